@@ -1,3 +1,5 @@
+import os
+import click
 from flask import Flask
 from flask_cors import CORS
 from flask_sqlalchemy import SQLAlchemy
@@ -15,8 +17,120 @@ def create_app():
     )
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False  # optional, disables overhead
 
+    # Connection pool shared by SQLAlchemy sessions in this process
+    app.config["DB_POOL_SIZE"] = int(os.getenv("DB_POOL_SIZE", "5"))
+    app.config["DB_MAX_OVERFLOW"] = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+    app.config["DB_POOL_TIMEOUT"] = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+    app.config["DB_POOL_PRE_PING"] = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+    app.config["DB_POOL_RECYCLE"] = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+    app.config["DB_STATEMENT_TIMEOUT_MS"] = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "30000"))
+    app.config["RAW_DB_POOL_MIN_SIZE"] = int(os.getenv("RAW_DB_POOL_MIN_SIZE", "1"))
+    app.config["RAW_DB_POOL_MAX_SIZE"] = int(os.getenv("RAW_DB_POOL_MAX_SIZE", "5"))
+    # Pool metrics are served only when enabled: the app has no auth in front of them
+    app.config["DB_POOL_METRICS_ENABLED"] = os.getenv("DB_POOL_METRICS_ENABLED", "false").lower() == "true"
+
+    from app.utils.db_pool import engine_options, instrument_engine, engine_metrics, raw_pool
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(
+        pool_size=app.config["DB_POOL_SIZE"],
+        max_overflow=app.config["DB_MAX_OVERFLOW"],
+        pool_timeout=app.config["DB_POOL_TIMEOUT"],
+        pool_pre_ping=app.config["DB_POOL_PRE_PING"],
+        pool_recycle=app.config["DB_POOL_RECYCLE"],
+        statement_timeout_ms=app.config["DB_STATEMENT_TIMEOUT_MS"],
+    )
+
     db.init_app(app)
 
+    # Creating the engine opens no connection; forked workers drop the inherited pool
+    with app.app_context():
+        instrument_engine(db.engine)
+
+    # Pooled psycopg2 connections for raw access (get_db_connection)
+    raw_pool.init_app(app)
+
+    if app.config["DB_POOL_METRICS_ENABLED"]:
+        @app.route("/metrics/db-pool", methods=["GET"])
+        def db_pool_metrics():
+            return {"sqlalchemy": engine_metrics(db.engine), "psycopg2": raw_pool.metrics()}
+
+    # Shared, connection-pooled LLM client used by every GPT route
+    app.config["LLM_TIMEOUT"] = float(os.getenv("LLM_TIMEOUT", "120"))
+    app.config["LLM_CONNECT_TIMEOUT"] = float(os.getenv("LLM_CONNECT_TIMEOUT", "10"))
+    app.config["LLM_MAX_CONNECTIONS"] = int(os.getenv("LLM_MAX_CONNECTIONS", "50"))
+    app.config["LLM_MAX_KEEPALIVE_CONNECTIONS"] = int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", "20"))
+    app.config["LLM_MAX_RETRIES"] = int(os.getenv("LLM_MAX_RETRIES", "2"))
+
+    # Response cache for routes that opt in; the disk tier is shared by all workers on the host
+    app.config["LLM_CACHE_ENABLED"] = os.getenv("LLM_CACHE_ENABLED", "true").lower() == "true"
+    app.config["LLM_CACHE_PATH"] = os.getenv(
+        "LLM_CACHE_PATH", os.path.join(app.instance_path, "llm_cache.sqlite3")
+    )
+    app.config["LLM_CACHE_TTL"] = int(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 3600)))
+    app.config["LLM_CACHE_MAX_DISK_BYTES"] = int(os.getenv("LLM_CACHE_MAX_DISK_BYTES", str(256 * 1024 * 1024)))
+
+    from app.utils.llm_gateway import llm
+    llm.init_app(app)
+
+    # Background compaction of old item versions, run periodically with `flask compact-history`
+    @app.cli.command("compact-history")
+    @click.option("--batch-size", default=500, show_default=True)
+    def compact_history(batch_size):
+        from app.utils.db_operations import compact_item_history
+
+        total = 0
+        while True:
+            compacted = compact_item_history(db.session, batch_size=batch_size)
+            if not compacted:
+                break
+            total += compacted
+        click.echo(f"Compacted {total} item versions")
+
+    # Background pruning of undo branches abandoned by later edits: `flask prune-history`
+    @app.cli.command("prune-history")
+    @click.option("--batch-size", default=200, show_default=True)
+    def prune_history(batch_size):
+        from app.utils.db_operations import prune_item_branches
+
+        total = 0
+        while True:
+            pruned = prune_item_branches(db.session, batch_size=batch_size)
+            if not pruned:
+                break
+            total += pruned
+        click.echo(f"Pruned abandoned versions of {total} items")
+
+    # Apply the SQL files in migrations/ that have not run yet: `flask migrate-db`
+    @app.cli.command("migrate-db")
+    @click.option("--mark-applied", default=None,
+                  help="Record versions up to this one (e.g. 0007) as applied without running them.")
+    def migrate_db(mark_applied):
+        from app.utils.migrations import apply_migrations
+
+        for name in apply_migrations(db.engine, mark_applied=mark_applied):
+            click.echo(f"Applied {name}")
+
+    # Fail when a hot query shape is no longer served by an index: `flask check-query-plans`
+    @app.cli.command("check-query-plans")
+    def check_plans():
+        from app.utils.query_plans import check_query_plans
+
+        failed = False
+        for name, uses_index, scans in check_query_plans(db.session):
+            click.echo(f"{'ok  ' if uses_index else 'FAIL'} {name}: {', '.join(scans) or 'no scan'}")
+            failed = failed or not uses_index
+        if failed:
+            raise SystemExit(1)
+
+    # Post-response work (requirement capture), spooled to local disk so it survives restarts
+    app.config["TASK_WORKERS"] = int(os.getenv("TASK_WORKERS", "1"))
+    app.config["TASK_MAX_ATTEMPTS"] = int(os.getenv("TASK_MAX_ATTEMPTS", "5"))
+    app.config["TASK_SPOOL_PATH"] = os.getenv(
+        "TASK_SPOOL_PATH", os.path.join(app.instance_path, "task_spool.sqlite3")
+    )
+
+    from app.utils.task_queue import task_queue
+    task_queue.init_app(app)
+
     # Import and register blueprints
     from routes.gpt import gpt_bp
 
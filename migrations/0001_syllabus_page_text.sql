@@ -0,0 +1,6 @@
+-- Text extracted from rendered syllabus pages, keyed by a SHA-256 of the page pixels
+-- and the extraction prompt, so re-uploaded pages are not sent to the model again.
+CREATE TABLE IF NOT EXISTS syllabus_page_text (
+    page_hash VARCHAR(64) PRIMARY KEY,
+    page_text TEXT
+);
@@ -0,0 +1,15 @@
+-- Next free order number of each test, so a batch of items reserves its block of
+-- order numbers with one UPDATE ... RETURNING instead of a MAX(order_number) scan per item.
+CREATE TABLE IF NOT EXISTS test_order_counters (
+    user_id VARCHAR(255) NOT NULL,
+    class_id VARCHAR(255) NOT NULL,
+    test_id VARCHAR(255) NOT NULL,
+    next_order INTEGER NOT NULL,
+    PRIMARY KEY (user_id, class_id, test_id)
+);
+
+INSERT INTO test_order_counters (user_id, class_id, test_id, next_order)
+SELECT user_id, class_id, test_id, COALESCE(MAX(order_number), 0) + 1
+FROM tests
+GROUP BY user_id, class_id, test_id
+ON CONFLICT (user_id, class_id, test_id) DO NOTHING;
@@ -0,0 +1,28 @@
+-- tests.order_number now holds sparse ranks instead of dense positions: items are 1024 apart
+-- (ORDER_GAP) so inserts and moves take a rank between two neighbours and write a single row.
+-- Clients still see dense 1..n positions, computed when items are read.
+UPDATE tests
+SET order_number = ranked.position * 1024
+FROM (
+    SELECT user_id, class_id, test_id, item_id,
+           ROW_NUMBER() OVER (
+               PARTITION BY user_id, class_id, test_id
+               ORDER BY COALESCE(order_number, 0), item_id
+           ) AS position
+    FROM tests
+) AS ranked
+WHERE tests.user_id = ranked.user_id
+  AND tests.class_id = ranked.class_id
+  AND tests.test_id = ranked.test_id
+  AND tests.item_id = ranked.item_id;
+
+UPDATE test_order_counters
+SET next_order = counts.next_order
+FROM (
+    SELECT user_id, class_id, test_id, (COUNT(*) + 1) * 1024 AS next_order
+    FROM tests
+    GROUP BY user_id, class_id, test_id
+) AS counts
+WHERE test_order_counters.user_id = counts.user_id
+  AND test_order_counters.class_id = counts.class_id
+  AND test_order_counters.test_id = counts.test_id;
@@ -0,0 +1,23 @@
+-- Next free numeric suffix of each class's topic ("topic_<n>") and skill ("skill_<n>") ids,
+-- so new ids are reserved in blocks instead of found with ORDER BY topic_id DESC LIMIT 1.
+CREATE TABLE IF NOT EXISTS class_id_counters (
+    user_id VARCHAR(255) NOT NULL,
+    class_id VARCHAR(255) NOT NULL,
+    kind VARCHAR(50) NOT NULL,
+    next_id INTEGER NOT NULL,
+    PRIMARY KEY (user_id, class_id, kind)
+);
+
+INSERT INTO class_id_counters (user_id, class_id, kind, next_id)
+SELECT user_id, class_id, 'topic',
+       COALESCE(MAX(CAST(SUBSTRING(topic_id FROM '^topic_([0-9]+)$') AS INTEGER)), -1) + 1
+FROM item_topics
+GROUP BY user_id, class_id
+ON CONFLICT (user_id, class_id, kind) DO NOTHING;
+
+INSERT INTO class_id_counters (user_id, class_id, kind, next_id)
+SELECT user_id, class_id, 'skill',
+       COALESCE(MAX(CAST(SUBSTRING(skill_id FROM '^skill_([0-9]+)$') AS INTEGER)), -1) + 1
+FROM item_skills
+GROUP BY user_id, class_id
+ON CONFLICT (user_id, class_id, kind) DO NOTHING;
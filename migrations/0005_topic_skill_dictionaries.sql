@@ -0,0 +1,118 @@
+-- Topic and skill names move into class-scoped dictionaries; item_topics and item_skills
+-- become link tables holding only integer ids, so a new item version no longer repeats every
+-- name and topic/skill filters are integer index lookups.
+BEGIN;
+
+-- topics: one row per distinct topic name of a class, with an integer id from class_id_counters.
+CREATE TABLE IF NOT EXISTS topics (
+    user_id VARCHAR(255) NOT NULL,
+    class_id VARCHAR(255) NOT NULL,
+    topic_id INTEGER NOT NULL,
+    name VARCHAR(255) NOT NULL,
+    PRIMARY KEY (user_id, class_id, topic_id),
+    UNIQUE (user_id, class_id, name)
+);
+
+INSERT INTO topics (user_id, class_id, topic_id, name)
+SELECT user_id, class_id,
+       ROW_NUMBER() OVER (PARTITION BY user_id, class_id ORDER BY MIN(topic_id), topic_name) - 1,
+       topic_name
+FROM item_topics
+WHERE topic_name IS NOT NULL
+GROUP BY user_id, class_id, topic_name
+ON CONFLICT DO NOTHING;
+
+-- item_topics keeps only the integer id of each linked name
+ALTER TABLE item_topics ADD COLUMN topic_ref INTEGER;
+
+UPDATE item_topics
+SET topic_ref = d.topic_id
+FROM topics AS d
+WHERE d.user_id = item_topics.user_id
+  AND d.class_id = item_topics.class_id
+  AND d.name = item_topics.topic_name;
+
+DELETE FROM item_topics WHERE topic_ref IS NULL;
+
+-- The same name linked twice to one item version collapses to one row
+DELETE FROM item_topics AS a
+USING item_topics AS b
+WHERE a.user_id = b.user_id
+  AND a.class_id = b.class_id
+  AND a.item_id = b.item_id
+  AND a.version = b.version
+  AND a.topic_ref = b.topic_ref
+  AND a.ctid > b.ctid;
+
+ALTER TABLE item_topics DROP CONSTRAINT item_topics_pkey;
+ALTER TABLE item_topics DROP COLUMN topic_id;
+ALTER TABLE item_topics DROP COLUMN topic_name;
+ALTER TABLE item_topics RENAME COLUMN topic_ref TO topic_id;
+ALTER TABLE item_topics ALTER COLUMN topic_id SET NOT NULL;
+ALTER TABLE item_topics ADD PRIMARY KEY (user_id, class_id, item_id, version, topic_id);
+
+CREATE INDEX IF NOT EXISTS item_topics_topic_idx ON item_topics (user_id, class_id, topic_id);
+
+INSERT INTO class_id_counters (user_id, class_id, kind, next_id)
+SELECT user_id, class_id, 'topic', MAX(topic_id) + 1
+FROM topics
+GROUP BY user_id, class_id
+ON CONFLICT (user_id, class_id, kind) DO UPDATE SET next_id = EXCLUDED.next_id;
+
+-- skills: one row per distinct skill name of a class, with an integer id from class_id_counters.
+CREATE TABLE IF NOT EXISTS skills (
+    user_id VARCHAR(255) NOT NULL,
+    class_id VARCHAR(255) NOT NULL,
+    skill_id INTEGER NOT NULL,
+    name VARCHAR(255) NOT NULL,
+    PRIMARY KEY (user_id, class_id, skill_id),
+    UNIQUE (user_id, class_id, name)
+);
+
+INSERT INTO skills (user_id, class_id, skill_id, name)
+SELECT user_id, class_id,
+       ROW_NUMBER() OVER (PARTITION BY user_id, class_id ORDER BY MIN(skill_id), skill_name) - 1,
+       skill_name
+FROM item_skills
+WHERE skill_name IS NOT NULL
+GROUP BY user_id, class_id, skill_name
+ON CONFLICT DO NOTHING;
+
+-- item_skills keeps only the integer id of each linked name
+ALTER TABLE item_skills ADD COLUMN skill_ref INTEGER;
+
+UPDATE item_skills
+SET skill_ref = d.skill_id
+FROM skills AS d
+WHERE d.user_id = item_skills.user_id
+  AND d.class_id = item_skills.class_id
+  AND d.name = item_skills.skill_name;
+
+DELETE FROM item_skills WHERE skill_ref IS NULL;
+
+-- The same name linked twice to one item version collapses to one row
+DELETE FROM item_skills AS a
+USING item_skills AS b
+WHERE a.user_id = b.user_id
+  AND a.class_id = b.class_id
+  AND a.item_id = b.item_id
+  AND a.version = b.version
+  AND a.skill_ref = b.skill_ref
+  AND a.ctid > b.ctid;
+
+ALTER TABLE item_skills DROP CONSTRAINT item_skills_pkey;
+ALTER TABLE item_skills DROP COLUMN skill_id;
+ALTER TABLE item_skills DROP COLUMN skill_name;
+ALTER TABLE item_skills RENAME COLUMN skill_ref TO skill_id;
+ALTER TABLE item_skills ALTER COLUMN skill_id SET NOT NULL;
+ALTER TABLE item_skills ADD PRIMARY KEY (user_id, class_id, item_id, version, skill_id);
+
+CREATE INDEX IF NOT EXISTS item_skills_skill_idx ON item_skills (user_id, class_id, skill_id);
+
+INSERT INTO class_id_counters (user_id, class_id, kind, next_id)
+SELECT user_id, class_id, 'skill', MAX(skill_id) + 1
+FROM skills
+GROUP BY user_id, class_id
+ON CONFLICT (user_id, class_id, kind) DO UPDATE SET next_id = EXCLUDED.next_id;
+
+COMMIT;
@@ -0,0 +1,7 @@
+-- item_history rows can be stored compacted: "packed" (zlib-compressed snapshot) or "delta"
+-- (zlib-compressed edit script against base_version). Existing rows stay "full" until
+-- `flask compact-history` rewrites the ones that are no longer current.
+ALTER TABLE item_history ADD COLUMN IF NOT EXISTS storage VARCHAR(16) NOT NULL DEFAULT 'full';
+ALTER TABLE item_history ADD COLUMN IF NOT EXISTS base_version INTEGER;
+ALTER TABLE item_history ADD COLUMN IF NOT EXISTS delta_depth INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE item_history ADD COLUMN IF NOT EXISTS payload BYTEA;
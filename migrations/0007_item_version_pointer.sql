@@ -0,0 +1,11 @@
+-- Undo and redo move item_current.version between versions instead of deleting history.
+-- parent_version records which version each one was edited from; latest_version keeps new
+-- edits from reusing the number of an undone version; prune_pending marks items with
+-- abandoned branches for `flask prune-history`.
+ALTER TABLE item_history ADD COLUMN IF NOT EXISTS parent_version INTEGER;
+ALTER TABLE item_current ADD COLUMN IF NOT EXISTS latest_version INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE item_current ADD COLUMN IF NOT EXISTS prune_pending BOOLEAN NOT NULL DEFAULT FALSE;
+
+-- Until now undo deleted the undone version, so history is a straight line
+UPDATE item_history SET parent_version = version - 1 WHERE version > 0 AND parent_version IS NULL;
+UPDATE item_current SET latest_version = COALESCE(version, 0);
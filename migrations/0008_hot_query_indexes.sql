@@ -0,0 +1,39 @@
+-- Indexes for the query shapes the primary keys do not serve. `flask check-query-plans`
+-- EXPLAINs each of these queries and fails when one of them stops using an index.
+
+-- Items of a test in rank order (fetch_by_test_id, order positions, rank neighbours) and all
+-- of a user's items in (class, test, rank) order (fetch_by_user_id). Queries order by
+-- COALESCE(order_number, 0), item_id, so the index is on the same expression.
+CREATE INDEX IF NOT EXISTS tests_rank_idx
+    ON tests (user_id, class_id, test_id, (COALESCE(order_number, 0)), item_id);
+
+-- Items linked to a topic or skill of a class, answered from the index alone
+DROP INDEX IF EXISTS item_topics_topic_idx;
+CREATE INDEX item_topics_topic_idx
+    ON item_topics (user_id, class_id, topic_id) INCLUDE (item_id, version);
+
+DROP INDEX IF EXISTS item_skills_skill_idx;
+CREATE INDEX item_skills_skill_idx
+    ON item_skills (user_id, class_id, skill_id) INCLUDE (item_id, version);
+
+-- select_requirements looks a requirement up without its class and test
+CREATE INDEX IF NOT EXISTS requirements_user_req_idx
+    ON requirements (user_id, req_id);
+
+-- Redo: newest version edited from the current one
+CREATE INDEX IF NOT EXISTS item_history_parent_idx
+    ON item_history (user_id, class_id, item_id, parent_version, version);
+
+-- Work queues of `flask compact-history` and `flask prune-history`
+CREATE INDEX IF NOT EXISTS item_history_full_idx
+    ON item_history (user_id, class_id, item_id, version) WHERE storage = 'full';
+
+CREATE INDEX IF NOT EXISTS item_current_prune_idx
+    ON item_current (user_id, class_id, item_id) WHERE prune_pending;
+
+ANALYZE tests;
+ANALYZE item_topics;
+ANALYZE item_skills;
+ANALYZE requirements;
+ANALYZE item_history;
+ANALYZE item_current;
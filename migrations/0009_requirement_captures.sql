@@ -0,0 +1,9 @@
+-- One row per requirement capture task that has taken effect, keyed on the req_id the route
+-- generated for it. The row commits together with the requirement it saved or the usage count
+-- it raised, so a retried task can tell it already ran.
+CREATE TABLE IF NOT EXISTS requirement_captures (
+    user_id VARCHAR(255) NOT NULL,
+    capture_id VARCHAR(255) NOT NULL,
+    captured_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    PRIMARY KEY (user_id, capture_id)
+);
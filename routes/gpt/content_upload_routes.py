@@ -7,27 +7,24 @@ from flask import jsonify, request, make_response
 from .gpt_blueprint import gpt_bp
 from sqlalchemy import text
 from app import db
-import openai
 import os
 import json
 import uuid
 import yaml
 from PIL import Image
-import base64
-from io import BytesIO
-from pdf2image import convert_from_bytes
+import hashlib
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from itertools import islice
 from models import ExtractedQuestion
 from ...utils.class_info import get_class_info
 from ...utils.db_operations import (
-    fetch_next_order_number, 
-    fetch_highest_topic_id,
-    fetch_highest_skill_id,
-    insert_item_current, 
-    insert_item_history, 
-    select_unique_class, 
-    insert_item_skills, 
-    insert_tests,
-    insert_item_topics)
+    reserve_order_numbers, 
+    ItemBatchWriter,
+    fetch_page_texts,
+    insert_page_texts)
+from ...utils.llm_gateway import llm
+from ...utils.image_payload import encode_image_data_url
+from ...utils.pdf_pages import iter_pdf_pages, iter_uploaded_images, PDF_RENDER_WINDOW
 from ...utils.testconvert import normalize_pdf_images_to_summary
 from werkzeug.utils import secure_filename
 
@@ -36,6 +33,102 @@ config_path = os.path.join(os.path.dirname(__file__), "../../utils/config.yaml")
 with open(config_path, "r", encoding="utf-8") as f:
     config = yaml.safe_load(f)
 
+# Maximum number of syllabus pages sent to the model at the same time
+SYLLABUS_OCR_CONCURRENCY = int(os.getenv("SYLLABUS_OCR_CONCURRENCY", "8"))
+
+SYLLABUS_OCR_PROMPT = "You are an assistant that extracts all readable text from images of curriculum guides. Extract text from this page of a curriculum guide. Do not make up content. If the text is logistic related and not academically related and not centered around the curriculum do not include it. Preserve formatting when helpful."
+
+
+def _extract_page_text(page_number, img):
+    """
+    Extract the text of one syllabus page with GPT-4o vision.
+
+    Returns:
+        str: the page text, or None if the page could not be processed
+    """
+    image_url = encode_image_data_url(img, kind="document")
+
+    try:
+        return llm.read_image(SYLLABUS_OCR_PROMPT, image_url, model="gpt-4o")
+    except Exception as e:
+        print(f"Failed to process image {page_number}: {e}")
+        return None
+
+
+def _page_hash(img):
+    """
+    Content hash of a rendered page, combined with the extraction prompt so prompt changes re-extract.
+    """
+    digest = hashlib.sha256()
+    digest.update(SYLLABUS_OCR_PROMPT.encode("utf-8"))
+    digest.update(f"{img.mode}:{img.size[0]}x{img.size[1]}".encode("utf-8"))
+    digest.update(img.tobytes())
+    return digest.hexdigest()
+
+
+def _extract_pages_text(pages):
+    """
+    Extract the text of every syllabus page as pages arrive from the rasterizer.
+
+    Pages are consumed one window at a time; pages seen in an earlier upload are read from
+    syllabus_page_text and the rest are sent to the model with at most
+    SYLLABUS_OCR_CONCURRENCY calls in flight, so only a bounded number of pages is held
+    in memory regardless of page count. Pages are reassembled in page order; pages that
+    fail are skipped.
+    """
+    concurrency = max(1, SYLLABUS_OCR_CONCURRENCY)
+    page_hashes = []
+    page_texts = {}
+    new_texts = {}
+    in_flight = {}
+    reused = 0
+
+    def collect(done):
+        for future in done:
+            page_number = in_flight.pop(future)
+            page_text = future.result()
+            if page_text is not None:
+                new_texts[page_hashes[page_number - 1]] = page_text
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        while True:
+            window = list(islice(pages, PDF_RENDER_WINDOW))
+            if not window:
+                break
+
+            first_page_number = len(page_hashes) + 1
+            window_hashes = [_page_hash(img) for img in window]
+            page_hashes.extend(window_hashes)
+            page_texts.update(fetch_page_texts(db.session, set(window_hashes)))
+
+            for page_number, (img, page_hash) in enumerate(zip(window, window_hashes), start=first_page_number):
+                if page_hash in page_texts:
+                    reused += 1
+                    continue
+
+                # Wait for a free slot so pending pages cannot pile up in memory
+                if len(in_flight) >= concurrency:
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    collect(done)
+
+                in_flight[executor.submit(_extract_page_text, page_number, img)] = page_number
+
+            del window
+
+        collect(wait(in_flight).done)
+
+    print(f"{reused} of {len(page_hashes)} syllabus pages already extracted")
+    insert_page_texts(db.session, new_texts)
+    page_texts.update(new_texts)
+
+    full_text = ""
+    for page_number, page_hash in enumerate(page_hashes, start=1):
+        page_text = page_texts.get(page_hash)
+        if page_text is None:
+            continue
+        full_text += f"\n\n--- Page {page_number} ---\n\n" + page_text
+
+    return full_text
 
 
 @gpt_bp.route("/process_syllabus", methods=["POST"])
@@ -80,52 +173,19 @@ def process_syllabus():
             400,
         )
 
-    client = openai.OpenAI()
-
-    full_text = ""
-    images = []
 
+    # Pages are rendered lazily and consumed by the extraction stage as they are produced
     if len(files) == 1 and files[0].filename.lower().endswith(".pdf"):
-        try:
-            files[0].seek(0)
-            images = convert_from_bytes(files[0].read())
-        except Exception as e:
-            return jsonify({"error": f"Failed to convert PDF to images: {str(e)}"}), 500
+        pages = iter_pdf_pages(files[0])
+        read_error = "Failed to convert PDF to images"
     else:
-        try:
-            for f in files:
-                img = Image.open(f.stream).convert("RGB")
-                images.append(img)
-        except Exception as e:
-            return jsonify({"error": f"Failed to read images: {str(e)}"}), 500
+        pages = iter_uploaded_images(files)
+        read_error = "Failed to read images"
 
-    for i, img in enumerate(images):
-        buffered = BytesIO()
-        img.save(buffered, format="PNG")
-        img_base64 = base64.b64encode(buffered.getvalue()).decode("utf-8")
-        image_url = f"data:image/png;base64,{img_base64}"
-
-        try:
-            response = client.chat.completions.create(
-                model="gpt-4o",
-                messages=[
-                    {
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "text",
-                                "text": "You are an assistant that extracts all readable text from images of curriculum guides. Extract text from this page of a curriculum guide. Do not make up content. If the text is logistic related and not academically related and not centered around the curriculum do not include it. Preserve formatting when helpful.",
-                            },
-                            {"type": "image_url", "image_url": {"url": image_url}},
-                        ],
-                    },
-                ],
-            )
-            page_text = response.choices[0].message.content
-            full_text += f"\n\n--- Page {i+1} ---\n\n" + page_text
-        except Exception as e:
-            print(f"Failed to process image {i + 1}: {e}")
-            continue
+    try:
+        full_text = _extract_pages_text(pages)
+    except Exception as e:
+        return jsonify({"error": f"{read_error}: {str(e)}"}), 500
 
     prompt_template = config["prompts"]["syllabus_single_question_generation_looped"]
 
@@ -143,15 +203,8 @@ def process_syllabus():
         )
 
         try:
-            response = client.responses.parse(
-                model=config["gpt_model"]["engine"],
-                input=rendered_prompt,
-                text_format=ExtractedQuestion,
-                reasoning={"effort": config["gpt_model"]["reasoning"]},
-                text={"verbosity": config["gpt_model"]["verbosity"]},
-            )
+            result = llm.parse(rendered_prompt, ExtractedQuestion)
 
-            result = response.output[1].content[0].parsed
             if result.questions:
                 item = result.questions[0]
                 item.item_id = str(uuid.uuid4())
@@ -164,33 +217,14 @@ def process_syllabus():
 
     inserted_items = []
 
-    # Select highest topic_id
-    highest_topic_result = fetch_highest_topic_id(db.session, userid, classid)
-    # Select highest skill_id
-    highest_skill_result = fetch_highest_skill_id(db.session, userid, classid)
-
-    def get_next_id(current_id, prefix):
-        if not current_id:
-            return f"{prefix}_0"
-        try:
-            num = int(current_id.split("_")[1])
-            return f"{prefix}_{num + 1}"
-        except (IndexError, ValueError):
-            return f"{prefix}_0"
+    version = 0
 
-    current_topic_id = get_next_id(
-        highest_topic_result, "topic"
-    )
-    current_skill_id = get_next_id(
-        highest_skill_result if highest_skill_result else None, "skill"
+    # Reserve the order slots of the whole batch up front
+    order_ranks, positions = reserve_order_numbers(
+        db.session, userid, classid, test_id, len(generated), order_number
     )
 
-    version = 0
-
-    if order_number is not None:
-        fetch_next_order_number(
-            db.session, userid, classid, test_id, order_number, num_mcq + num_frq
-        )
+    writer = ItemBatchWriter(db.session, userid, classid, test_id)
 
     try:
         for idx, item_response in enumerate(generated):
@@ -213,38 +247,21 @@ def process_syllabus():
             else:
                 answer_part = item_response.answer_part
 
-            # Insert into item_current
-            insert_item_current(db.session, userid, classid, item_id, version)
-
-            # Check if class is unique and insert if does not exist
-            select_unique_class(db.session, userid, classid)
-
-            # Insert into item_history
-            insert_item_history(db.session, userid, classid, item_id, version, question, answer_part, question_type, difficulty, wrong_answer_explanation)
-
-            if idx == 0 and order_number is not None:
-                current_order = order_number
-            elif order_number is not None:
-                current_order = order_number + idx
-            else:
-                current_order = fetch_next_order_number(
-                    db.session, userid, classid, test_id
-                )
-
-            # Insert into tests
-            insert_tests(db.session, userid, classid, test_id, item_id, current_order)
-
-            # Insert into item_topics
-            for topic_name in item_response.relatedtopics:
-                topic_id = get_next_id(current_topic_id, "topic")
-                current_topic_id = topic_id
-                insert_item_topics(db.session, userid, classid, item_id, version, topic_id, topic_name)
-
-            # Insert into item_skills
-            for skill_name in item_response.relatedskills:
-                skill_id = get_next_id(current_skill_id, "skill")
-                current_skill_id = skill_id
-                insert_item_skills(db.session, userid, classid, item_id, version, skill_id, skill_name)
+            current_order = positions[idx]
+
+            # Queue item_current, item_history, tests, item_topics and item_skills rows
+            writer.add_item(
+                item_id,
+                question,
+                answer_part,
+                question_type,
+                difficulty,
+                wrong_answer_explanation,
+                topics=item_response.relatedtopics,
+                skills=item_response.relatedskills,
+                order_number=order_ranks[idx],
+                version=version,
+            )
 
             inserted_items.append(
                 {
@@ -258,6 +275,7 @@ def process_syllabus():
                 }
             )
 
+        writer.flush()
         db.session.commit()
         return (
             jsonify(
@@ -317,18 +335,11 @@ def pdf_upload():
     if is_images:
         print(f"Received {len(files)} image(s)")
         all_questions = []
-        client = openai.OpenAI()
         for idx, img_file in enumerate(files):
-            img = Image.open(img_file.stream).convert("RGB")
-            buffered = BytesIO()
-            img.save(buffered, format="PNG")
-            img_base64 = base64.b64encode(buffered.getvalue()).decode("utf-8")
-            image_url = f"data:image/png;base64,{img_base64}"
-
             try:
-                response = client.responses.parse(
-                    model=config["gpt_model"]["engine"],
-                    input=[
+                image_url = encode_image_data_url(Image.open(img_file.stream), kind="document")
+                result = llm.parse(
+                    [
                         {
                             "role": "user",
                             "content": [
@@ -343,11 +354,8 @@ def pdf_upload():
                             ]
                         }
                     ],
-                    text_format=ExtractedQuestion,
-                    reasoning={"effort": config["gpt_model"]["reasoning"]},
-                    text={"verbosity": config["gpt_model"]["verbosity"]},
+                    ExtractedQuestion,
                 )
-                result = response.output[1].content[0].parsed
                 questions = result.questions
                 all_questions.extend(questions)
             except Exception as e:
@@ -365,33 +373,14 @@ def pdf_upload():
 
     total_questions = len(all_questions)
 
-    # Get next topic/skill IDs
-    def get_next_id(current_id, prefix):
-        if not current_id:
-            return f"{prefix}_0"
-        try:
-            num = int(current_id.split("_")[1])
-            return f"{prefix}_{num + 1}"
-        except (IndexError, ValueError):
-            return f"{prefix}_0"
-
-    # Fetch highest topic ID
-    highest_topic_result = fetch_highest_topic_id(db.session, userid, classid)
-    # Fetch highest skill ID
-    highest_skill_result = fetch_highest_skill_id(db.session, userid, classid)
-
-    current_topic_id = get_next_id(
-        highest_topic_result if highest_topic_result else None, "topic"
-    )
-    current_skill_id = get_next_id(
-        highest_skill_result if highest_skill_result else None, "skill"
-    )
     version = 0
 
-    if order_number is not None:
-        fetch_next_order_number(
-            db.session, userid, classid, test_id, order_number, total_questions
-        )
+    # Reserve the order slots of the whole batch up front
+    order_ranks, _ = reserve_order_numbers(
+        db.session, userid, classid, test_id, total_questions, order_number
+    )
+
+    writer = ItemBatchWriter(db.session, userid, classid, test_id)
 
     for i, item in enumerate(all_questions):
         question_type = item.format
@@ -413,45 +402,27 @@ def pdf_upload():
         else:
             answer_part = item.answer_part
 
-        try:
-            select_unique_class(db.session, userid, classid)
-       
-            # Insert into item_current
-            insert_item_current(db.session, userid, classid, item_id, version)
-
-            # Insert into item_history
-            insert_item_history(db.session, userid, classid, item_id, version, question, answer_part, question_type, difficulty, wrong_answer_explanation)
-
-            if i == 0 and order_number is not None:
-                current_order = order_number
-            elif order_number is not None:
-                current_order = order_number + i
-            else:
-                current_order = fetch_next_order_number(
-                    db.session, userid, classid, test_id
-                )
-
-            # Insert into tests
-            insert_tests(db.session, userid, classid, test_id, item_id, current_order)
-
-            # Insert into item_topics
-            for topic_name in item.relatedtopics:
-                topic_id = get_next_id(current_topic_id, "topic")
-                current_topic_id = topic_id
-                insert_item_topics(db.session, userid, classid, item_id, version, topic_id, topic_name)
-
-            # Insert into item_skills
-            for skill_name in item.relatedskills:
-                skill_id = get_next_id(current_skill_id, "skill")
-                current_skill_id = skill_id
-                insert_item_skills(db.session, userid, classid, item_id, version, skill_id, skill_name)
-
-            db.session.commit()
+        # Queue item_current, item_history, tests, item_topics and item_skills rows
+        writer.add_item(
+            item_id,
+            question,
+            answer_part,
+            question_type,
+            difficulty,
+            wrong_answer_explanation,
+            topics=item.relatedtopics,
+            skills=item.relatedskills,
+            order_number=order_ranks[i],
+            version=version,
+        )
 
-        except Exception as e:
-            db.session.rollback()
-            print(f"Error inserting item {i+1}: {e}")
-            continue
+    # Write every extracted question in one transaction
+    try:
+        writer.flush()
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"error": "Failed to insert questions", "detail": str(e)}), 500
 
     return (
         jsonify({"message": "All questions added successfully.", "test_id": test_id}),
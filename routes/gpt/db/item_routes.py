@@ -1,21 +1,47 @@
 # Filename: item_routes.py
 # Description: Defines routes for item (question) management.
 
-from flask import request, jsonify
+from flask import request, jsonify, Response, stream_with_context
 from sqlalchemy import select, func
 from app import db
+import base64
+import json
+import os
 import uuid
 from flask import make_response
 from .db_blueprint import db_bp
-from app.utils.db_operations import add_to_database, fetch_item_data, fetch_item_latest_version
+from app.utils.db_operations import (
+    add_to_database,
+    fetch_item_data,
+    fetch_items_data,
+    fetch_item_latest_version,
+    select_user_items,
+    hydrate_user_items,
+    iter_user_items,
+    place_order_numbers,
+    fetch_parent_version,
+    undo_item_version,
+    redo_item_version,
+    intern_names_many,
+    bump_item_version,
+    insert_item_version,
+    copy_items,
+    copy_test,
+)
+from app.utils.item_cache import item_cache
 from ....utils.table_models import (
     Tests,
     ItemCurrent,
     ItemHistory,
     ItemTopics,
     ItemSkills,
+    UserTests,
 )
 
+# Page size used by fetch_by_user_id when paging without a limit, and its chunk size otherwise
+ITEMS_PAGE_SIZE = int(os.getenv("ITEMS_PAGE_SIZE", "200"))
+ITEMS_MAX_PAGE_SIZE = int(os.getenv("ITEMS_MAX_PAGE_SIZE", "1000"))
+
 ################
 # Fetch Methods
 ################
@@ -28,40 +54,41 @@ def fetch_by_test_id(userid, classid, testid):
     """Fetch items and all related data by test ID."""
     
     try:
-        # Step 1: Fetch the item_id and order_number from the tests table
-        test_results = select(Tests.item_id, Tests.order_number).filter(
-            Tests.user_id == userid,
-            Tests.class_id == classid,
-            Tests.test_id == testid
-        ).order_by(Tests.order_number.asc())
+        # Step 1: Fetch the item_id, order_number and current version of every item in the test
+        test_results = (
+            select(Tests.item_id, Tests.order_number, ItemCurrent.version)
+            .join(
+                ItemCurrent,
+                (ItemCurrent.user_id == Tests.user_id)
+                & (ItemCurrent.class_id == Tests.class_id)
+                & (ItemCurrent.item_id == Tests.item_id),
+            )
+            .filter(
+                Tests.user_id == userid,
+                Tests.class_id == classid,
+                Tests.test_id == testid
+            )
+            .order_by(func.coalesce(Tests.order_number, 0), Tests.item_id)
+        )
 
         test_exists = db.session.execute(test_results).all()
         if not test_exists:
             return jsonify({"message": "No items in this test"}), 200
-        
-        # Store both item_id and order_number in a dictionary for quick lookup
-        item_order_map = {item[0]: item[1] for item in test_exists}
-        item_id_list = list(item_order_map.keys())
-
-        # Step 2: Fetch the version from the item_current table
-        current_version_stmt = select(ItemCurrent.item_id, ItemCurrent.version).filter(
-            ItemCurrent.user_id == userid,
-            ItemCurrent.class_id == classid,
-            ItemCurrent.item_id.in_(item_id_list)
+
+        # Step 2: Load every item version with one query per table
+        item_map = fetch_items_data(
+            db.session, userid, [(classid, item_id, version) for item_id, _, version in test_exists]
         )
-        version_results = db.session.execute(current_version_stmt).all()
-        version_map = {item_id: version for item_id, version in version_results}
-        if not version_results:
-            return jsonify({"message": "Item not found in item_current table"}), 404
 
-        # Step 3: Fetch item data from the item_history table using version
+        # Step 3: Assemble the items in test order, numbering them 1..n
         all_items = []
-        for item_id in item_id_list: 
-            version = version_map.get(item_id)
-            
-            item_data = fetch_item_data(userid, classid, item_id, version)
+        for position, (item_id, _, version) in enumerate(test_exists, start=1):
+            item_data = item_map.get((classid, item_id, version))
+            if item_data is None:
+                continue
+
             item_data['test_id'] = testid
-            item_data['order_number'] = item_order_map.get(item_id)
+            item_data['order_number'] = position
             item_data['topics'] = item_data.pop('relatedtopics')
             item_data['skills'] = item_data.pop('relatedskills')
             all_items.append(item_data)
@@ -69,8 +96,6 @@ def fetch_by_test_id(userid, classid, testid):
         if not all_items:
             return jsonify({"message": "No item history found for the specified items"}), 404
 
-        # Return the collected data sorted by order_number
-        all_items.sort(key=lambda x: x['order_number'])
         return {
             "message": "Data fetched successfully",
             "items": all_items,
@@ -85,65 +110,79 @@ def fetch_by_test_id(userid, classid, testid):
     methods=["GET"],
 )
 def fetch_by_user_id(userid):
-    """Fetch items and all related data by test ID."""
-    
+    """
+    Fetch a user's items and all related data.
+
+    Every item is returned unless one of the query args asks for pages or a stream.
+
+    Query args:
+        limit (int, optional): Page size, defaults to ITEMS_PAGE_SIZE.
+        cursor (str, optional): next_cursor from the previous page.
+        stream (bool, optional): Stream every item after cursor as NDJSON instead of a page.
+    """
+    paged = any(arg in request.args for arg in ("limit", "cursor", "stream"))
+
     try:
-        # Step 1: Fetch the item_id and order_number from for all user's tests
-        test_results = select(Tests.item_id, Tests.order_number, Tests.test_id, Tests.class_id).filter(
-            Tests.user_id == userid,
-        ).order_by(Tests.order_number.asc())
+        after = _decode_cursor(request.args.get("cursor"))
+        limit = min(int(request.args.get("limit", ITEMS_PAGE_SIZE)), ITEMS_MAX_PAGE_SIZE)
+        if limit <= 0:
+            raise ValueError("limit must be positive")
+    except (ValueError, TypeError) as e:
+        return jsonify({"message": f"Invalid pagination arguments: {str(e)}"}), 400
 
-        test_exists = db.session.execute(test_results).all()
-        if not test_exists:
+    try:
+        if request.args.get("stream", "").lower() in ("1", "true", "yes"):
+            def generate():
+                for item in iter_user_items(db.session, userid, after=after, chunk_size=limit):
+                    yield json.dumps(item) + "\n"
+
+            return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+        if not paged:
+            # Whole collection, still loaded ITEMS_PAGE_SIZE rows at a time
+            all_items = list(iter_user_items(db.session, userid, chunk_size=limit))
+            if not all_items:
+                return jsonify({"message": "No items in this test"}), 200
+
+            return {
+                "message": "Data fetched successfully",
+                "items": all_items,
+            }, 200
+
+        # Fetch one page of items (plus their current version) for all user's tests
+        rows = db.session.execute(select_user_items(userid, after=after, limit=limit)).all()
+        if not rows and after is None:
             return jsonify({"message": "No items in this test"}), 200
-        
-        # Store both item_id and order_number in a dictionary for quick lookup
-        item_details = {
-            item_id: {'order_number': order_num, 'test_id': test_id, 'class_id': class_id}
-            for item_id, order_num, test_id, class_id in test_exists
-        }
-        item_id_list = list(item_details.keys())
 
-        # Step 2: Fetch the version from the item_current table
-        current_version_stmt = select(ItemCurrent.item_id, ItemCurrent.version).filter(
-            ItemCurrent.user_id == userid,
-            ItemCurrent.item_id.in_(item_id_list)
-        )
-        version_results = db.session.execute(current_version_stmt).all()
-        version_map = {item_id: version for item_id, version in version_results}
-        if not version_results:
-            return jsonify({"message": "Item not found in item_current table"}), 404
-
-        # Step 3: Fetch item data for each item's current version
-        all_items = []
-        for item_id in item_id_list: 
-            version = version_map.get(item_id)
-            details = item_details.get(item_id)
-            classid = details['class_id']
-            
-            item_data = fetch_item_data(userid, classid, item_id, version)
-            item_data["class_id"] = classid
-            item_data["item_id"] = item_id
-            item_data['test_id'] = details['test_id']
-            item_data['order_number'] = details['order_number']
-            item_data['topics'] = item_data.pop('relatedtopics')
-            item_data['skills'] = item_data.pop('relatedskills')
-            all_items.append(item_data)
+        all_items = hydrate_user_items(db.session, userid, rows)
 
-        if not all_items:
-            return jsonify({"message": "No item history found for the specified items"}), 404
+        # A full page means there may be more rows after the last one
+        next_cursor = _encode_cursor(rows[-1][:4]) if len(rows) == limit else None
 
-        # Return the collected data sorted by order_number
-        all_items.sort(key=lambda x: x['order_number'])
         return {
             "message": "Data fetched successfully",
             "items": all_items,
+            "next_cursor": next_cursor,
         }, 200
 
     except Exception as e:
         return f"Connection failed: {str(e)}", 500
 
 
+def _encode_cursor(key):
+    """Encode a (class_id, test_id, order_number, item_id) keyset position as an opaque token."""
+    return base64.urlsafe_b64encode(json.dumps(list(key)).encode("utf-8")).decode("ascii")
+
+
+def _decode_cursor(token):
+    """Decode a token from _encode_cursor, or return None when no token was given."""
+    if not token:
+        return None
+
+    class_id, test_id, order_number, item_id = json.loads(base64.urlsafe_b64decode(token.encode("ascii")))
+    return (class_id, test_id, int(order_number), item_id)
+
+
 @db_bp.route("/fetch-last-version-of-item", methods=["POST"])
 def fetch_last_version_of_item():
     """
@@ -158,16 +197,9 @@ def fetch_last_version_of_item():
     itemid = data["itemid"]
 
     try:
-        # Get the max version (current version)
-        max_version_stmt = select(func.max(ItemHistory.version)).filter(
-            ItemHistory.user_id == userid,
-            ItemHistory.class_id == classid,
-            ItemHistory.item_id == itemid
-        )
-        max_version = db.session.execute(max_version_stmt).scalar()
-        
-        # Calculate the previous version
-        previous_version = max_version - 1 if max_version is not None and max_version > 0 else None
+        # The previous version is the one the current version was edited from
+        current_version = fetch_item_latest_version(db.session, userid, classid, itemid)
+        previous_version = fetch_parent_version(db.session, userid, classid, itemid, current_version)
         
         if previous_version is None:
             return jsonify({
@@ -176,7 +208,7 @@ def fetch_last_version_of_item():
             }), 404
 
         # Fetch all data for the previous version using the helper function
-        item_data = fetch_item_data(userid, classid, itemid, previous_version)
+        item_data = fetch_item_data(db.session, userid, classid, itemid, previous_version)
         item_data['topics'] = item_data.pop('relatedtopics')
         item_data['skills'] = item_data.pop('relatedskills')
         
@@ -294,113 +326,96 @@ def copy_item():
     class_id = data["classId"]
     test_id = data["testId"]
     old_item_id = data["itemId"]
-    old_version = fetch_item_latest_version(user_id, class_id, old_item_id)
-
-    # Generate a new item_id for this copy item
-    new_item_id = f"{old_item_id}_{uuid.uuid4().hex[:6]}"
 
     try:
-        # 1. Get current order number
-        old_test_entry = db.session.execute(
-            select(Tests).filter(
-                Tests.user_id == user_id,
-                Tests.class_id == class_id,
-                Tests.test_id == test_id,
-                Tests.item_id == old_item_id
-            )
-        ).scalar_one_or_none()
-
-        if not old_test_entry:
+        new_ids = copy_items(db.session, user_id, class_id, test_id, [old_item_id])
+        if not new_ids:
+            db.session.rollback()
             return jsonify({"message": "Original item not found in test"}), 400
 
-        old_order = old_test_entry.order_number
-        new_order = old_order + 1  # Place the copied item right after the original
+        db.session.commit()
+        return jsonify({
+            "message": "Item duplicated successfully",
+            "newItemId": new_ids[old_item_id]
+        }), 200
 
-        # 2. Update order numbers for items after the insertion point
-        db.session.query(Tests).filter(
-            Tests.user_id == user_id,
-            Tests.class_id == class_id,
-            Tests.test_id == test_id,
-            Tests.order_number >= new_order
-        ).update(
-            {Tests.order_number: Tests.order_number + 1},
-            synchronize_session=False
-        )
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"message": f"Failed to copy item: {str(e)}"}), 500
 
-        # 3. Insert copied item into item_current: new version = 0
-        db.session.add(ItemCurrent(
-            user_id=user_id, class_id=class_id, item_id=new_item_id, version=0
-        ))
-
-        # 4. Fetch target item's data and insert copied item into item_history
-        history_to_copy = db.session.execute(
-            select(ItemHistory).filter(
-                ItemHistory.user_id == user_id,
-                ItemHistory.class_id == class_id,
-                ItemHistory.item_id == old_item_id,
-                ItemHistory.version == old_version
-            )
-        ).scalar_one_or_none()
 
-        if not history_to_copy:
-             # Rollback and return if the history data doesn't exist
+@db_bp.route("/copy-items", methods=["POST"])
+def copy_items_route():
+    """
+    Copies several items of a test at once, inserting the copies as one block below the last
+    of them.
+    """
+    data = request.get_json()
+    if not data:
+        return jsonify({"message": "Missing data"}), 400
+
+    user_id = data.get("userId")
+    class_id = data.get("classId")
+    test_id = data.get("testId")
+    item_ids = data.get("itemIds")
+
+    if not all([user_id, class_id, test_id, item_ids]):
+        return jsonify({"message": "Missing required fields"}), 400
+
+    try:
+        new_ids = copy_items(db.session, user_id, class_id, test_id, item_ids)
+        if not new_ids:
             db.session.rollback()
-            return jsonify({"message": "Item history not found for copy operation"}), 404
-        
-        # Insert into item_history (new version = 0)
-        db.session.add(ItemHistory(
-            user_id=user_id, class_id=class_id, item_id=new_item_id, version=0,
-            question_part=history_to_copy.question_part,
-            answer_part=history_to_copy.answer_part,
-            format=history_to_copy.format,
-            difficulty=history_to_copy.difficulty,
-            wrong_answer_explanation=history_to_copy.wrong_answer_explanation
-        ))
-
-        # 5. Copy and insert into item_topics and item_skills
-        topics_to_copy = db.session.execute(
-            select(ItemTopics).filter(
-                ItemTopics.user_id == user_id,
-                ItemTopics.class_id == class_id,
-                ItemTopics.item_id == old_item_id,
-                ItemTopics.version == old_version
-            )
-        ).scalars().all()
-        for topic in topics_to_copy:
-            db.session.add(ItemTopics(
-                user_id=user_id, class_id=class_id, item_id=new_item_id, version=0,
-                topic_id=topic.topic_id, topic_name=topic.topic_name
-            ))
-
-        # Copy item_skills
-        skills_to_copy = db.session.execute(
-            select(ItemSkills).filter(
-                ItemSkills.user_id == user_id,
-                ItemSkills.class_id == class_id,
-                ItemSkills.item_id == old_item_id,
-                ItemSkills.version == old_version
-            )
-        ).scalars().all()
-        for skill in skills_to_copy:
-            db.session.add(ItemSkills(
-                user_id=user_id, class_id=class_id, item_id=new_item_id, version=0,
-                skill_id=skill.skill_id, skill_name=skill.skill_name
-            ))
-
-        # 5. Insert into tests
-        db.session.add(Tests(
-            user_id=user_id, class_id=class_id, test_id=test_id, item_id=new_item_id, order_number=new_order
-        ))
+            return jsonify({"message": "None of the items were found in the test"}), 400
 
         db.session.commit()
         return jsonify({
-            "message": "Item duplicated successfully",
-            "newItemId": new_item_id
+            "message": "Items duplicated successfully",
+            "newItemIds": new_ids,
+            "missingItemIds": [item_id for item_id in item_ids if item_id not in new_ids]
         }), 200
 
     except Exception as e:
         db.session.rollback()
-        return jsonify({"message": f"Failed to copy item: {str(e)}"}), 500
+        return jsonify({"message": f"Failed to copy items: {str(e)}"}), 500
+
+
+@db_bp.route("/copy-test", methods=["POST"])
+def copy_test_route():
+    """
+    Copies a whole test with all of its items under a new "copy of ..." name.
+    """
+    data = request.get_json()
+    if not data:
+        return jsonify({"message": "Missing data"}), 400
+
+    user_id = data.get("userId")
+    class_id = data.get("classId")
+    test_id = data.get("testId")
+
+    if not all([user_id, class_id, test_id]):
+        return jsonify({"message": "Missing required fields"}), 400
+
+    try:
+        exists = db.session.execute(
+            select(UserTests.test_id).filter_by(user_id=user_id, class_id=class_id, test_id=test_id)
+        ).scalar_one_or_none()
+        if exists is None:
+            return jsonify({"message": "Test not found"}), 404
+
+        new_test_id, copied = copy_test(
+            db.session, user_id, class_id, test_id, data.get("newTestId")
+        )
+        db.session.commit()
+        return jsonify({
+            "message": "Test duplicated successfully",
+            "newTestId": new_test_id,
+            "itemCount": copied
+        }), 200
+
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"message": f"Failed to copy test: {str(e)}"}), 500
 
 
 @db_bp.route("/update-item", methods=["PUT"])
@@ -424,71 +439,48 @@ def update_item():
         topics = data.get('topics', [])
         skills = data.get('skills', [])
         wrong_answer_explanation = data.get('wrongAnswerExplanation')
+        expected_version = data.get('expectedVersion')
         
         # Validate required fields
         if not all([user_id, class_id, item_id, question, answer, format_type, difficulty]):
             return jsonify({"message": "Missing required fields"}), 400
 
         try:
-            # Get current version and calculate new version
-            result = fetch_item_latest_version(user_id, class_id, item_id)
-            new_version = result + 1
-
-            # Find latest topic_id
-            latest_topic_id = db.session.execute(
-                select(ItemTopics.topic_id).filter_by(
-                    user_id=user_id, class_id=class_id
-                ).order_by(ItemTopics.topic_id.desc()).limit(1)
-            ).scalar_one_or_none()
-
-            # Find latest skill_id
-            latest_skill_id = db.session.execute(
-                select(ItemSkills.skill_id).filter_by(
-                    user_id=user_id, class_id=class_id
-                ).order_by(ItemSkills.skill_id.desc()).limit(1)
-            ).scalar_one_or_none()
-
-            # Get next IDs
-            def get_next_id(current_id, prefix):
-                if not current_id:
-                    return f"{prefix}_0"
-                try:
-                    num = int(current_id.split('_')[1])
-                    return f"{prefix}_{num + 1}"
-                except (IndexError, ValueError):
-                    return f"{prefix}_0"
-
-            # Update item_current
-            db.session.query(ItemCurrent).filter_by(
-                user_id=user_id, class_id=class_id, item_id=item_id
-            ).update({ItemCurrent.version: new_version}, synchronize_session=False)
-
-            # Insert into item_history
-            db.session.add(ItemHistory(
-                user_id=user_id, class_id=class_id, item_id=item_id, version=new_version,
-                question_part=question, answer_part=answer, format=format_type, 
-                difficulty=difficulty, wrong_answer_explanation=wrong_answer_explanation
-            ))
-
-            # Insert topics
-            current_topic_id = latest_topic_id
-            for topic in topics:
-                next_topic_id = get_next_id(current_topic_id, "topic") 
-                db.session.add(ItemTopics(
-                    user_id=user_id, class_id=class_id, item_id=item_id, version=new_version,
-                    topic_id=next_topic_id, topic_name=topic
-                ))
-                current_topic_id = next_topic_id # Update for next iteration
-
-            # Insert skills
-            current_skill_id = latest_skill_id
-            for skill in skills:
-                next_skill_id = get_next_id(current_skill_id, "skill")
-                db.session.add(ItemSkills(
-                    user_id=user_id, class_id=class_id, item_id=item_id, version=new_version,
-                    skill_id=next_skill_id, skill_name=skill
-                ))
-                current_skill_id = next_skill_id
+            # The version the client edited. Older clients do not send it, in which case the
+            # current version is read first and the update is still checked against it.
+            if expected_version is None:
+                expected_version = fetch_item_latest_version(db.session, user_id, class_id, item_id)
+            expected_version = int(expected_version)
+
+            # 1. Claim the new version, only if nobody else has moved the item meanwhile
+            new_version = bump_item_version(db.session, user_id, class_id, item_id, expected_version)
+            if new_version is None:
+                db.session.rollback()
+                return _version_conflict_response(user_id, class_id, item_id, expected_version)
+
+            # 2. Resolve topic and skill names, creating the ones the class has not used before
+            ids = intern_names_many(
+                db.session, user_id, class_id, {"topic": topics, "skill": skills}
+            )
+
+            # 3. Write history, topic links and skill links in one statement
+            insert_item_version(
+                db.session,
+                user_id,
+                class_id,
+                item_id,
+                new_version,
+                expected_version,
+                {
+                    "question_part": question,
+                    "answer_part": answer,
+                    "format": format_type,
+                    "difficulty": difficulty,
+                    "wrong_answer_explanation": wrong_answer_explanation,
+                },
+                topic_ids=[ids["topic"][topic] for topic in topics if topic],
+                skill_ids=[ids["skill"][skill] for skill in skills if skill],
+            )
 
             db.session.commit()
 
@@ -517,6 +509,20 @@ def update_item():
         return jsonify({"message": f"Error updating item: {str(e)}"}), 500
 
 
+def _version_conflict_response(user_id, class_id, item_id, expected_version):
+    """404 when the item does not exist, 409 with the current version when it has moved on."""
+    current_version = db.session.execute(
+        select(ItemCurrent.version).filter_by(user_id=user_id, class_id=class_id, item_id=item_id)
+    ).scalar_one_or_none()
+    if current_version is None:
+        return jsonify({"message": "Item not found"}), 404
+    return jsonify({
+        "message": "Item was changed by another edit",
+        "expectedVersion": expected_version,
+        "currentVersion": current_version
+    }), 409
+
+
 @db_bp.route("/update_item_order", methods=["POST"])
 def update_item_order():
     """
@@ -538,41 +544,19 @@ def update_item_order():
         return jsonify({"message": "Missing required fields"}), 400
     
     try:
-        # 1. Update the moved item's order number
+        # Give the moved item a rank between its new neighbours; no other row is written
+        # unless the test has to be rebalanced
+        new_ranks, _ = place_order_numbers(
+            db.session, user_id, class_id, test_id, int(new_order_number), exclude_item_id=item_id
+        )
+
         db.session.query(Tests).filter_by(
             user_id=user_id, class_id=class_id, test_id=test_id, item_id=item_id
         ).update(
-            {Tests.order_number: new_order_number}, 
+            {Tests.order_number: new_ranks[0]}, 
             synchronize_session=False
         )
         
-        # 2. Shift the order numbers of other items
-        filter_args = [
-            Tests.user_id == user_id,
-            Tests.class_id == class_id,
-            Tests.test_id == test_id,
-            Tests.item_id != item_id
-        ]
-
-        if new_order_number > old_order_number:
-            # Item moved down: shift all in between up (decrement order_number)
-            db.session.query(Tests).filter(
-                *filter_args,
-                Tests.order_number.between(old_order_number + 1, new_order_number)
-            ).update(
-                {Tests.order_number: Tests.order_number - 1}, 
-                synchronize_session=False
-            )
-        elif new_order_number < old_order_number:
-            # Item moved up: shift all in between down (increment order_number)
-            db.session.query(Tests).filter(
-                *filter_args,
-                Tests.order_number.between(new_order_number, old_order_number - 1)
-            ).update(
-                {Tests.order_number: Tests.order_number + 1}, 
-                synchronize_session=False
-            )
-        
         db.session.commit()
         return jsonify({"message": "Item order updated successfully"}), 200
     
@@ -603,50 +587,71 @@ def undo_item():
     itemid = data["itemid"]
     
     try:
-        # 1. Find the current version of the item
-        current_item = db.session.execute(
-            select(ItemCurrent).filter_by(
-                user_id=userid, class_id=classid, item_id=itemid
-            )
-        ).scalar_one_or_none()
-
-        if not current_item:
-            return jsonify({"message": "Item not found in current table"}), 404
-            
-        old_version = current_item.version
-        
-        # Check if there is a version to undo to (version 0 is the base)
-        if old_version <= 0:
-            return jsonify({"message": "Cannot undo the base version (version 0)"}), 400
-            
-        new_version = old_version - 1
-        
-        # 2. Delete obsolete version entries from History, Topics, Skills
-        filter_args = {
-            "user_id": userid, "class_id": classid, "item_id": itemid, "version": old_version
-        }
-        
-        db.session.query(ItemTopics).filter_by(**filter_args).delete(synchronize_session=False)
-        db.session.query(ItemSkills).filter_by(**filter_args).delete(synchronize_session=False)
-        db.session.query(ItemHistory).filter_by(**filter_args).delete(synchronize_session=False)
-        
-        # 3. Update the item version in item_current table
-        current_item.version = new_version
-
-        # Note: No need to update item_topics and item_skills table as they are related to item_current via ON_UPDATE_CASCADE
+        # Move the pointer to the parent version; no history row is deleted, so redo can
+        # come back and cached versions stay valid
+        new_version = undo_item_version(db.session, userid, classid, itemid)
+        if new_version is None:
+            db.session.rollback()
+            return _missing_version_response(userid, classid, itemid, "Nothing to undo for this item")
 
-        # 4. Fetch the details of the current version
-        item = fetch_item_data(userid, classid, itemid, new_version)
-    
+        item = fetch_item_data(db.session, userid, classid, itemid, new_version)
         db.session.commit()
     
         return jsonify({"message": "Item undone successfully", "item": item}), 200
     
     except Exception as e:
-        print("failed")
+        db.session.rollback()
+        return jsonify({"message": f"Connection failed: {str(e)}"}), 500
+
+
+@db_bp.route("/redo-item", methods=["POST", "OPTIONS"])
+def redo_item():
+    """
+    Redo the latest undone change of a specific item.
+    """
+    # OPTIONS request handling for CORS
+    if request.method == 'OPTIONS':
+        response = make_response('', 200)
+        response.headers['Access-Control-Allow-Origin'] = '*'
+        response.headers['Access-Control-Allow-Methods'] = 'POST, OPTIONS'
+        response.headers['Access-Control-Allow-Headers'] = 'Content-Type, Authorization'
+        return response
+
+    data = request.get_json()
+    if not data or "userid" not in data or "classid" not in data or "itemid" not in data:
+        return jsonify({"message": "Missing or invalid request body"}), 400
+
+    userid = data["userid"]
+    classid = data["classid"]
+    itemid = data["itemid"]
+
+    try:
+        # Move the pointer to the newest version edited from the current one
+        new_version = redo_item_version(db.session, userid, classid, itemid)
+        if new_version is None:
+            db.session.rollback()
+            return _missing_version_response(userid, classid, itemid, "Nothing to redo for this item")
+
+        item = fetch_item_data(db.session, userid, classid, itemid, new_version)
+        db.session.commit()
+
+        return jsonify({"message": "Item redone successfully", "item": item}), 200
+
+    except Exception as e:
+        db.session.rollback()
         return jsonify({"message": f"Connection failed: {str(e)}"}), 500
 
 
+def _missing_version_response(userid, classid, itemid, message):
+    """404 when the item does not exist, 400 when it has no version to move to."""
+    exists = db.session.execute(
+        select(ItemCurrent.version).filter_by(user_id=userid, class_id=classid, item_id=itemid)
+    ).first()
+    if exists is None:
+        return jsonify({"message": "Item not found in current table"}), 404
+    return jsonify({"message": message}), 400
+
+
 @db_bp.route("/delete-item/", methods=["POST"])
 def delete_item():
     """
@@ -662,15 +667,8 @@ def delete_item():
     itemid = data.get('itemId')
 
     try:
-        # 1. Get the order number from the Tests table before deletion
-        tests_entry = db.session.execute(
-            select(Tests).filter_by(
-                user_id=userid, class_id=classid, item_id=itemid
-            )
-        ).scalar_one_or_none()
-        deleted_order_number = tests_entry.order_number if tests_entry else None
-
-        # 2. Delete from item tables by item_id
+        # Delete from item tables by item_id. The remaining items keep their ranks, so their
+        # dense positions close the gap without being rewritten.
         filter_args = {
             "user_id": userid, 
             "class_id": classid, 
@@ -680,20 +678,9 @@ def delete_item():
         tables_to_delete = [ItemSkills, ItemTopics, ItemHistory, Tests, ItemCurrent]
         for Model in tables_to_delete:
             db.session.query(Model).filter_by(**filter_args).delete(synchronize_session=False)
-        
-        # 3. Adjust order numbers of remaining items in the test
-        if deleted_order_number is not None:
-            # Decrement order_number for all subsequent items in the test
-            db.session.query(Tests).filter(
-                Tests.user_id == userid, 
-                Tests.class_id == classid,
-                Tests.order_number > deleted_order_number
-            ).update(
-                {Tests.order_number: Tests.order_number - 1}, 
-                synchronize_session=False
-            )
 
         db.session.commit()
+        item_cache.invalidate(userid, classid, itemid)
 
         return jsonify({"message": "Item successfully deleted"}), 200
 
@@ -7,26 +7,18 @@ from flask import jsonify, request, make_response
 from .gpt_blueprint import gpt_bp
 from sqlalchemy import text
 from app import db
-import openai
 import os
 import json
 import uuid
 import yaml
-from PIL import Image
-import base64
 from models import UnifiedQuestioSingleItem, ExtractedQuestion
 from ...utils.class_info import get_class_info
 from ...utils.db_operations import (
-    fetch_next_order_number, 
-    fetch_highest_topic_id, 
-    fetch_highest_skill_id, 
-    insert_item_current, 
-    insert_item_history, 
-    select_unique_class, 
-    insert_tests, 
-    insert_item_skills, 
-    insert_item_topics
+    reserve_order_numbers, 
+    ItemBatchWriter
 )
+from ...utils.llm_gateway import llm
+from ...utils.image_payload import encode_image_data_url
 # Load config.yaml
 config_path = os.path.join(os.path.dirname(__file__), "../../utils/config.yaml")
 with open(config_path, "r", encoding="utf-8") as f:
@@ -81,11 +73,11 @@ def generate_from_image():
             return jsonify({"error": "Invalid order number format"}), 400
 
     # Process image
-    img_bytes = file.read()
-    img_base64 = base64.b64encode(img_bytes).decode("utf-8")
-    image_url = f"data:image/png;base64,{img_base64}"
+    try:
+        image_url = encode_image_data_url(file.read(), kind="photo")
+    except Exception as e:
+        return jsonify({"error": f"Failed to read image: {str(e)}"}), 400
 
-    client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
     prompt_text = config["prompts"]["image_question_conversion"]
     generated_items = []
@@ -104,9 +96,8 @@ def generate_from_image():
                 existing_questions=json.dumps(existing_questions),
                 question_type=question_type,
             )
-            response = client.responses.parse(
-                model=config["gpt_model"]["engine"],
-                input=[
+            result = llm.parse(
+                [
                     {
                         "role": "user",
                         "content": [
@@ -121,12 +112,9 @@ def generate_from_image():
                         ]
                     }
                 ],
-                text_format=ExtractedQuestion,
-                reasoning={"effort": config["gpt_model"]["reasoning"]},
-                text={"verbosity": config["gpt_model"]["verbosity"]},
+                ExtractedQuestion,
             )
 
-            result = response.output[1].content[0].parsed
             if result.questions:
                 item = result.questions[0]
                 item.item_id = f"{test_id}_{str(uuid.uuid4())[:12]}"
@@ -138,33 +126,16 @@ def generate_from_image():
             continue
 
     inserted_items = []
-    
-    highest_topic_result = fetch_highest_topic_id(db.session, userid, classid)
-    highest_skill_result = fetch_highest_skill_id(db.session, userid, classid)
-
-    def get_next_id(current_id, prefix):
-        if not current_id:
-            return f"{prefix}_0"
-        try:
-            num = int(current_id.split("_")[1])
-            return f"{prefix}_{num + 1}"
-        except (IndexError, ValueError):
-            return f"{prefix}_0"
-
-    current_topic_id = get_next_id(
-        highest_topic_result if highest_topic_result else None, "topic"
-    )
-    current_skill_id = get_next_id(
-        highest_skill_result if highest_skill_result else None, "skill"
-    )
 
     version = 0
     total_questions = num_mcq + num_frq
 
-    if order_number is not None:
-        fetch_next_order_number(
-            db.session, userid, classid, test_id, order_number, total_questions
-        )
+    # Reserve the order slots of the whole batch up front
+    order_ranks, positions = reserve_order_numbers(
+        db.session, userid, classid, test_id, len(generated_items), order_number
+    )
+
+    writer = ItemBatchWriter(db.session, userid, classid, test_id)
 
     try:
         for idx, item_response in enumerate(generated_items):
@@ -187,71 +158,22 @@ def generate_from_image():
             else:
                 answer_part = item_response.answer_part
                 
-            # Insert_item_history
-            insert_item_current(
-                db.session,
-                userid,
-                classid,
-                item_id,
-                version,
-            )
-
-            # Check if class exists, if not, insert it
-            select_unique_class(db.session, userid, classid)
+            current_order = positions[idx]
 
-            # Insert into item_history
-            insert_item_history(
-                db.session,
-                userid,
-                classid,
+            # Queue item_current, item_history, tests, item_topics and item_skills rows
+            writer.add_item(
                 item_id,
-                version,
                 question,
                 answer_part,
                 question_type,
                 difficulty,
                 wrong_answer_explanation,
+                topics=item_response.relatedtopics,
+                skills=item_response.relatedskills,
+                order_number=order_ranks[idx],
+                version=version,
             )
 
-            if idx == 0 and order_number is not None:
-                current_order = order_number
-            elif order_number is not None:
-                current_order = order_number + idx
-            else:
-                current_order = fetch_next_order_number(
-                    db.session, userid, classid, test_id
-                )
-                
-            # Insert into tests
-            insert_tests(db.session, userid, classid, test_id, item_id, current_order)
-
-            for topic_name in item_response.relatedtopics:
-                topic_id = get_next_id(current_topic_id, "topic")
-                current_topic_id = topic_id
-                # Insert into item_topcis
-                insert_item_topics(
-                    db.session,
-                    userid,
-                    classid,
-                    item_id,
-                    version,
-                    topic_id,
-                    topic_name,
-                )
-
-            for skill_name in item_response.relatedskills:
-                skill_id = get_next_id(current_skill_id, "skill")
-                current_skill_id = skill_id
-                insert_item_skills(
-                    db.session,
-                    userid,
-                    classid,
-                    item_id,
-                    version,
-                    skill_id,
-                    skill_name,
-                )
-
             inserted_items.append(
                 {
                     "item_id": item_id,
@@ -264,6 +186,7 @@ def generate_from_image():
                 }
             )
 
+        writer.flush()
         db.session.commit()
         return (
             jsonify(
@@ -7,7 +7,6 @@ from flask import jsonify, request, make_response
 from .gpt_blueprint import gpt_bp
 from sqlalchemy import text
 from app import db
-import openai
 import os
 import json
 import uuid
@@ -17,10 +16,11 @@ from ...utils.class_info import get_class_info
 from ...utils.db_operations import (
     fetch_item_latest_version,
     fetch_item_data,
-    add_requirement_to_database,
-    fetch_item_latest_version
+    fetch_item_next_version
 )
-from ...utils.compare_reqs import compare_reqs
+from ...utils.llm_gateway import llm
+from ...utils.task_queue import task_queue
+from ...utils import requirement_tasks  # registers the capture_requirement task
 
 # Load config.yaml
 config_path = os.path.join(os.path.dirname(__file__), "../../utils/config.yaml")
@@ -85,23 +85,19 @@ def modify_item():
         "skills": True,
     }
 
-    comparison = compare_reqs(db, userid, modification)
-    if comparison == '{"requirementCheck":"False"}':
-        if modification:
-            add_requirement_to_database(
-                userid,
-                classid,
-                testid,
-                itemid,
-                req_id,
-                0,
-                user_modification,
-                1,
-                1,
-                contentType,
-            )
-
-    client = openai.OpenAI()
+    # Dedup and save the requirement after the response; the user only waits for the item
+    if modification:
+        task_queue.enqueue(
+            "capture_requirement",
+            user_id=userid,
+            class_id=classid,
+            test_id=testid,
+            item_id=itemid,
+            req_id=req_id,
+            content=user_modification,
+            content_type=contentType,
+            check_content=modification,
+        )
 
     try:
         # Find item in item_history
@@ -125,16 +121,7 @@ def modify_item():
                 modification=modification,
             )
 
-            response = client.responses.parse(
-                model=config["gpt_model"]["engine"],
-                input=user_content,
-                text_format=MultipleChoiceItem,
-                reasoning={"effort": config["gpt_model"]["reasoning"]},
-                text={"verbosity": config["gpt_model"]["verbosity"]},
-            )
-
-            # Extract the parsed response from GPT's output.
-            item_response = response.output[1].content[0].parsed
+            item_response = llm.parse(user_content, MultipleChoiceItem)
 
             # Extract attributes from the `item_response` object
             answer_A = item_response.answer_A
@@ -161,16 +148,7 @@ def modify_item():
                 modification=modification,
             )
 
-            response = client.responses.parse(
-                model=config["gpt_model"]["engine"],
-                input=user_content,
-                text_format=FreeResponseItem,
-                reasoning={"effort": config["gpt_model"]["reasoning"]},
-                text={"verbosity": config["gpt_model"]["verbosity"]},
-            )
-
-            # Extract the parsed response from GPT's output.
-            item_response = response.output[1].content[0].parsed
+            item_response = llm.parse(user_content, FreeResponseItem)
 
             # Extract attributes from the `item_response` object
             wrong_answer_explanation = ""
@@ -185,8 +163,8 @@ def modify_item():
         relatedtopics = item_response.relatedtopics
         relatedskills = item_response.relatedskills
 
-        result = fetch_item_latest_version(db.session, userid, classid, itemid)
-        highest_version = result + 1
+        # Saved edits are numbered past every version ever written, including undone ones
+        highest_version = fetch_item_next_version(db.session, userid, classid, itemid)
 
         modify_item = {
             "version": highest_version,
@@ -271,18 +249,9 @@ def edit_item_component():
     )
 
     # Make API call
-    client = openai.OpenAI()
     try:
-        response = client.responses.parse(
-            model=config["gpt_model"]["engine"],
-            input=prompt,
-            text_format=EditedItemComponent,
-            reasoning={"effort": config["gpt_model"]["reasoning"]},
-            text={"verbosity": config["gpt_model"]["verbosity"]},
-        )
+        editedComponent_response = llm.parse(prompt, EditedItemComponent)
 
-        # Extract the parsed response from GPT's output.
-        editedComponent_response = response.output[1].content[0].parsed
         editedComponent = editedComponent_response.editedComponent
 
         # Get current item data from DB
@@ -290,7 +259,6 @@ def edit_item_component():
 
         # Add user prompt as a new requirement
         requirement_id = f"{userId.replace(' ', '')}_{classId.replace(' ', '')}_{testId.replace(' ', '')}_{itemId.replace(' ', '')}_{str(uuid.uuid4())[:12]}"
-        req_version = 0
 
         contentType = {
             "question": True if contentType == "question" else False,
@@ -302,44 +270,28 @@ def edit_item_component():
             "skills": True if contentType == "skills" else False,
         }
 
-        comparison = compare_reqs(db, userId, userPrompt)
-
-        if comparison == '{"requirementCheck":"False"}':
-
-            # IF function thinks different do:
-            add_requirement_to_database(
-                user_id=userId,
-                class_id=classId,
-                test_id=testId,
-                item_id=requirement_id,
-                req_id=requirement_id,
-                version=req_version,
-                content=userPrompt,
-                usage_count=1,
-                application_count=1,
-                contentType=contentType,
-            )
+        # Dedup and save the user prompt as a requirement after the response
+        task_queue.enqueue(
+            "capture_requirement",
+            user_id=userId,
+            class_id=classId,
+            test_id=testId,
+            item_id=requirement_id,
+            req_id=requirement_id,
+            content=userPrompt,
+            content_type=contentType,
+        )
 
-            # Return changed component
-            return (
-                jsonify(
-                    {
-                        "message": "Item component edited successfully (new req added)",
-                        "editedComponent": editedComponent,
-                    }
-                ),
-                200,
-            )
-        else:
-            return (
-                jsonify(
-                    {
-                        "message": "Item component edited successfully (No req added)",
-                        "editedComponent": editedComponent,
-                    }
-                ),
-                200,
-            )
+        # Return changed component
+        return (
+            jsonify(
+                {
+                    "message": "Item component edited successfully",
+                    "editedComponent": editedComponent,
+                }
+            ),
+            200,
+        )
 
     except Exception as e:
         print("Error during GPT API call:", str(e))
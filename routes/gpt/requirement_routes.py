@@ -7,25 +7,51 @@ from flask import jsonify, request, make_response
 from .gpt_blueprint import gpt_bp
 from sqlalchemy import text
 from app import db
-import openai
 import os
 import json
 import uuid
 import yaml
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import List
+from pydantic import create_model
 from models import MultipleChoiceItem, FreeResponseItem, RequirementItem
 from ...utils.db_operations import (
     fetch_item_latest_version,
-    fetch_item_data,
-    add_requirement_to_database,
+    fetch_items_latest_versions,
+    fetch_parent_version,
+    fetch_items_data,
     select_requirements
 )
-from ...utils.compare_reqs import compare_reqs
+from ...utils.llm_gateway import llm
+from ...utils.task_queue import task_queue
+from ...utils import requirement_tasks  # registers the capture_requirement task
 
 # Load config.yaml
 config_path = os.path.join(os.path.dirname(__file__), "../../utils/config.yaml")
 with open(config_path, "r", encoding="utf-8") as f:
     config = yaml.safe_load(f)
 
+# Maximum number of items a single apply-requirements request sends to the model at the same time
+APPLY_REQUIREMENTS_CONCURRENCY = int(os.getenv("APPLY_REQUIREMENTS_CONCURRENCY", "8"))
+# Items of the same format sent in one model call; 1 sends every item on its own
+APPLY_REQUIREMENTS_BATCH_SIZE = int(os.getenv("APPLY_REQUIREMENTS_BATCH_SIZE", "5"))
+
+# Appended to the usual Entire_*/Partial_* prompt when item_data holds several items
+BATCH_PROMPT_SUFFIX = (
+    "\n\nitem_data above is a list of independent items, each with an itemid. Apply the requirements "
+    "to each item on its own, exactly as you would for a single item, and return one entry per "
+    "item in `items`, with the itemid of the item it was made from."
+)
+
+# Output fields of MultipleChoiceItem/FreeResponseItem regenerated for each selectable tag
+TAG_FIELDS = {
+    "question": ("question_part",),
+    "answer": ("answer_A", "answer_B", "answer_C", "answer_D", "correct_answer", "answer_part"),
+    "wrong_answer_explanation": ("wrong_answer_explanation",),
+    "topics": ("relatedtopics",),
+    "skills": ("relatedskills",),
+}
 
 
 @gpt_bp.route("/apply-requirements", methods=["POST", "OPTIONS"])
@@ -58,6 +84,7 @@ def apply_requirements():
     class_id = data.get("class_id")
     req_ids = data.get("req_ids")
     item_ids = data.get("item_ids")
+    use_cache = not data.get("noCache", False)  # clients can force a fresh generation
 
     # Step 1: Fetch requirements and corresponding tags from database
     requirements_dict = {}
@@ -98,160 +125,232 @@ def apply_requirements():
     with open(req_config, "r", encoding="utf-8") as f:
         req_config = yaml.safe_load(f)
 
-    # Organize API call
-    client = openai.OpenAI()
 
-    new_items = []
-
-    # Step 3: Iterate through each item and apply requirements to their corresponding tags
-    for item_id in item_ids:
-        # Get latest verison of item
-        latest_ver = fetch_item_latest_version(db.session, user_id, class_id, item_id)
+    # Get latest version and data of every item up front
+    latest_versions = fetch_items_latest_versions(db.session, user_id, class_id, item_ids, with_latest=True)
+    items_data = fetch_items_data(
+        db.session,
+        user_id,
+        [(class_id, item_id, version) for item_id, (version, _) in latest_versions.items()],
+    )
 
-        # Get item data
-        item_data = fetch_item_data(db.session, user_id, class_id, item_id, latest_ver)
-        item_format = item_data["format"]
+    # Step 3: Apply the requirements to every item, at most APPLY_REQUIREMENTS_CONCURRENCY calls at a time.
+    # Items of the same format share a call, batch_size at a time (the tag set is the same for
+    # the whole request). Items that are missing or fail are reported in "errors" instead of
+    # failing the request.
+    batch_size = max(1, int(data.get("batchSize", APPLY_REQUIREMENTS_BATCH_SIZE)))
+    results = {}
+    errors = []
+
+    by_format = {}
+    for item_id in dict.fromkeys(item_ids):
+        latest_ver, highest_ver = latest_versions.get(item_id, (None, None))
+        item_data = items_data.get((class_id, item_id, latest_ver))
+        if item_data is None:
+            errors.append({"itemid": item_id, "message": f"Item {item_id} not found"})
+            continue
+        # The edit will be saved as highest_ver + 1, past any undone versions
+        by_format.setdefault(item_data["format"], []).append((item_id, highest_ver + 1, dict(item_data)))
+
+    batches = [
+        items[start:start + batch_size]
+        for items in by_format.values()
+        for start in range(0, len(items), batch_size)
+    ]
+
+    with ThreadPoolExecutor(max_workers=max(1, min(APPLY_REQUIREMENTS_CONCURRENCY, len(batches)))) as executor:
+        futures = [
+            executor.submit(_apply_to_batch, batch, apply_reqs, tags, req_config, use_cache)
+            for batch in batches
+        ]
+
+        for future in futures:
+            batch_results, batch_errors = future.result()
+            results.update(batch_results)
+            errors.extend(
+                {"itemid": item_id, "message": f"Connection failed: {str(e)}"}
+                for item_id, e in batch_errors.items()
+            )
 
-        try:
-            # All/no tags selected -> (true) edit entire item
-            # <5 tags selected -> (false) edit only those tags
-            is_full_edit = len(tags) == 5 or len(tags) == 0
-
-            # Multiple Choice Item
-            if item_format == "MC":
-                if is_full_edit:
-                    user_content = req_config["Entire_MCQ_prompt"].format(
-                        item_data=str(item_data), requirements=str(apply_reqs)
-                    )
-
-                    response = client.responses.parse(
-                        model=config["gpt_model"]["engine"],
-                        input=user_content,
-                        text_format=MultipleChoiceItem,
-                        reasoning={"effort": config["gpt_model"]["reasoning"]},
-                        text={"verbosity": config["gpt_model"]["verbosity"]},
-                    )
-
-                else:
-                    user_content = req_config["Partial_MCQ_Prompt"].format(
-                        item_data=str(item_data),
-                        requirements=str(apply_reqs),
-                        item_tags=str(tags),
-                    )
-
-                    response = client.responses.parse(
-                        model=config["gpt_model"]["engine"],
-                        input=user_content,
-                        text_format=MultipleChoiceItem,
-                        reasoning={"effort": config["gpt_model"]["reasoning"]},
-                        text={"verbosity": config["gpt_model"]["verbosity"]},
-                    )
-
-                # Extract parsed response
-                item_response = response.output[1].content[0].parsed
-
-                # Step 4: Extract answers from response
-                answer_A = item_response.answer_A
-                answer_B = item_response.answer_B
-                answer_C = item_response.answer_C
-                answer_D = item_response.answer_D
-                correct_answer = item_response.correct_answer
-
-                # Formate MC answers
-                answer = {}
-                answer["A"] = answer_A
-                answer["B"] = answer_B
-                answer["C"] = answer_C
-                answer["D"] = answer_D
-                answer["Correct"] = correct_answer
-                answer = json.dumps(answer)
-
-            # Free Response Item
-            else:
-                if is_full_edit:
-                    user_content = req_config["Entire_FRQ_prompt"].format(
-                        item_data=str(item_data), requirements=str(apply_reqs)
-                    )
-
-                    response = client.responses.parse(
-                        model=config["gpt_model"]["engine"],
-                        input=user_content,
-                        text_format=FreeResponseItem,
-                        reasoning={"effort": config["gpt_model"]["reasoning"]},
-                        text={"verbosity": config["gpt_model"]["verbosity"]},
-                    )
-
-                else:
-                    user_content = req_config["Partial_FRQ_Prompt"].format(
-                        item_data=str(item_data),
-                        requirements=str(apply_reqs),
-                        item_tags=str(tags),
-                    )
-
-                    response = client.responses.parse(
-                        model=config["gpt_model"]["engine"],
-                        input=user_content,
-                        text_format=FreeResponseItem,
-                        reasoning={"effort": config["gpt_model"]["reasoning"]},
-                        text={"verbosity": config["gpt_model"]["verbosity"]},
-                    )
-
-                # Extract parsed response
-                item_response = response.output[1].content[0].parsed
-                # Step 4: Extract FR answer
-                answer = item_response.answer_part
-
-            # Step 5: Extract other attributes
-            question = item_response.question_part
-            difficulty = item_response.difficulty
-            relatedtopics = item_response.relatedtopics
-            relatedskills = item_response.relatedskills
-            wrong_answer_explanation = item_response.wrong_answer_explanation
-
-            # Step 6: Construct the modified item
-            modify_item = {
-                "itemid": item_id,
-                "version": latest_ver + 1,
-                "question": question,
-                "answer": answer,
-                "format": item_format,
-                "difficulty": difficulty,
-                "topics": relatedtopics,
-                "skills": relatedskills,
-                "wrong_answer_explanation": wrong_answer_explanation,
-            }
-
-            # Rename keys of item_data (original data of item )to match with modify item
-            remap_keys = {
-                "question_part": "question",
-                "answer_part": "answer",
-                "relatedtopics": "topics",
-                "relatedskills": "skills",
-            }
-
-            for old_key, new_key in remap_keys.items():
-                item_data[new_key] = item_data.pop(old_key)
-
-            # If only some tags are selected, make sure they are the only fields with modified content
-            # If 0 or 5 tags are selected, all modified content is kept
-            if not is_full_edit:
-                for key in modify_item.keys():
-                    if key not in tags and key != "itemid" and key != "version":
-                        modify_item[key] = item_data[key]
-
-            new_items.append(modify_item)
+    new_items = [results[item_id] for item_id in item_ids if item_id in results]
 
-        except Exception as e:
-            return jsonify({"message": f"Connection failed: {str(e)}"}), 500
+    if errors and not new_items:
+        return jsonify({"message": "No item could be generated", "errors": errors}), 500
 
     response_data = {
         "item_info": new_items,
+        "errors": errors,
         "message": "Item generated successfully",
     }
 
     return jsonify(response_data), 200
 
 
+def _item_prompt(item_format, item_data, apply_reqs, tags, req_config):
+    """
+    Prompt and output schema for applying requirements to item_data (one item, or a list of
+    items of the same format).
+    """
+    # All/no tags selected -> (true) edit entire item
+    # <5 tags selected -> (false) edit only those tags
+    is_full_edit = len(tags) == 5 or len(tags) == 0
+
+    # Multiple Choice Item
+    if item_format == "MC":
+        schema = MultipleChoiceItem
+        if is_full_edit:
+            user_content = req_config["Entire_MCQ_prompt"].format(
+                item_data=str(item_data), requirements=str(apply_reqs)
+            )
+        else:
+            user_content = req_config["Partial_MCQ_Prompt"].format(
+                item_data=str(item_data),
+                requirements=str(apply_reqs),
+                item_tags=str(tags),
+            )
+
+    # Free Response Item
+    else:
+        schema = FreeResponseItem
+        if is_full_edit:
+            user_content = req_config["Entire_FRQ_prompt"].format(
+                item_data=str(item_data), requirements=str(apply_reqs)
+            )
+        else:
+            user_content = req_config["Partial_FRQ_Prompt"].format(
+                item_data=str(item_data),
+                requirements=str(apply_reqs),
+                item_tags=str(tags),
+            )
+
+    if not is_full_edit:
+        schema = _scoped_schema(schema, tuple(sorted(tags)))
+
+    return user_content, schema
+
+
+@lru_cache(maxsize=None)
+def _scoped_schema(item_schema, tags):
+    """
+    Output schema holding only the fields of item_schema that the selected tags cover, so the
+    model does not generate fields that would be thrown away.
+    """
+    fields = {
+        name: (item_schema.model_fields[name].annotation, item_schema.model_fields[name])
+        for tag in tags
+        for name in TAG_FIELDS.get(tag, ())
+        if name in item_schema.model_fields
+    }
+    if not fields:
+        return item_schema
+
+    return create_model(f"{item_schema.__name__}_{'_'.join(tags)}", **fields)
+
+
+def _modified_item(item_id, new_ver, item_data, item_response):
+    """
+    Build the response entry of one item: the stored item with the generated fields merged in.
+
+    A full edit generates every field. A partial edit only generates the fields of the selected
+    tags (see _scoped_schema), and everything else keeps its stored value.
+    """
+    generated = item_response.model_dump()
+
+    modify_item = {
+        "itemid": item_id,
+        "version": new_ver,
+        "question": generated.get("question_part", item_data.get("question_part")),
+        "answer": item_data.get("answer_part"),
+        "format": item_data["format"],
+        "difficulty": generated.get("difficulty", item_data.get("difficulty")),
+        "topics": generated.get("relatedtopics", item_data.get("relatedtopics")),
+        "skills": generated.get("relatedskills", item_data.get("relatedskills")),
+        "wrong_answer_explanation": generated.get(
+            "wrong_answer_explanation", item_data.get("wrong_answer_explanation")
+        ),
+    }
+
+    if "correct_answer" in generated:
+        # Formate MC answers
+        modify_item["answer"] = json.dumps({
+            "A": generated["answer_A"],
+            "B": generated["answer_B"],
+            "C": generated["answer_C"],
+            "D": generated["answer_D"],
+            "Correct": generated["correct_answer"],
+        })
+    elif "answer_part" in generated:
+        modify_item["answer"] = generated["answer_part"]
+
+    return modify_item
+
+
+def _apply_to_item(item_id, new_ver, item_data, apply_reqs, tags, req_config, use_cache):
+    """
+    Apply requirements to one item with a single model call.
+
+    Returns:
+        dict: the modified item
+    """
+    user_content, schema = _item_prompt(item_data["format"], item_data, apply_reqs, tags, req_config)
+    item_response = llm.parse(user_content, schema, cache=use_cache)
+    return _modified_item(item_id, new_ver, item_data, item_response)
+
+
+@lru_cache(maxsize=None)
+def _batch_schema(item_schema):
+    """List-valued output schema whose entries are item_schema plus the itemid they belong to."""
+    entry = create_model(f"{item_schema.__name__}Entry", __base__=item_schema, itemid=(str, ...))
+    return create_model(f"{item_schema.__name__}Batch", items=(List[entry], ...))
+
+
+def _apply_to_batch(batch, apply_reqs, tags, req_config, use_cache):
+    """
+    Apply requirements to several items of the same format with one model call.
+
+    Runs on a worker thread: everything it needs is passed in, and it does not touch the database.
+    Each entry of the response is matched to its item by itemid and validated against the
+    single-item schema. Items the batch call did not return a valid entry for, or all of them
+    when the call itself fails, are retried with single-item calls.
+
+    Args:
+        batch (List[Tuple[str, int, dict]]): (item_id, version the edit will get, item data) of each item.
+
+    Returns:
+        Tuple[dict, dict]: {item_id: modified item} and {item_id: exception} of failed items
+    """
+    results = {}
+    retry = list(batch)
+
+    if len(batch) > 1:
+        payload = [{"itemid": item_id, **item_data} for item_id, _, item_data in batch]
+        user_content, schema = _item_prompt(batch[0][2]["format"], payload, apply_reqs, tags, req_config)
+
+        try:
+            response = llm.parse(user_content + BATCH_PROMPT_SUFFIX, _batch_schema(schema), cache=use_cache)
+            entries = {entry.itemid: entry for entry in response.items}
+
+            retry = []
+            for item_id, new_ver, item_data in batch:
+                entry = entries.get(item_id)
+                try:
+                    item_response = schema.model_validate(entry.model_dump(exclude={"itemid"}))
+                    results[item_id] = _modified_item(item_id, new_ver, item_data, item_response)
+                except Exception:
+                    retry.append((item_id, new_ver, item_data))
+        except Exception as e:
+            print(f"Batched requirement call failed, retrying {len(batch)} items one by one: {e}")
+
+    errors = {}
+    for item_id, new_ver, item_data in retry:
+        try:
+            results[item_id] = _apply_to_item(item_id, new_ver, item_data, apply_reqs, tags, req_config, use_cache)
+        except Exception as e:
+            errors[item_id] = e
+
+    return results, errors
+
+
 @gpt_bp.route("/generate-requirement", methods=["POST", "OPTIONS"])
 def generate_requirement():
     """
@@ -285,16 +384,27 @@ def generate_requirement():
     test_id = data.get("testid")
     item_id = data.get("itemid")
     contentType = data.get("contentType")  # tags
+    use_cache = not data.get("noCache", False)  # clients can force a fresh generation
 
     # Get latest version of item
     latest_ver = fetch_item_latest_version(db.session, user_id, class_id, item_id)
 
-    # Previous version of item
-    prev_ver = latest_ver - 1 if latest_ver > 0 else 0
+    # Previous version of item: the one the current version was edited from
+    prev_ver = fetch_parent_version(db.session, user_id, class_id, item_id, latest_ver)
+    if prev_ver is None:
+        prev_ver = latest_ver
 
-    # Fetch items from DB
-    latest_ver_item = fetch_item_data(db.session, user_id, class_id, item_id, latest_ver)
-    previous_ver_item = fetch_item_data(db.session, user_id, class_id, item_id, prev_ver)
+    # Fetch both versions of the item from DB in one batch
+    versions = fetch_items_data(
+        db.session,
+        user_id,
+        [(class_id, item_id, latest_ver), (class_id, item_id, prev_ver)],
+    )
+    latest_ver_item = versions.get((class_id, item_id, latest_ver))
+    previous_ver_item = versions.get((class_id, item_id, prev_ver))
+
+    if latest_ver_item is None or previous_ver_item is None:
+        return jsonify({"message": "Item not found in history"}), 404
 
     # Construct prompt for GPT
     prompt = config["prompts"]["requirement_template"].format(
@@ -302,62 +412,36 @@ def generate_requirement():
     )
 
     # Make API call
-    client = openai.OpenAI()
     try:
-        response = client.responses.parse(
-            model=config["gpt_model"]["engine"],
-            input=prompt,
-            text_format=RequirementItem,
-            reasoning={"effort": config["gpt_model"]["reasoning"]},
-            text={"verbosity": config["gpt_model"]["verbosity"]},
-        )
-
-        requirement_response = response.output[1].content[0].parsed
+        requirement_response = llm.parse(prompt, RequirementItem, cache=use_cache)
 
         # Extract the reasoning from the parsed response
         reasoning = requirement_response.reasoning
 
-        comparison = compare_reqs(db, user_id, reasoning)
-        if comparison == '{"requirementCheck":"False"}':
-
-            # Add to database
-            requirement_id = (
-                f"{user_id}_{class_id}_{test_id}_{item_id}_{str(uuid.uuid4())[:12]}"
-            )
-            req_version = 0
-
-            add_requirement_to_database(
-                user_id=user_id,
-                class_id=class_id,
-                test_id=test_id,
-                item_id=requirement_id,
-                req_id=requirement_id,
-                version=req_version,
-                content=reasoning,
-                usage_count=1,
-                application_count=1,
-                contentType=contentType,
-            )
+        # Dedup and save the requirement after the response
+        requirement_id = (
+            f"{user_id}_{class_id}_{test_id}_{item_id}_{str(uuid.uuid4())[:12]}"
+        )
+        task_queue.enqueue(
+            "capture_requirement",
+            user_id=user_id,
+            class_id=class_id,
+            test_id=test_id,
+            item_id=requirement_id,
+            req_id=requirement_id,
+            content=reasoning,
+            content_type=contentType,
+        )
 
-            return (
-                jsonify(
-                    {
-                        "message": "Requirement generated successfully",
-                        "requirement": reasoning,
-                    }
-                ),
-                200,
-            )
-        else:
-            return (
-                jsonify(
-                    {
-                        "message": "Requirement already exists",
-                        "requirement": reasoning,
-                    }
-                ),
-                200,
-            )
+        return (
+            jsonify(
+                {
+                    "message": "Requirement generated successfully",
+                    "requirement": reasoning,
+                }
+            ),
+            200,
+        )
 
     except Exception as e:
         print(f"Error generating requirement: {str(e)}")
@@ -7,23 +7,16 @@ from flask import jsonify, request, make_response
 from .gpt_blueprint import gpt_bp
 from sqlalchemy import text
 from app import db
-import openai
 import os
 import json
 import uuid
 import yaml
 from models import MultipleChoiceItem, FreeResponseItem, ExtractedQuestion
 from ...utils.db_operations import (
-    fetch_next_order_number, 
-    fetch_highest_topic_id,
-    fetch_highest_skill_id, 
-    select_unique_class, 
-    insert_item_current, 
-    insert_item_history, 
-    insert_tests,
-    insert_item_topics,
-    insert_item_skills
+    reserve_order_numbers, 
+    ItemBatchWriter
 )
+from ...utils.llm_gateway import llm
 
 # Load config.yaml
 config_path = os.path.join(os.path.dirname(__file__), "../../utils/config.yaml")
@@ -56,6 +49,8 @@ def generate_similar():
     description = data.get("description")
     num_of_items = data.get("num_of_items", 1)
     order_number = data.get("orderNumber")
+    # Off unless asked for: running "generate similar" again should give new items
+    use_cache = bool(data.get("useCache", False))
 
     try:
         num_of_items = int(num_of_items)
@@ -74,33 +69,7 @@ def generate_similar():
     if not description:
         description = ""
 
-    # Get the highest existing topic_id and skill_id
-    highest_topic_result = fetch_highest_topic_id(db.session, userid, classid)
-    highest_skill_result = fetch_highest_skill_id(db.session, userid, classid)
-
-    def get_next_id(current_id, prefix):
-        if not current_id:
-            return f"{prefix}_0"
-        try:
-            num = int(current_id.split("_")[1])
-            return f"{prefix}_{num + 1}"
-        except (IndexError, ValueError):
-            return f"{prefix}_0"
-
-    current_topic_id = get_next_id(
-        highest_topic_result if highest_topic_result else None, "topic"
-    )
-    current_skill_id = get_next_id(
-        highest_skill_result if highest_skill_result else None, "skill"
-    )
-
     # Choose the proper prompt template based on question type
-    client = openai.OpenAI()
-
-    if order_number is not None:
-        fetch_next_order_number(
-            db.session, userid, classid, testid, order_number, num_of_items
-        )
 
     # Build prompt for generating all items at once
     prompt_template = (
@@ -121,16 +90,8 @@ def generate_similar():
 
     # Make a single API call to generate all items
     try:
-        response = client.responses.parse(
-            model=config["gpt_model"]["engine"],
-            input=prompt,
-            text_format=ExtractedQuestion,
-            reasoning={"effort": config["gpt_model"]["reasoning"]},
-            text={"verbosity": config["gpt_model"]["verbosity"]},
-        )
-
-        result = response.output[1].content[0].parsed
-        
+        result = llm.parse(prompt, ExtractedQuestion, cache=use_cache)
+
         if not hasattr(result, 'questions') or not result.questions:
             return jsonify({"error": "No questions generated"}), 500
         
@@ -143,7 +104,13 @@ def generate_similar():
     except Exception as e:
         return jsonify({"error": f"Failed to generate questions: {str(e)}"}), 500
 
+    # Reserve the order slots of the whole batch up front
+    order_ranks, positions = reserve_order_numbers(
+        db.session, userid, classid, testid, len(generated_items), order_number
+    )
+
     items = []
+    writer = ItemBatchWriter(db.session, userid, classid, testid)
 
     # Process all generated items
     for i, item_response in enumerate(generated_items):
@@ -175,56 +142,20 @@ def generate_similar():
             else:
                 answer_part = item_response.answer_part
 
-            # Perform the database insertions and commit explicitly.
-            # IMPORTANT: Insert into item_current first to satisfy the foreign key in item_history.
-            try:
-                # Insert into item_current
-                insert_item_current(db.session, userid, classid, item_id, 0)
-
-                # Ensure the user_class exists
-                select_unique_class(db.session, userid, classid)
-
-                # Insert into item_history
-                insert_item_history(
-                    db.session,
-                    userid,
-                    classid,
-                    item_id,
-                    0,
-                    question,
-                    answer_part,
-                    question_format,
-                    difficulty,
-                    wrong_answer_explanation,
-                )
-
-                # Get the appropriate order number
-                if i == 0 and order_number is not None:
-                    current_order = order_number
-                elif order_number is not None:
-                    current_order = order_number + i
-                else:
-                    current_order = fetch_next_order_number(
-                        db.session, userid, classid, testid
-                    )
-
-                # Insert into tests
-                insert_tests(db.session, userid, classid, testid, item_id, current_order)
-
-                # Insert into item_topics
-                for topic in topics:
-                    current_topic_id = get_next_id(current_topic_id, "topic")
-                    insert_item_topics(db.session, userid, classid, item_id, 0, current_topic_id, topic)
-
-                # Insert into item_skills
-                for skill in skills:
-                    current_skill_id = get_next_id(current_skill_id, "skill")
-                    insert_item_skills(db.session, userid, classid, item_id, 0, current_skill_id, skill)
-
-                db.session.commit()
-            except Exception as db_e:
-                db.session.rollback()
-                raise db_e
+            current_order = positions[i]
+
+            # Queue item_current, item_history, tests, item_topics and item_skills rows
+            writer.add_item(
+                item_id,
+                question,
+                answer_part,
+                question_format,
+                difficulty,
+                wrong_answer_explanation,
+                topics=topics,
+                skills=skills,
+                order_number=order_ranks[i],
+            )
 
             item = {
                 "item_id": item_id,
@@ -240,6 +171,14 @@ def generate_similar():
             db.session.rollback()
             return jsonify({"message": "Error generating item", "error": str(e)}), 500
 
+    # Write every generated item in one transaction
+    try:
+        writer.flush()
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"message": "Error generating item", "error": str(e)}), 500
+
     return (
         jsonify(
             {
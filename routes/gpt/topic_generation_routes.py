@@ -7,7 +7,6 @@ from flask import jsonify, request, make_response
 from .gpt_blueprint import gpt_bp
 from sqlalchemy import text
 from app import db
-import openai
 import os
 import json
 import uuid
@@ -15,15 +14,9 @@ import yaml
 from models import ExtractedQuestion
 from ...utils.class_info import get_class_info 
 from ...utils.db_operations import (
-    fetch_next_order_number, 
-    fetch_highest_topic_id, 
-    fetch_highest_skill_id, 
-    insert_tests, 
-    select_unique_class, 
-    insert_item_current, 
-    insert_item_history, 
-    insert_item_topics, 
-    insert_item_skills)
+    reserve_order_numbers, 
+    ItemBatchWriter)
+from ...utils.llm_gateway import llm
 
 
 @gpt_bp.route("/generate_multiple_items", methods=["POST", "OPTIONS"])
@@ -88,7 +81,6 @@ def generate_multiple_items():
     ) as f:
         config = yaml.safe_load(f)
 
-    client = openai.OpenAI()
     generated_items = []
 
     # Count total questions to be generated
@@ -120,16 +112,8 @@ def generate_multiple_items():
 
     try:
         # Make a single API call to generate all questions
-        response = client.responses.parse(
-            model=config["gpt_model"]["engine"],
-            input=prompt,
-            text_format=ExtractedQuestion,
-            reasoning={"effort": config["gpt_model"]["reasoning"]},
-            text={"verbosity": config["gpt_model"]["verbosity"]},
-        )
+        result = llm.parse(prompt, ExtractedQuestion)
 
-        result = response.output[1].content[0].parsed
-        
         if hasattr(result, 'questions'):
             if result.questions:
                 # Assign unique IDs to all generated questions
@@ -144,31 +128,14 @@ def generate_multiple_items():
 
     inserted_items = []
 
-    highest_topic_result = fetch_highest_topic_id(db.session, userid, classid)
-    highest_skill_result = fetch_highest_skill_id(db.session, userid, classid)
-
-    def get_next_id(current_id, prefix):
-        if not current_id:
-            return f"{prefix}_0"
-        try:
-            num = int(current_id.split("_")[1])
-            return f"{prefix}_{num + 1}"
-        except (IndexError, ValueError):
-            return f"{prefix}_0"
+    version = 0
 
-    current_topic_id = get_next_id(
-        highest_topic_result if highest_topic_result else None, "topic"
+    # Reserve the order slots of the whole batch up front
+    order_ranks, positions = reserve_order_numbers(
+        db.session, userid, classid, testid, len(generated_items), order_number
     )
-    current_skill_id = get_next_id(
-        highest_skill_result if highest_skill_result else None, "skill"
-    )
-
-    version = 0
 
-    if order_number is not None:
-        fetch_next_order_number(
-            db.session, userid, classid, testid, order_number, total_questions
-        )
+    writer = ItemBatchWriter(db.session, userid, classid, testid)
 
     try:
         for idx, item_response in enumerate(generated_items):
@@ -196,40 +163,13 @@ def generate_multiple_items():
             else:
                 answer_part = item_response.answer_part
 
-            # Insert into item_current
-            insert_item_current(db.session, userid, classid, item_id, version)
+            current_order = positions[idx]
 
-            # Ensure the user_class is unique and doesn't already exist
-            select_unique_class(db.session, userid, classid)
-
-            # Insert into item_history
-            insert_item_history(db.session, userid, classid, item_id, version, question, answer_part, question_type, difficulty, wrong_answer_explanation)
-
-            # Get the appropriate order number
-            if idx == 0 and order_number is not None:
-                current_order = order_number
-            elif order_number is not None:
-                current_order = order_number + idx
-            else:
-                current_order = fetch_next_order_number(
-                    db.session, userid, classid, testid
-                )
-
-            # Insert into tests
-            insert_tests(db.session, userid, classid, testid, item_id, current_order)
-
-            for topic_name in item_response.relatedtopics:
-                topic_id = get_next_id(current_topic_id, "topic")
-                current_topic_id = topic_id
-                # Insert into item_topics
-                insert_item_topics(db.session, userid, classid, item_id, version, topic_id, topic_name)
-
-            for skill_name in item_response.relatedskills:
-                skill_id = get_next_id(current_skill_id, "skill")
-                current_skill_id = skill_id
-                # Insert into item_skills
-                insert_item_skills(db.session, userid, classid, item_id, version, skill_id, skill_name)
-                
+            # Queue item_current, item_history, tests, item_topics and item_skills rows
+            writer.add_item(
+                item_id, question, answer_part, question_type, difficulty, wrong_answer_explanation,
+                topics=item_response.relatedtopics, skills=item_response.relatedskills, order_number=order_ranks[idx], version=version,
+            )
 
             inserted_items.append(
                 {
@@ -243,6 +183,7 @@ def generate_multiple_items():
                 }
             )
 
+        writer.flush()
         db.session.commit()
         return (
             jsonify(
@@ -1,19 +1,43 @@
-import psycopg2
 import uuid
+import csv
+import io
 from dotenv import load_dotenv
 import os
 import json
 
-from sqlalchemy import select, desc, update, func
+from sqlalchemy import (
+    select, update, insert, func, tuple_, literal, union_all, or_, cast, exists,
+    Table, MetaData, Column, String, Integer, Text
+)
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import aliased
 from app.utils.table_models import (
     Tests,
     ItemCurrent,
     ItemHistory,
     ItemTopics,
     ItemSkills,
+    Topics,
+    Skills,
     Requirements,
+    RequirementCaptures,
     UserClasses,
-    UserTests
+    UserTests,
+    SyllabusPageText,
+    TestOrderCounters,
+    ClassIdCounters
+)
+from app.utils.item_cache import item_cache
+from app.utils.db_pool import raw_pool
+from app.utils.version_store import (
+    VERSION_FIELDS,
+    STORAGE_FULL,
+    STORAGE_PACKED,
+    STORAGE_DELTA,
+    ITEM_KEYFRAME_INTERVAL,
+    encode_version,
+    unpack_fields,
+    apply_delta,
 )
 
 
@@ -22,159 +46,477 @@ from app.utils.table_models import (
 # Load environment variables
 load_dotenv()
 
+# Distance between the ranks of items appended to a test, leaving room to insert or move items
+# between them without renumbering the rest of the test
+ORDER_GAP = int(os.getenv("ORDER_GAP", "1024"))
+
+# Number of item versions loaded (or pruned) per round of queries in fetch_items_data and
+# prune_item_branches
+ITEM_LOAD_CHUNK_SIZE = 1000
+
 def get_db_connection():
     """
-    Establish a connection to the PostgreSQL database using environment variables.
+    Get a connection to the PostgreSQL database from the process-wide psycopg2 pool.
+
+    Used like a psycopg2.connect() connection; close() returns it to the pool.
+    """
+    return raw_pool.connect()
+
+def _test_filter(user_id, class_id, test_id):
+    return (
+        Tests.user_id == user_id,
+        Tests.class_id == class_id,
+        Tests.test_id == test_id
+    )
+
+def count_test_items(db_session, user_id, class_id, test_id):
+    return db_session.execute(
+        select(func.count()).select_from(Tests).where(*_test_filter(user_id, class_id, test_id))
+    ).scalar()
+
+def order_position(db_session, user_id, class_id, test_id, order_number, item_id):
+    """
+    Get the dense 1-based position of an item in its test from its stored rank.
+    """
+    rank = func.coalesce(Tests.order_number, 0)
+    before = db_session.execute(
+        select(func.count())
+        .select_from(Tests)
+        .where(
+            *_test_filter(user_id, class_id, test_id),
+            tuple_(rank, Tests.item_id) < tuple_(order_number or 0, item_id)
+        )
+    ).scalar()
+
+    return before + 1
+
+def _advance_order_counter(db_session, user_id, class_id, test_id, next_order):
+    """Move the test's order counter up to at least next_order."""
+    stmt = pg_insert(TestOrderCounters).values(
+        user_id=user_id, class_id=class_id, test_id=test_id, next_order=next_order
+    )
+    db_session.execute(
+        stmt.on_conflict_do_update(
+            index_elements=["user_id", "class_id", "test_id"],
+            set_={"next_order": func.greatest(TestOrderCounters.next_order, stmt.excluded.next_order)},
+        )
+    )
+
+def _lock_order_counter(db_session, user_id, class_id, test_id):
+    """
+    Lock the test's row in test_order_counters until the transaction ends, seeding it from
+    MAX(order_number) when missing.
+
+    Placements read the ranks of their neighbours, so two of them at the same spot would pick
+    the same ranks; holding this row serializes them per test, like the UPDATE ... RETURNING
+    of appends.
+    """
+    seed = select(
+        literal(user_id),
+        literal(class_id),
+        literal(test_id),
+        func.coalesce(func.max(Tests.order_number), 0) + ORDER_GAP,
+    ).where(*_test_filter(user_id, class_id, test_id))
+
+    # A no-op DO UPDATE locks the existing row, unlike DO NOTHING
+    db_session.execute(
+        pg_insert(TestOrderCounters)
+        .from_select(["user_id", "class_id", "test_id", "next_order"], seed)
+        .on_conflict_do_update(
+            index_elements=["user_id", "class_id", "test_id"],
+            set_={"next_order": TestOrderCounters.next_order},
+        )
+    )
+
+def rebalance_order_numbers(db_session, user_id, class_id, test_id, gap=ORDER_GAP):
+    """
+    Respace the ranks of a test to gap, 2 * gap, ... keeping the current order.
+
+    Runs only when an insert or move finds no free rank between two neighbours, which is rare
+    with the default gap. Does not commit.
+    """
+    gap = max(gap, ORDER_GAP)
+    ranked = (
+        select(
+            Tests.item_id,
+            func.row_number().over(
+                order_by=(func.coalesce(Tests.order_number, 0), Tests.item_id)
+            ).label("position"),
+        )
+        .where(*_test_filter(user_id, class_id, test_id))
+        .subquery()
+    )
+
+    db_session.execute(
+        update(Tests)
+        .where(*_test_filter(user_id, class_id, test_id), Tests.item_id == ranked.c.item_id)
+        .values(order_number=ranked.c.position * gap)
+    )
+
+    # Keep appends past the respaced ranks
+    _advance_order_counter(
+        db_session, user_id, class_id, test_id,
+        (count_test_items(db_session, user_id, class_id, test_id) + 1) * gap
+    )
+
+def _rank_neighbours(db_session, user_id, class_id, test_id, position, exclude_item_id=None):
+    """
+    Get the ranks on either side of dense position `position` and the position clamped to the
+    end of the test.
+
+    Returns:
+        Tuple[Optional[int], Optional[int], int]: (rank before, rank after, position)
     """
-    return psycopg2.connect(
-        host=os.getenv("DB_HOST"),
-        database=os.getenv("DB_NAME"),
-        user=os.getenv("DB_USER"),
-        password=os.getenv("DB_PASSWORD"),
-        port=os.getenv("DB_PORT")
+    rank = func.coalesce(Tests.order_number, 0)
+    filters = list(_test_filter(user_id, class_id, test_id))
+    if exclude_item_id is not None:
+        filters.append(Tests.item_id != exclude_item_id)
+
+    position = max(1, position)
+    stmt = (
+        select(rank)
+        .where(*filters)
+        .order_by(rank, Tests.item_id)
+        .offset(max(0, position - 2))
+        .limit(2 if position > 1 else 1)
     )
+    ranks = db_session.execute(stmt).scalars().all()
+
+    if position == 1:
+        return None, (ranks[0] if ranks else None), 1
+    if len(ranks) == 2:
+        return ranks[0], ranks[1], position
+    if len(ranks) == 1:
+        return ranks[0], None, position
 
-def fetch_next_order_number(db_session, user_id, class_id, test_id, desired_order=None, num_items=1):
+    # Past the end of the test: append after the last item
+    last = db_session.execute(
+        select(func.count(), func.max(rank)).select_from(Tests).where(*filters)
+    ).one()
+    return last[1], None, last[0] + 1
+
+def _ranks_between(before, after, num_items):
+    """Spread num_items ranks evenly between two neighbours, or None when they do not fit."""
+    low = before if before is not None else 0
+    if after is None:
+        return [low + ORDER_GAP * (i + 1) for i in range(num_items)]
+
+    step = (after - low) // (num_items + 1)
+    if step < 1:
+        return None
+    return [low + step * (i + 1) for i in range(num_items)]
+
+def place_order_numbers(db_session, user_id, class_id, test_id, position, num_items=1, exclude_item_id=None):
     """
-    Get the next order number for a test item, either at a specific position or at the end.    
+    Get ranks that put num_items new (or moved) items at dense position `position` of a test.
+
+    Only the placed items are written by the caller; the rest of the test keeps its ranks unless
+    the neighbours have no free rank left between them, in which case the test is rebalanced
+    first. Does not commit: the test's counter row stays locked until the caller commits, so
+    call this right before writing the placed items.
+
+    Args:
+        position (int): 1-based position the first item should end up at.
+        exclude_item_id (str, optional): Item being moved, ignored when finding neighbours.
+
     Returns:
-        int: The next order number to use
+        Tuple[List[int], int]: the ranks, and the position of the first item
+    """
+    _lock_order_counter(db_session, user_id, class_id, test_id)
+
+    before, after, position = _rank_neighbours(
+        db_session, user_id, class_id, test_id, position, exclude_item_id
+    )
+    ranks = _ranks_between(before, after, num_items)
+
+    if ranks is None:
+        rebalance_order_numbers(db_session, user_id, class_id, test_id, gap=num_items + 1)
+        before, after, position = _rank_neighbours(
+            db_session, user_id, class_id, test_id, position, exclude_item_id
+        )
+        ranks = _ranks_between(before, after, num_items)
+
+    if after is None and ranks:
+        # Placed at the end of the test: later appends must come after these ranks
+        _advance_order_counter(db_session, user_id, class_id, test_id, ranks[-1] + ORDER_GAP)
+
+    return ranks, position
+
+def _take_order_span(conn, user_id, class_id, test_id, span):
+    """Advance the test's order counter by span and return its new value."""
+    next_order = conn.execute(
+        update(TestOrderCounters)
+        .where(
+            TestOrderCounters.user_id == user_id,
+            TestOrderCounters.class_id == class_id,
+            TestOrderCounters.test_id == test_id
+        )
+        .values(next_order=TestOrderCounters.next_order + span)
+        .returning(TestOrderCounters.next_order)
+    ).scalar_one_or_none()
+
+    if next_order is None:
+        # First reservation in this test: seed the counter past the items it already holds.
+        # ON CONFLICT covers a concurrent request that seeded it in the meantime.
+        seed = select(
+            literal(user_id),
+            literal(class_id),
+            literal(test_id),
+            func.coalesce(func.max(Tests.order_number), 0) + ORDER_GAP + span,
+        ).where(*_test_filter(user_id, class_id, test_id))
+        stmt = (
+            pg_insert(TestOrderCounters)
+            .from_select(["user_id", "class_id", "test_id", "next_order"], seed)
+            .on_conflict_do_update(
+                index_elements=["user_id", "class_id", "test_id"],
+                set_={"next_order": TestOrderCounters.next_order + span},
+            )
+            .returning(TestOrderCounters.next_order)
+        )
+        next_order = conn.execute(stmt).scalar_one()
+
+    return next_order
+
+def reserve_order_numbers(db_session, user_id, class_id, test_id, num_items=1, desired_order=None):
+    """
+    Reserve order slots for a batch of num_items items in a test.
+
+    order_number holds sparse ranks (ORDER_GAP apart when appended) rather than dense positions,
+    so placing a batch writes only the batch's own rows. With desired_order (a 1-based position)
+    the batch goes between the two items around that position. Otherwise the ranks are taken
+    from the end of the test with a single UPDATE ... RETURNING on the test's row in
+    test_order_counters; the first reservation seeds that row from MAX(order_number).
+
+    Neither path commits the caller's session. An append advances the counter in its own short
+    transaction on a separate connection, so the counter row is not held locked while the
+    caller writes its items; ranks of a batch that is later rolled back are simply skipped. A
+    placement at desired_order runs in the caller's transaction: its ranks are only free until
+    the items are written, so the counter row stays locked until the caller commits them; an
+    append later in that same transaction would wait on it forever.
+
+    Returns:
+        Tuple[List[int], range]: ranks to store in order_number, and the dense positions the
+        items will have, in order
     """
     if desired_order is not None:
-        if isinstance(db_session, psycopg2.extensions.cursor):
-            db_session.execute(
-            update(Tests)
-            .where(
-                Tests.user_id == user_id,
-                Tests.class_id == class_id,
-                Tests.test_id == test_id,
-                Tests.order_number >= desired_order
+        ranks, position = place_order_numbers(
+            db_session, user_id, class_id, test_id, desired_order, num_items
+        )
+        return ranks, range(position, position + num_items)
+
+    span = num_items * ORDER_GAP
+    with db_session.get_bind().begin() as conn:
+        next_order = _take_order_span(conn, user_id, class_id, test_id, span)
+
+    position = count_test_items(db_session, user_id, class_id, test_id) + 1
+
+    ranks = list(range(next_order - span, next_order, ORDER_GAP))
+    return ranks, range(position, position + num_items)
+
+# Dictionary table and id column of each kind of class-scoped name
+CLASS_DICTIONARIES = {
+    "topic": (Topics, Topics.topic_id),
+    "skill": (Skills, Skills.skill_id),
+}
+
+def reserve_class_ids(db_session, user_id, class_id, kind, count):
+    """
+    Reserve count new topic or skill ids for a class.
+
+    The ids come from the class's row in class_id_counters, advanced with a single
+    UPDATE ... RETURNING. The first reservation seeds that row from the highest id already in
+    the class's dictionary, so existing ids are never handed out again. The counter row stays
+    locked until the caller commits, so call this right before writing the rows that use the ids.
+
+    Args:
+        kind (str): "topic" or "skill".
+        count (int): Number of ids to reserve.
+
+    Returns:
+        List[int]: the ids, in increasing order
+    """
+    if count <= 0:
+        return []
+
+    next_id = db_session.execute(
+        update(ClassIdCounters)
+        .where(
+            ClassIdCounters.user_id == user_id,
+            ClassIdCounters.class_id == class_id,
+            ClassIdCounters.kind == kind
+        )
+        .values(next_id=ClassIdCounters.next_id + count)
+        .returning(ClassIdCounters.next_id)
+    ).scalar_one_or_none()
+
+    if next_id is None:
+        # First reservation for this class: start past the highest id in use.
+        # ON CONFLICT covers a concurrent request that seeded the row in the meantime.
+        model, id_column = CLASS_DICTIONARIES[kind]
+        seed = select(
+            literal(user_id),
+            literal(class_id),
+            literal(kind),
+            func.coalesce(func.max(id_column), -1) + 1 + count,
+        ).where(model.user_id == user_id, model.class_id == class_id)
+        stmt = (
+            pg_insert(ClassIdCounters)
+            .from_select(["user_id", "class_id", "kind", "next_id"], seed)
+            .on_conflict_do_update(
+                index_elements=["user_id", "class_id", "kind"],
+                set_={"next_id": ClassIdCounters.next_id + count},
             )
-            .values(order_number=Tests.order_number + num_items)
+            .returning(ClassIdCounters.next_id)
         )
+        next_id = db_session.execute(stmt).scalar_one()
 
-            db_session.commit()
-            return desired_order
-        else:
-            
-            db_session.execute(
-                update(Tests)
-                .where(
-                    Tests.user_id == user_id,
-                    Tests.class_id == class_id,
-                    Tests.test_id == test_id,
-                    Tests.order_number >= desired_order
-                )
-                .values(order_number=Tests.order_number + num_items)
+    return list(range(next_id - count, next_id))
+
+def _lookup_names(db_session, user_id, class_id, wanted):
+    """
+    Look up names of several kinds with one UNION ALL query.
+
+    Args:
+        wanted (dict): {kind: [name, ...]}
+
+    Returns:
+        dict: {kind: {name: id}} for the names found
+    """
+    selects = []
+    for kind, names in wanted.items():
+        if not names:
+            continue
+        model, id_column = CLASS_DICTIONARIES[kind]
+        selects.append(
+            select(literal(kind).label("kind"), model.name, id_column.label("id")).where(
+                model.user_id == user_id,
+                model.class_id == class_id,
+                model.name.in_(names),
             )
+        )
 
-            db_session.commit()
-            return desired_order
-    
-    max_order = (
-        db_session.query(func.coalesce(func.max(Tests.order_number), 0))
-        .filter(
-            Tests.user_id == user_id,
-            Tests.class_id == class_id,
-            Tests.test_id == test_id
+    found = {kind: {} for kind in wanted}
+    if not selects:
+        return found
+
+    stmt = selects[0] if len(selects) == 1 else union_all(*selects)
+    for kind, name, name_id in db_session.execute(stmt).all():
+        found[kind][name] = name_id
+    return found
+
+def intern_names_many(db_session, user_id, class_id, names_by_kind):
+    """
+    Get the ids of topic and skill names in a class's dictionaries, creating the missing ones.
+
+    Known names of every kind are looked up with one query; the missing ones of each kind get
+    ids from reserve_class_ids and are inserted with one multi-row INSERT ... ON CONFLICT DO
+    NOTHING. A name another request created in the meantime is read back instead. Does not
+    commit.
+
+    Args:
+        names_by_kind (dict): {kind: names}, kind being "topic" or "skill" and names an
+            iterable of names, duplicates allowed.
+
+    Returns:
+        dict: {kind: {name: id}}
+    """
+    wanted = {
+        kind: list(dict.fromkeys(name for name in names if name))
+        for kind, names in names_by_kind.items()
+    }
+    ids = _lookup_names(db_session, user_id, class_id, wanted)
+
+    raced = {}
+    for kind, names in wanted.items():
+        missing = [name for name in names if name not in ids[kind]]
+        if not missing:
+            continue
+
+        model, id_column = CLASS_DICTIONARIES[kind]
+        new_ids = reserve_class_ids(db_session, user_id, class_id, kind, len(missing))
+        stmt = (
+            pg_insert(model)
+            .values([
+                {"user_id": user_id, "class_id": class_id, id_column.key: new_id, "name": name}
+                for name, new_id in zip(missing, new_ids)
+            ])
+            .on_conflict_do_nothing(index_elements=["user_id", "class_id", "name"])
+            .returning(model.name, id_column)
         )
-        .scalar()
-    )
+        ids[kind].update(db_session.execute(stmt).all())
 
-    return max_order + 1
+        raced[kind] = [name for name in missing if name not in ids[kind]]
+
+    if any(raced.values()):
+        for kind, found in _lookup_names(db_session, user_id, class_id, raced).items():
+            ids[kind].update(found)
+
+    return ids
+
+def intern_names(db_session, user_id, class_id, kind, names):
+    """
+    Get the ids of topic or skill names of one kind; see intern_names_many.
+
+    Returns:
+        dict: {name: id}
+    """
+    return intern_names_many(db_session, user_id, class_id, {kind: names})[kind]
 
-def fetch_highest_topic_id(db_session, user_id, class_id):
+def bump_item_version(db_session, user_id, class_id, item_id, expected_version):
+    """
+    Claim the next version number of an item and make it current, if the item is still at
+    expected_version.
+
+    A single UPDATE ... RETURNING both checks and moves the pointer, so two concurrent edits of
+    the same version cannot both succeed. The new version is numbered past every version ever
+    written; editing an undone version marks the item for prune_item_branches. Does not commit.
+
+    Returns:
+        Optional[int]: the new version, or None when the item is missing or has moved on
+    """
     stmt = (
-        select(ItemTopics.topic_id)
+        update(ItemCurrent)
         .where(
-            ItemTopics.user_id == user_id,
-            ItemTopics.class_id == class_id,
+            ItemCurrent.user_id == user_id,
+            ItemCurrent.class_id == class_id,
+            ItemCurrent.item_id == item_id,
+            ItemCurrent.version == expected_version,
+        )
+        .values(
+            # Every SET expression sees the row as it was before the update
+            version=ItemCurrent.latest_version + 1,
+            latest_version=ItemCurrent.latest_version + 1,
+            prune_pending=or_(ItemCurrent.prune_pending, ItemCurrent.version != ItemCurrent.latest_version),
         )
-        .order_by(desc(ItemTopics.topic_id))
-        .limit(1)
+        .returning(ItemCurrent.version)
     )
 
     return db_session.execute(stmt).scalar_one_or_none()
-   
-def insert_item_current(db_session, user_id, class_id, item_id, version):
-    try:
-        curr_item = ItemCurrent(
-            user_id = user_id,
-            class_id = class_id, 
-            item_id = item_id, 
-            version = version
-        )
 
-        db_session.add(curr_item)
-    except Exception as e:
-        print(f"Error inserting into item current: {e}")
-        db_session.rollback()
+def insert_item_version(db_session, user_id, class_id, item_id, version, parent_version, fields, topic_ids=(), skill_ids=()):
+    """
+    Write one item version and its topic and skill links with a single statement.
 
-def insert_item_history(db_session, user_id, class_id, item_id, version, question, answer_part, question_type, difficulty, wrong_answer_explanation):
-    try:
-        history_item = ItemHistory(
-                user_id = user_id,
-                class_id = class_id,
-                item_id = item_id,
-                version = version,
-                question_part = question,
-                answer_part = answer_part,
-                format = question_type,
-                difficulty = difficulty,
-                wrong_answer_explanation = wrong_answer_explanation
-
-        )
-        db_session.add(history_item)
-    except Exception as e:
-        print(f"Error inserting into item history: {e}")
-        db_session.rollback()
+    The item_topics and item_skills inserts ride along as data-modifying CTEs of the
+    item_history insert, so the whole version costs one round trip. Does not commit.
 
-def insert_item_topics(db_session, user_id, class_id, item_id, version, topic_id, topic_name):
-    try:
-        topic = ItemTopics(
-                user_id = user_id,
-                class_id = class_id,
-                item_id = item_id,
-                version = version,
-                topic_id = topic_id, 
-                topic_name = topic_name
-        )
-        
-        db_session.add(topic)
-    except Exception as e:
-        print(f"Error inserting topics: {e}")
-        db_session.rollback()
+    Args:
+        fields (dict): question_part, answer_part, format, difficulty, wrong_answer_explanation.
+        topic_ids (Iterable[int]): Interned topic ids.
+        skill_ids (Iterable[int]): Interned skill ids.
+    """
+    key = {"user_id": user_id, "class_id": class_id, "item_id": item_id, "version": version}
+    stmt = insert(ItemHistory).values(**key, parent_version=parent_version, **fields)
 
-def insert_item_skills(db_session, user_id, class_id, item_id, version, skill_id, skill_name):
-    try:
-        skill = ItemSkills(
-                user_id = user_id,
-                class_id = class_id,
-                item_id = item_id,
-                version = version,
-                skill_id = skill_id, 
-                skill_name = skill_name
-        )
-        
-        db_session.add(skill)
-    except Exception as e:
-        print(f"Error inserting skills: {e}")
-        db_session.rollback()
+    topic_rows = [{**key, "topic_id": topic_id} for topic_id in dict.fromkeys(topic_ids)]
+    if topic_rows:
+        stmt = stmt.add_cte(insert(ItemTopics).values(topic_rows).cte("new_item_topics"))
 
-def insert_tests(db_session, user_id, class_id, test_id, item_id, order_number):
-    try:
-        new_test = Tests(
-            user_id=user_id,
-            class_id=class_id,
-            test_id=test_id,
-            item_id=item_id,
-            order_number=order_number,
-        )
-        db_session.add(new_test)
+    skill_rows = [{**key, "skill_id": skill_id} for skill_id in dict.fromkeys(skill_ids)]
+    if skill_rows:
+        stmt = stmt.add_cte(insert(ItemSkills).values(skill_rows).cte("new_item_skills"))
 
-    except Exception as e:
-        print(f"Error inserting into tests: {e}")
-        db_session.rollback()
+    db_session.execute(stmt)
 
 def select_unique_class(db_session, user_id, class_id):
     existing_class = (
@@ -191,19 +533,6 @@ def select_unique_class(db_session, user_id, class_id):
         
         return existing_class
     
-def fetch_highest_skill_id(db_session, userid, classid):
-    stmt = (
-        select(ItemSkills.skill_id)
-        .where(
-            ItemSkills.user_id == userid,
-            ItemSkills.class_id == classid,
-        )
-        .order_by(desc(ItemSkills.skill_id))
-        .limit(1)
-    )
-
-    return db_session.execute(stmt).scalar_one_or_none()
-
 def select_requirements(db_session, user_id, req_id):
     stmt = (
         select(Requirements.content, Requirements.question, Requirements.answer, Requirements.wrong_answer_explanation, Requirements.topics, Requirements.skills)
@@ -215,101 +544,169 @@ def select_requirements(db_session, user_id, req_id):
 
     return db_session.execute(stmt).one_or_none()
 
+class ItemBatchWriter:
+    """
+    Collects a whole generation result and writes it with one multi-row INSERT per table.
+
+    Usage:
+        writer = ItemBatchWriter(db.session, user_id, class_id, test_id)
+        writer.add_item(item_id, question, answer_part, "MC", "Easy", explanation,
+                        topics=["Derivatives"], skills=["Chain rule"],
+                        order_number=3)
+        writer.flush()
+        db.session.commit()
+
+    flush() does not commit, so the rows land in the caller's transaction. Batches of at least
+    COPY_THRESHOLD rows for a table are streamed with COPY instead of INSERT.
+    """
+
+    COPY_THRESHOLD = 500
+
+    def __init__(self, db_session, user_id, class_id, test_id):
+        self.db_session = db_session
+        self.user_id = user_id
+        self.class_id = class_id
+        self.test_id = test_id
+
+        self.current_rows = []
+        self.history_rows = []
+        self.test_rows = []
+        self.topic_rows = []
+        self.skill_rows = []
+
+    def __len__(self):
+        return len(self.current_rows)
+
+    def add_item(self, item_id, question, answer_part, question_type, difficulty, wrong_answer_explanation, topics=(), skills=(), order_number=None, version=0):
+        """
+        Queue one item.
+
+        Args:
+            topics (Iterable[str]): Topic names, interned in the class's dictionary on flush.
+            skills (Iterable[str]): Skill names, same.
+        """
+        key = {
+            "user_id": self.user_id,
+            "class_id": self.class_id,
+            "item_id": item_id,
+            "version": version,
+        }
+
+        self.current_rows.append({**key, "latest_version": version})
+        self.history_rows.append(
+            {
+                **key,
+                "question_part": question,
+                "answer_part": answer_part,
+                "format": question_type,
+                "difficulty": difficulty,
+                "wrong_answer_explanation": wrong_answer_explanation,
+            }
+        )
+        self.test_rows.append(
+            {
+                "user_id": self.user_id,
+                "class_id": self.class_id,
+                "test_id": self.test_id,
+                "item_id": item_id,
+                "order_number": order_number,
+            }
+        )
+        # A name listed twice links the item once
+        for topic_name in dict.fromkeys(name for name in topics if name):
+            self.topic_rows.append({**key, "topic_id": topic_name})
+        for skill_name in dict.fromkeys(name for name in skills if name):
+            self.skill_rows.append({**key, "skill_id": skill_name})
+
+    def flush(self):
+        """
+        Write every queued row. The class row is resolved once for the whole batch.
+        """
+        if not self.current_rows:
+            return
+
+        # Swap the queued names for their dictionary ids, one lookup for the whole batch
+        kinds = (("topic", self.topic_rows), ("skill", self.skill_rows))
+        ids = intern_names_many(
+            self.db_session,
+            self.user_id,
+            self.class_id,
+            {kind: [row[f"{kind}_id"] for row in rows] for kind, rows in kinds},
+        )
+        for kind, rows in kinds:
+            column = f"{kind}_id"
+            for row in rows:
+                row[column] = ids[kind][row[column]]
+
+        select_unique_class(self.db_session, self.user_id, self.class_id)
+        self.db_session.flush()
+
+        # item_current first to satisfy the foreign key in item_history
+        for model, rows in (
+            (ItemCurrent, self.current_rows),
+            (ItemHistory, self.history_rows),
+            (Tests, self.test_rows),
+            (ItemTopics, self.topic_rows),
+            (ItemSkills, self.skill_rows),
+        ):
+            if len(rows) >= self.COPY_THRESHOLD:
+                self._copy(model, rows)
+            elif rows:
+                self.db_session.execute(insert(model).values(rows))
+
+        self.current_rows = []
+        self.history_rows = []
+        self.test_rows = []
+        self.topic_rows = []
+        self.skill_rows = []
+
+    def _copy(self, model, rows):
+        """Stream rows with COPY on the session's own connection, inside its transaction."""
+        columns = list(rows[0].keys())
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, quoting=csv.QUOTE_NONNUMERIC)  # None -> unquoted empty -> NULL
+        for row in rows:
+            writer.writerow([row[column] for column in columns])
+        buffer.seek(0)
+
+        cursor = self.db_session.connection().connection.cursor()
+        try:
+            cursor.copy_expert(
+                f"COPY {model.__tablename__} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)",
+                buffer,
+            )
+        finally:
+            cursor.close()
+
 def add_to_database(db_session, user_id, class_id, test_id, questions, order_number=None):
     try:
-       
-        existing_class = (
-            db_session.query(UserClasses)
-            .filter_by(user_id=user_id, class_id=class_id)
-            .first()
-        )
+        writer = ItemBatchWriter(db_session, user_id, class_id, test_id)
+        num_items = sum(len(question_set["questions"]) for question_set in questions)
 
-        if not existing_class:
-            new_uc = UserClasses(user_id=user_id, class_id=class_id)
-            db_session.add(new_uc)
+        # Reserve the order slots of the whole batch up front
+        order_ranks, _ = reserve_order_numbers(db_session, user_id, class_id, test_id, num_items, order_number)
 
         # Iterate through each topic and subtopic in the list of questions
         for question_set in questions:
-            topic = question_set["topic"]
-            subtopic = question_set["subtopic"]
             question_list = question_set["questions"]  # Now a list
 
-
             for question in question_list:
-                item_id = f"{test_id}_{str(uuid.uuid4())[:12]}"   # Unique item ID
-                version = 0
-
-                # Extract common fields
-                question_part = question["question_part"]
-                difficulty = question["difficulty"]
-                format_type = question["format"]
-                    
-                formatted_question_part = question_part  
-                answer_part = question["answer_part"] 
+                item_id = question.get("item_id") or f"{test_id}_{str(uuid.uuid4())[:12]}"   # Unique item ID
                 wrong_answer_explanation = question["wrong_answer_explanation"]
 
-                # Insert into item_current
-                item_current = ItemCurrent(
-                    user_id=user_id,
-                    class_id=class_id,
-                    item_id=item_id,
-                    version=version,
-                )
-                db_session.add(item_current)
-
-
-                item_history = ItemHistory(
-                    user_id=user_id,
-                    class_id=class_id,
-                    item_id=item_id,
-                    version=version,
-                    question_part=formatted_question_part,
-                    answer_part=answer_part,
-                    format=format_type,
-                    difficulty=difficulty,
-                    wrong_answer_explanation=(
-                        wrong_answer_explanation if wrong_answer_explanation else None
-                    ),
-                )
-                db_session.add(item_history)
-
-                # Insert into item_topics
-                for related_topic in question.get("relatedtopics", []):
-                    related_topic_id = f"{related_topic.replace(' ', '_')}_{class_id}"
-                    item_topic = ItemTopics(
-                        user_id=user_id,
-                        class_id=class_id,
-                        item_id=item_id,
-                        version=version,
-                        topic_id=related_topic_id,
-                        topic_name=related_topic,
-                    )
-                    db_session.add(item_topic)
-
-                # Insert into item_skills
-                for skill_name in question.get("relatedskills", []):
-                    skill_id = f"{skill_name.replace(' ', '_')}_{class_id}"
-                    item_skill = ItemSkills(
-                        user_id=user_id,
-                        class_id=class_id,
-                        item_id=item_id,
-                        version=version,
-                        skill_id=skill_id,
-                        skill_name=skill_name,
-                    )
-                    db_session.add(item_skill)
-
-                new_order = fetch_next_order_number(db_session, user_id, class_id, test_id, order_number)
-
-                # Link each question to the test in the `tests` table
-                test_row = Tests(
-                    user_id=user_id,
-                    class_id=class_id,
-                    test_id=test_id,
-                    item_id=item_id,
-                    order_number=new_order,
+                writer.add_item(
+                    item_id,
+                    question["question_part"],
+                    question["answer_part"],
+                    question["format"],
+                    question["difficulty"],
+                    wrong_answer_explanation if wrong_answer_explanation else None,
+                    topics=question.get("relatedtopics", []),
+                    skills=question.get("relatedskills", []),
+                    order_number=order_ranks[len(writer)],
                 )
-                db_session.add(test_row)
+
+        writer.flush()
 
         # Commit transaction
         db_session.commit()
@@ -334,66 +731,907 @@ def fetch_item_latest_version(db_session, user_id, class_id, item_id):
     except Exception as e:
         raise Exception(f"Failed to fetch latest version: {e}")
     
-def fetch_item_data(db_session, user_id, class_id, item_id, version):
-    try:
-        # Get the item details from item_history
-        fetch_all_from_item_history = (
-        select(ItemHistory.question_part, ItemHistory.answer_part, ItemHistory.format, ItemHistory.difficulty, ItemHistory.wrong_answer_explanation)
+def fetch_items_latest_versions(db_session, user_id, class_id, item_ids, with_latest=False):
+    """
+    Get the current version of many items of a class in a single query.
+
+    Args:
+        with_latest (bool): Also return latest_version, the highest version ever written. The
+            next edit of an item is numbered latest_version + 1, which after an undo is not
+            version + 1.
+
+    Returns:
+        dict: {item_id: version}, or {item_id: (version, latest_version)} with with_latest,
+        for every item found in item_current
+    """
+    stmt = select(ItemCurrent.item_id, ItemCurrent.version, ItemCurrent.latest_version).where(
+        ItemCurrent.user_id == user_id,
+        ItemCurrent.class_id == class_id,
+        ItemCurrent.item_id.in_(list(item_ids)),
+    )
+
+    rows = db_session.execute(stmt).all()
+    if with_latest:
+        return {item_id: (version, latest_version) for item_id, version, latest_version in rows}
+    return {item_id: version for item_id, version, _ in rows}
+
+def fetch_item_next_version(db_session, user_id, class_id, item_id):
+    """
+    Get the number the next edit of an item will get (see bump_item_version).
+    """
+    latest_version = db_session.execute(
+        select(ItemCurrent.latest_version).filter_by(user_id=user_id, class_id=class_id, item_id=item_id)
+    ).scalar_one_or_none()
+
+    if latest_version is None:
+        raise Exception("Item not found")
+    return latest_version + 1
+
+def fetch_parent_version(db_session, user_id, class_id, item_id, version):
+    """
+    Get the version an item version was edited from, or None for a first version.
+    """
+    stmt = select(ItemHistory.parent_version).where(
+        ItemHistory.user_id == user_id,
+        ItemHistory.class_id == class_id,
+        ItemHistory.item_id == item_id,
+        ItemHistory.version == version,
+    )
+
+    return db_session.execute(stmt).scalar_one_or_none()
+
+def _move_item_pointer(db_session, user_id, class_id, item_id, target):
+    """
+    Point item_current at the version selected by target, a scalar subquery correlated to the
+    item_current row, with a single UPDATE ... RETURNING. History rows are never touched.
+
+    Returns:
+        Optional[int]: the new current version, or None when target selects nothing
+    """
+    stmt = (
+        update(ItemCurrent)
+        .where(
+            ItemCurrent.user_id == user_id,
+            ItemCurrent.class_id == class_id,
+            ItemCurrent.item_id == item_id,
+            target.is_not(None),
+        )
+        .values(version=target)
+        .returning(ItemCurrent.version)
+    )
+
+    return db_session.execute(stmt).scalar_one_or_none()
+
+def undo_item_version(db_session, user_id, class_id, item_id):
+    """
+    Move an item back to the version its current version was edited from. Does not commit.
+
+    Returns:
+        Optional[int]: the new current version, or None when there is nothing to undo
+    """
+    parent = (
+        select(ItemHistory.parent_version)
+        .where(
+            ItemHistory.user_id == ItemCurrent.user_id,
+            ItemHistory.class_id == ItemCurrent.class_id,
+            ItemHistory.item_id == ItemCurrent.item_id,
+            ItemHistory.version == ItemCurrent.version,
+        )
+        .scalar_subquery()
+    )
+
+    return _move_item_pointer(db_session, user_id, class_id, item_id, parent)
+
+def redo_item_version(db_session, user_id, class_id, item_id):
+    """
+    Move an item forward to the newest version edited from its current version. Does not commit.
+
+    Returns:
+        Optional[int]: the new current version, or None when there is nothing to redo
+    """
+    newest_child = (
+        select(func.max(ItemHistory.version))
+        .where(
+            ItemHistory.user_id == ItemCurrent.user_id,
+            ItemHistory.class_id == ItemCurrent.class_id,
+            ItemHistory.item_id == ItemCurrent.item_id,
+            ItemHistory.parent_version == ItemCurrent.version,
+        )
+        .scalar_subquery()
+    )
+
+    return _move_item_pointer(db_session, user_id, class_id, item_id, newest_child)
+
+def prune_item_branches(db_session, batch_size=200):
+    """
+    Delete the versions of up to batch_size items that undo and redo can no longer reach.
+
+    A version stays reachable while it is an ancestor of the current version (undo) or on the
+    chain of newest children below it (redo). Everything else was abandoned when an edit was
+    made after an undo. Unreachable versions only ever have unreachable descendants, so no
+    delta kept in history is taken against a pruned version. Meant to be run repeatedly by a
+    background job until it returns 0.
+
+    Returns:
+        int: number of items processed
+    """
+    items = db_session.execute(
+        select(ItemCurrent.user_id, ItemCurrent.class_id, ItemCurrent.item_id, ItemCurrent.version)
+        .where(ItemCurrent.prune_pending)
+        .limit(batch_size)
+        .with_for_update(skip_locked=True)
+    ).all()
+    if not items:
+        return 0
+
+    pointers = {(user_id, class_id, item_id): version for user_id, class_id, item_id, version in items}
+    tree_stmt = select(
+        ItemHistory.user_id,
+        ItemHistory.class_id,
+        ItemHistory.item_id,
+        ItemHistory.version,
+        ItemHistory.parent_version,
+    ).where(tuple_(ItemHistory.user_id, ItemHistory.class_id, ItemHistory.item_id).in_(list(pointers)))
+
+    parents = {}
+    for user_id, class_id, item_id, version, parent_version in db_session.execute(tree_stmt).all():
+        parents.setdefault((user_id, class_id, item_id), {})[version] = parent_version
+
+    pruned = []
+    for key, pointer in pointers.items():
+        item_parents = parents.get(key, {})
+        newest_child = {}
+        for version, parent_version in item_parents.items():
+            if parent_version is not None and version > newest_child.get(parent_version, -1):
+                newest_child[parent_version] = version
+
+        reachable = set()
+        version = pointer
+        while version is not None and version not in reachable:
+            reachable.add(version)
+            version = item_parents.get(version)
+        version = newest_child.get(pointer)
+        while version is not None and version not in reachable:
+            reachable.add(version)
+            version = newest_child.get(version)
+
+        pruned.extend((*key, version) for version in item_parents if version not in reachable)
+
+    for start in range(0, len(pruned), ITEM_LOAD_CHUNK_SIZE):
+        chunk = pruned[start:start + ITEM_LOAD_CHUNK_SIZE]
+        for model in (ItemTopics, ItemSkills, ItemHistory):
+            db_session.execute(
+                model.__table__.delete().where(
+                    tuple_(model.user_id, model.class_id, model.item_id, model.version).in_(chunk)
+                )
+            )
+
+    db_session.execute(
+        update(ItemCurrent)
+        .where(tuple_(ItemCurrent.user_id, ItemCurrent.class_id, ItemCurrent.item_id).in_(list(pointers)))
+        .values(prune_pending=False)
+    )
+    db_session.commit()
+
+    for user_id, class_id, item_id, version in pruned:
+        item_cache.invalidate(user_id, class_id, item_id, version)
+
+    return len(items)
+
+def _select_history_rows(db_session, user_id, keys):
+    stmt = (
+        select(
+            ItemHistory.class_id,
+            ItemHistory.item_id,
+            ItemHistory.version,
+            ItemHistory.question_part,
+            ItemHistory.answer_part,
+            ItemHistory.format,
+            ItemHistory.difficulty,
+            ItemHistory.wrong_answer_explanation,
+            ItemHistory.storage,
+            ItemHistory.base_version,
+            ItemHistory.delta_depth,
+            ItemHistory.payload,
+        )
+        .where(
+            ItemHistory.user_id == user_id,
+            tuple_(ItemHistory.class_id, ItemHistory.item_id, ItemHistory.version).in_(keys),
+        )
+    )
+
+    return {tuple(row[:3]): row for row in db_session.execute(stmt).all()}
+
+def load_item_versions(db_session, user_id, keys):
+    """
+    Load the stored fields of many item versions, whatever their storage.
+
+    Delta rows need the versions they were taken against; those are fetched one round per
+    chain step for the whole batch, so a batch costs at most ITEM_KEYFRAME_INTERVAL extra
+    queries however many items it holds.
+
+    Args:
+        keys (Iterable[Tuple[str, str, int]]): (class_id, item_id, version) of each version.
+
+    Returns:
+        dict: {key: {question_part, answer_part, wrong_answer_explanation, format, difficulty,
+            storage, delta_depth}} for every key found in item_history
+    """
+    keys = list(dict.fromkeys(keys))
+    rows = _select_history_rows(db_session, user_id, keys) if keys else {}
+
+    # Fetch the bases of delta rows until every chain reaches a keyframe or a full row
+    while True:
+        missing = {
+            (row.class_id, row.item_id, row.base_version)
+            for row in rows.values()
+            if row.storage == STORAGE_DELTA
+        } - rows.keys()
+        if not missing:
+            break
+
+        found = _select_history_rows(db_session, user_id, list(missing))
+        if not found:
+            break
+        rows.update(found)
+
+    resolved = {}
+
+    def fields_of(key):
+        if key in resolved:
+            return resolved[key]
+
+        row = rows.get(key)
+        if row is None:
+            raise Exception(f"Base version of a compacted item version is missing: {key}")
+
+        if row.storage == STORAGE_PACKED:
+            fields = unpack_fields(row.payload)
+        elif row.storage == STORAGE_DELTA:
+            fields = apply_delta(fields_of((row.class_id, row.item_id, row.base_version)), row.payload)
+        else:
+            fields = {name: getattr(row, name) for name in VERSION_FIELDS}
+
+        fields.update(
+            format=row.format,
+            difficulty=row.difficulty,
+            storage=row.storage,
+            delta_depth=row.delta_depth,
+        )
+        resolved[key] = fields
+        return fields
+
+    return {key: fields_of(key) for key in keys if key in rows}
+
+def compact_item_history(db_session, batch_size=500, keyframe_interval=None):
+    """
+    Rewrite up to batch_size full item_history rows that are no longer current in compact form.
+
+    Rows are taken per item in ascending version order, and a parent always has a lower version
+    than its children, so a version's parent has already been compacted (and its chain depth is
+    known) by the time the version itself is. The version an
+    item_current row points at is never compacted, which keeps the hot read path free of
+    reconstruction. After an undo that version can be the parent of a version being compacted;
+    its depth will change once it is compacted itself, so such children become keyframes
+    instead of deltas against it. A full row that other rows are already delta-encoded against
+    (a copy source decoded by _materialize_copy_sources) is left as it is, since re-encoding it
+    would change the depth those rows were stored with. Meant to be run repeatedly by a
+    background job until it returns 0.
+
+    Returns:
+        int: number of rows compacted
+    """
+    keyframe_interval = keyframe_interval or ITEM_KEYFRAME_INTERVAL
+
+    dependent = aliased(ItemHistory)
+    has_dependents = exists().where(
+        dependent.user_id == ItemHistory.user_id,
+        dependent.class_id == ItemHistory.class_id,
+        dependent.item_id == ItemHistory.item_id,
+        dependent.base_version == ItemHistory.version,
+    )
+
+    stmt = (
+        select(
+            ItemHistory.user_id,
+            ItemHistory.class_id,
+            ItemHistory.item_id,
+            ItemHistory.version,
+            ItemHistory.parent_version,
+        )
+        .join(
+            ItemCurrent,
+            (ItemCurrent.user_id == ItemHistory.user_id)
+            & (ItemCurrent.class_id == ItemHistory.class_id)
+            & (ItemCurrent.item_id == ItemHistory.item_id),
+        )
+        .where(
+            ItemHistory.storage == STORAGE_FULL,
+            ItemHistory.version != ItemCurrent.version,
+            ~has_dependents,
+        )
+        .order_by(ItemHistory.user_id, ItemHistory.class_id, ItemHistory.item_id, ItemHistory.version)
+        .limit(batch_size)
+    )
+    candidates = db_session.execute(stmt).all()
+    if not candidates:
+        return 0
+
+    by_user = {}
+    for user_id, class_id, item_id, version, parent_version in candidates:
+        by_user.setdefault(user_id, []).append((class_id, item_id, version, parent_version))
+
+    updates = []
+    for user_id, rows in by_user.items():
+        keys = [(class_id, item_id, version) for class_id, item_id, version, _ in rows]
+        parents = [
+            (class_id, item_id, parent_version)
+            for class_id, item_id, _, parent_version in rows
+            if parent_version is not None
+        ]
+        versions = load_item_versions(db_session, user_id, keys + parents)
+
+        for class_id, item_id, version, parent_version in rows:
+            fields = versions.get((class_id, item_id, version))
+            if fields is None:
+                continue
+
+            parent = versions.get((class_id, item_id, parent_version))
+            if parent is not None and parent["storage"] == STORAGE_FULL:
+                # A parent still full is the current version or a materialized copy source,
+                # whose depth does not describe a chain: start a new one
+                parent = None
+
+            encoded = encode_version(
+                fields,
+                base_version=parent_version if parent is not None else None,
+                base_fields=parent,
+                base_depth=parent["delta_depth"] if parent is not None else None,
+                keyframe_interval=keyframe_interval,
+            )
+
+            # Later versions of the same item in this batch chain onto the new encoding
+            fields["storage"] = encoded["storage"]
+            fields["delta_depth"] = encoded["delta_depth"]
+
+            updates.append(
+                {
+                    "user_id": user_id,
+                    "class_id": class_id,
+                    "item_id": item_id,
+                    "version": version,
+                    **encoded,
+                    **{name: None for name in VERSION_FIELDS},
+                }
+            )
+
+    if updates:
+        # ORM bulk UPDATE by primary key, one executemany for the whole batch
+        db_session.execute(update(ItemHistory), updates)
+    db_session.commit()
+
+    return len(updates)
+
+def _create_copy_map(db_session):
+    """
+    Create the temporary old item id -> new item id table the copy statements join against.
+
+    The table only lives in the current transaction; _copy_mapped_items drops it once done.
+    """
+    copy_map = Table(
+        "copy_map",
+        MetaData(),
+        Column("old_item_id", String(255), primary_key=True),
+        Column("new_item_id", String(255), nullable=False),
+        Column("order_number", Integer),
+        prefixes=["TEMPORARY"],
+        postgresql_on_commit="DROP",
+    )
+    copy_map.create(db_session.connection())
+    return copy_map
+
+def _copy_suffix(item_id):
+    """SQL expression for a random 6-hex-digit suffix of a copied item id."""
+    return func.substr(func.md5(cast(func.random(), Text) + item_id), 1, 6)
+
+def _free_copy_ids(db_session, user_id, class_id, copy_map):
+    """
+    Draw new suffixes for mapped new_item_ids that already exist in the class, until none does.
+    """
+    while True:
+        taken = exists().where(
+            ItemCurrent.user_id == user_id,
+            ItemCurrent.class_id == class_id,
+            ItemCurrent.item_id == copy_map.c.new_item_id,
+        )
+        renamed = db_session.execute(
+            update(copy_map)
+            .where(taken)
+            .values(new_item_id=copy_map.c.old_item_id + "_" + _copy_suffix(copy_map.c.old_item_id))
+        ).rowcount
+        if not renamed:
+            return
+
+def _materialize_copy_sources(db_session, user_id, class_id, copy_map):
+    """
+    Rewrite the current versions of the mapped items as full rows where they were compacted.
+
+    Versions are normally only compacted once they stop being current, but undo can point an
+    item back at a packed or delta row. The copy statements only copy full rows, so those few
+    are decoded here first; the new row is equivalent, so versions stored as deltas against it
+    still decode. delta_depth is left as it was: the depths of those versions were counted from
+    it and stay an upper bound on their now shorter chains, and compact_item_history does not
+    re-encode a row other rows depend on.
+    """
+    stmt = (
+        select(ItemHistory.class_id, ItemHistory.item_id, ItemHistory.version)
+        .join(
+            ItemCurrent,
+            (ItemCurrent.user_id == ItemHistory.user_id)
+            & (ItemCurrent.class_id == ItemHistory.class_id)
+            & (ItemCurrent.item_id == ItemHistory.item_id)
+            & (ItemCurrent.version == ItemHistory.version),
+        )
+        .join(copy_map, copy_map.c.old_item_id == ItemHistory.item_id)
         .where(
             ItemHistory.user_id == user_id,
             ItemHistory.class_id == class_id,
-            ItemHistory.item_id == item_id, 
-            ItemHistory.version == version
+            ItemHistory.storage != STORAGE_FULL,
         )
+    )
+    keys = [tuple(row) for row in db_session.execute(stmt).all()]
+    if not keys:
+        return
+
+    versions = load_item_versions(db_session, user_id, keys)
+    db_session.execute(
+        update(ItemHistory),
+        [
+            {
+                "user_id": user_id,
+                "class_id": key[0],
+                "item_id": key[1],
+                "version": key[2],
+                "storage": STORAGE_FULL,
+                "base_version": None,
+                "payload": None,
+                **{name: fields[name] for name in VERSION_FIELDS},
+            }
+            for key, fields in versions.items()
+        ],
+    )
+
+def _copy_mapped_items(db_session, user_id, class_id, copy_map, test_id=None):
+    """
+    Copy the current version of every item in copy_map to its new_item_id as version 0.
+
+    item_current, item_history, item_topics, item_skills and, with test_id, tests rows are all
+    written by one INSERT ... SELECT with data-modifying CTEs, so no item data leaves the
+    database. Drops copy_map. Does not commit.
+
+    Returns:
+        int: number of items copied
+    """
+    _materialize_copy_sources(db_session, user_id, class_id, copy_map)
+
+    sources = (
+        select(
+            copy_map.c.old_item_id,
+            copy_map.c.new_item_id,
+            copy_map.c.order_number,
+            ItemCurrent.version,
         )
-        item_data = db_session.execute(fetch_all_from_item_history).one_or_none()
-        
-        if not item_data: raise Exception("Item not found in history.")
-        
+        .join(ItemCurrent, ItemCurrent.item_id == copy_map.c.old_item_id)
+        .where(ItemCurrent.user_id == user_id, ItemCurrent.class_id == class_id)
+        .cte("copy_sources")
+    )
+
+    def copied_version_of(table):
+        return (
+            (table.user_id == user_id)
+            & (table.class_id == class_id)
+            & (table.item_id == sources.c.old_item_id)
+            & (table.version == sources.c.version)
+        )
+
+    history = insert(ItemHistory).from_select(
+        ["user_id", "class_id", "item_id", "version", "question_part", "answer_part",
+         "format", "difficulty", "wrong_answer_explanation"],
+        select(
+            literal(user_id),
+            literal(class_id),
+            sources.c.new_item_id,
+            literal(0),
+            ItemHistory.question_part,
+            ItemHistory.answer_part,
+            ItemHistory.format,
+            ItemHistory.difficulty,
+            ItemHistory.wrong_answer_explanation,
+        ).join(sources, copied_version_of(ItemHistory)),
+    )
+    topics = insert(ItemTopics).from_select(
+        ["user_id", "class_id", "item_id", "version", "topic_id"],
+        select(
+            literal(user_id), literal(class_id), sources.c.new_item_id, literal(0), ItemTopics.topic_id
+        ).join(sources, copied_version_of(ItemTopics)),
+    )
+    skills = insert(ItemSkills).from_select(
+        ["user_id", "class_id", "item_id", "version", "skill_id"],
+        select(
+            literal(user_id), literal(class_id), sources.c.new_item_id, literal(0), ItemSkills.skill_id
+        ).join(sources, copied_version_of(ItemSkills)),
+    )
+
+    stmt = (
+        insert(ItemCurrent)
+        .from_select(
+            ["user_id", "class_id", "item_id", "version", "latest_version"],
+            select(literal(user_id), literal(class_id), sources.c.new_item_id, literal(0), literal(0)),
+        )
+        .add_cte(sources)
+        .add_cte(history.cte("copied_history"))
+        .add_cte(topics.cte("copied_topics"))
+        .add_cte(skills.cte("copied_skills"))
+    )
+
+    if test_id is not None:
+        tests = insert(Tests).from_select(
+            ["user_id", "class_id", "test_id", "item_id", "order_number"],
+            select(
+                literal(user_id), literal(class_id), literal(test_id),
+                sources.c.new_item_id, sources.c.order_number,
+            ),
+        )
+        stmt = stmt.add_cte(tests.cte("copied_tests"))
+
+    copied = db_session.execute(stmt).rowcount
+    copy_map.drop(db_session.connection())
+
+    return copied
+
+def copy_items(db_session, user_id, class_id, test_id, item_ids):
+    """
+    Duplicate items of a test inside the database.
+
+    The copies go in as one block right after the last of the originals, in the order the
+    originals have in the test. Does not commit.
+
+    Returns:
+        dict: {old_item_id: new_item_id} for every item of item_ids found in the test
+    """
+    originals = db_session.execute(
+        select(Tests.item_id, Tests.order_number)
+        .where(*_test_filter(user_id, class_id, test_id), Tests.item_id.in_(list(item_ids)))
+        .order_by(func.coalesce(Tests.order_number, 0), Tests.item_id)
+    ).all()
+    if not originals:
+        return {}
+
+    last_item_id, last_order = originals[-1]
+    last_position = order_position(db_session, user_id, class_id, test_id, last_order, last_item_id)
+    ranks, _ = place_order_numbers(
+        db_session, user_id, class_id, test_id, last_position + 1, num_items=len(originals)
+    )
+
+    copy_map = _create_copy_map(db_session)
+    db_session.execute(
+        insert(copy_map),
+        [
+            {"old_item_id": item_id, "new_item_id": f"{item_id}_{uuid.uuid4().hex[:6]}", "order_number": rank}
+            for (item_id, _), rank in zip(originals, ranks)
+        ],
+    )
+    _free_copy_ids(db_session, user_id, class_id, copy_map)
+    new_ids = dict(db_session.execute(select(copy_map.c.old_item_id, copy_map.c.new_item_id)).all())
+
+    _copy_mapped_items(db_session, user_id, class_id, copy_map, test_id)
+
+    return new_ids
+
+def copy_test(db_session, user_id, class_id, test_id, new_test_id=None):
+    """
+    Duplicate a whole test and all of its items inside the database.
+
+    Item ids, ranks and the test's order counter are copied with INSERT ... SELECT, so the cost
+    in round trips does not depend on the size of the test. Does not commit.
+
+    Args:
+        new_test_id (str, optional): Defaults to a free "copy of <test_id>" name, picked again if
+            a concurrent copy takes it first.
+
+    Returns:
+        Tuple[str, int]: the new test id and the number of items copied
+
+    Raises:
+        ValueError: if new_test_id is given and already exists
+    """
+    while True:
+        candidate = new_test_id or generate_unique_test_id(db_session, test_id, user_id, class_id)
+        created = db_session.execute(
+            pg_insert(UserTests)
+            .values(user_id=user_id, class_id=class_id, test_id=candidate)
+            .on_conflict_do_nothing()
+            .returning(UserTests.test_id)
+        ).scalar_one_or_none()
+        if created is not None:
+            break
+        if new_test_id is not None:
+            raise ValueError(f"Test {new_test_id} already exists")
+    new_test_id = candidate
+
+    copy_map = _create_copy_map(db_session)
+    db_session.execute(
+        insert(copy_map).from_select(
+            ["old_item_id", "new_item_id", "order_number"],
+            select(Tests.item_id, Tests.item_id + "_" + _copy_suffix(Tests.item_id), Tests.order_number)
+            .where(*_test_filter(user_id, class_id, test_id)),
+        )
+    )
+    _free_copy_ids(db_session, user_id, class_id, copy_map)
+    copied = _copy_mapped_items(db_session, user_id, class_id, copy_map, new_test_id)
+
+    db_session.execute(
+        insert(TestOrderCounters).from_select(
+            ["user_id", "class_id", "test_id", "next_order"],
+            select(
+                TestOrderCounters.user_id,
+                TestOrderCounters.class_id,
+                literal(new_test_id),
+                TestOrderCounters.next_order,
+            ).where(
+                TestOrderCounters.user_id == user_id,
+                TestOrderCounters.class_id == class_id,
+                TestOrderCounters.test_id == test_id,
+            ),
+        )
+    )
+
+    return new_test_id, copied
+
+def fetch_items_data(db_session, user_id, item_keys):
+    """
+    Load many item versions using one query per table instead of three queries per item.
+
+    Args:
+        user_id (str): The user's ID.
+        item_keys (Iterable[Tuple[str, str, int]]): (class_id, item_id, version) of each item to load.
+
+    Returns:
+        dict: {(class_id, item_id, version): item} where item has the same shape as
+            fetch_item_data. Keys missing from item_history are left out.
+    """
+    keys = list(dict.fromkeys(item_keys))
+
+    # Versions are immutable, so anything already cached can be served as is
+    cached = item_cache.get_many(user_id, keys)
+    keys = [key for key in keys if key not in cached]
+    items = {}
+
+    col_names = [
+        "question_part",
+        "answer_part",
+        "format",
+        "difficulty",
+        "wrong_answer_explanation",
+    ]
+
+    for start in range(0, len(keys), ITEM_LOAD_CHUNK_SIZE):
+        chunk = keys[start:start + ITEM_LOAD_CHUNK_SIZE]
+
+        # Get the item details from item_history, rebuilding compacted versions
+        for (class_id, item_id, version), fields in load_item_versions(db_session, user_id, chunk).items():
+            item = {name: fields[name] for name in col_names}
+            item["relatedtopics"] = []
+            item["relatedskills"] = []
+            item["item_id"] = item_id
+            item["class_id"] = class_id
+            item["user_id"] = user_id
+            items[(class_id, item_id, version)] = item
+
         # Get item topics from item_topics
-        fetch_topic = (
-            select(ItemTopics.topic_name)
+        topics_stmt = (
+            select(ItemTopics.class_id, ItemTopics.item_id, ItemTopics.version, Topics.name)
+            .join(
+                Topics,
+                (Topics.user_id == ItemTopics.user_id)
+                & (Topics.class_id == ItemTopics.class_id)
+                & (Topics.topic_id == ItemTopics.topic_id),
+            )
             .where(
                 ItemTopics.user_id == user_id,
-                ItemTopics.class_id == class_id,
-                ItemTopics.item_id == item_id, 
-                ItemTopics.version == version
+                tuple_(ItemTopics.class_id, ItemTopics.item_id, ItemTopics.version).in_(chunk),
             )
         )
-        item_topics = db_session.execute(fetch_topic).scalars().all()
-                
-        # Get item skills form item_skills
-        stmt = (
-            select(ItemSkills.skill_name)
+        for class_id, item_id, version, topic_name in db_session.execute(topics_stmt).all():
+            item = items.get((class_id, item_id, version))
+            if item is not None:
+                item["relatedtopics"].append(topic_name)
+
+        # Get item skills from item_skills
+        skills_stmt = (
+            select(ItemSkills.class_id, ItemSkills.item_id, ItemSkills.version, Skills.name)
+            .join(
+                Skills,
+                (Skills.user_id == ItemSkills.user_id)
+                & (Skills.class_id == ItemSkills.class_id)
+                & (Skills.skill_id == ItemSkills.skill_id),
+            )
             .where(
                 ItemSkills.user_id == user_id,
-                ItemSkills.class_id == class_id,
-                ItemSkills.item_id == item_id,
-                ItemSkills.version == version
+                tuple_(ItemSkills.class_id, ItemSkills.item_id, ItemSkills.version).in_(chunk),
             )
         )
-        item_skills = db_session.execute(stmt).scalars().all()
-        
-        # Populate item for return
-        col_names = [
-            "question_part",
-            "answer_part",
-            "format",
-            "difficulty",
-            "wrong_answer_explanation",
-            ]
-        item = dict(zip(col_names, item_data))
-        item["relatedtopics"] = item_topics
-        item["relatedskills"] = item_skills
-        item["item_id"] = item_id
-        item["class_id"] = class_id
-        item["user_id"] = user_id
+        for class_id, item_id, version, skill_name in db_session.execute(skills_stmt).all():
+            item = items.get((class_id, item_id, version))
+            if item is not None:
+                item["relatedskills"].append(skill_name)
+
+    item_cache.put_many(user_id, items)
+    items.update(cached)
+
+    return items
+
+def fetch_item_data(db_session, user_id, class_id, item_id, version):
+    try:
+        key = (class_id, item_id, version)
+        item = fetch_items_data(db_session, user_id, [key]).get(key)
+
+        if not item: raise Exception("Item not found in history.")
 
         return item
 
     except Exception as e:
         raise Exception(f"Failed to fetch item details: {e}")
 
+def select_user_items(user_id, after=None, limit=None):
+    """
+    Build a keyset-paginated query over all of a user's test items with their current version.
+
+    Rows are ordered by (class_id, test_id, order_number, item_id) so a page can resume
+    right after the last row of the previous one without an OFFSET scan.
+
+    Args:
+        user_id (str): The user's ID.
+        after (Tuple[str, str, int, str], optional): (class_id, test_id, order_number, item_id)
+            of the last row already returned.
+        limit (int, optional): Maximum number of rows to return.
+
+    Returns:
+        Select: rows of (class_id, test_id, order_number, item_id, version)
+    """
+    order_number = func.coalesce(Tests.order_number, 0)
+    stmt = (
+        select(Tests.class_id, Tests.test_id, order_number, Tests.item_id, ItemCurrent.version)
+        .join(
+            ItemCurrent,
+            (ItemCurrent.user_id == Tests.user_id)
+            & (ItemCurrent.class_id == Tests.class_id)
+            & (ItemCurrent.item_id == Tests.item_id),
+        )
+        .where(Tests.user_id == user_id)
+        .order_by(Tests.class_id, Tests.test_id, order_number, Tests.item_id)
+    )
+
+    if after is not None:
+        stmt = stmt.where(tuple_(Tests.class_id, Tests.test_id, order_number, Tests.item_id) > tuple_(*after))
+
+    if limit is not None:
+        stmt = stmt.limit(limit)
+
+    return stmt
+
+def user_item_positions(db_session, user_id, rows, previous=None):
+    """
+    Get the dense 1-based position within its test of each row from select_user_items.
+
+    Rows arrive in test order, so positions are counted along the rows; only the first row needs
+    a query, when it may continue a test that started on an earlier page.
+
+    Args:
+        previous (Tuple[str, str, int], optional): (class_id, test_id, position) of the row just
+            before rows, when the caller already knows it.
+
+    Returns:
+        List[int]: one position per row
+    """
+    positions = []
+    for class_id, test_id, order_number, item_id, _ in rows:
+        if previous is not None and previous[:2] == (class_id, test_id):
+            position = previous[2] + 1
+        elif previous is None:
+            position = order_position(db_session, user_id, class_id, test_id, order_number, item_id)
+        else:
+            position = 1
+
+        positions.append(position)
+        previous = (class_id, test_id, position)
+
+    return positions
+
+def hydrate_user_items(db_session, user_id, rows, positions=None):
+    """
+    Turn rows from select_user_items into item dicts, in the same order.
+
+    order_number in the returned items is the item's dense position in its test.
+    """
+    if positions is None:
+        positions = user_item_positions(db_session, user_id, rows)
+
+    item_map = fetch_items_data(
+        db_session, user_id, [(class_id, item_id, version) for class_id, _, _, item_id, version in rows]
+    )
+
+    items = []
+    for (class_id, test_id, _, item_id, version), position in zip(rows, positions):
+        item = item_map.get((class_id, item_id, version))
+        if item is None:
+            continue
+
+        item["test_id"] = test_id
+        item["order_number"] = position
+        item["topics"] = item.pop("relatedtopics")
+        item["skills"] = item.pop("relatedskills")
+        items.append(item)
+
+    return items
+
+def iter_user_items(db_session, user_id, after=None, chunk_size=500):
+    """
+    Stream a user's test items from a server-side cursor, chunk_size rows at a time.
+
+    Only one chunk of rows and items is held in memory at any point.
+
+    Yields:
+        dict: item with test_id, order_number, topics and skills
+    """
+    stmt = select_user_items(user_id, after=after).execution_options(yield_per=chunk_size)
+    result = db_session.execute(stmt)
+
+    previous = None
+    for rows in result.partitions():
+        positions = user_item_positions(db_session, user_id, rows, previous)
+        previous = (rows[-1][0], rows[-1][1], positions[-1])
+
+        for item in hydrate_user_items(db_session, user_id, rows, positions):
+            yield item
+
+def fetch_page_texts(db_session, page_hashes):
+    """
+    Look up previously extracted syllabus page texts.
+
+    Returns:
+        dict: {page_hash: page_text} for every hash already stored
+    """
+    if not page_hashes:
+        return {}
+
+    stmt = select(SyllabusPageText.page_hash, SyllabusPageText.page_text).where(
+        SyllabusPageText.page_hash.in_(list(page_hashes))
+    )
+
+    return {page_hash: page_text for page_hash, page_text in db_session.execute(stmt).all()}
+
+def insert_page_texts(db_session, page_texts):
+    """
+    Store extracted syllabus page texts, ignoring hashes another request stored first.
+
+    Args:
+        page_texts (dict): {page_hash: page_text}
+    """
+    if not page_texts:
+        return
+
+    try:
+        stmt = pg_insert(SyllabusPageText).values(
+            [{"page_hash": page_hash, "page_text": page_text} for page_hash, page_text in page_texts.items()]
+        ).on_conflict_do_nothing(index_elements=["page_hash"])
+
+        db_session.execute(stmt)
+        db_session.commit()
+    except Exception as e:
+        print(f"Error inserting syllabus page texts: {e}")
+        db_session.rollback()
+
 def add_requirement_to_database(db_session, user_id, class_id, test_id, item_id, req_id, version, content, usage_count, application_count, contentType):
     """
     Save requirement into the database.
@@ -445,28 +1683,63 @@ def add_requirement_to_database(db_session, user_id, class_id, test_id, item_id,
         db_session.rollback()
         raise Exception(f"Failed to add requirement: {e}")
 
+def increment_requirement_usage(db_session, user_id, req_id):
+    """
+    Count one more use of a saved requirement, in a single UPDATE. Does not commit.
+    """
+    db_session.execute(
+        update(Requirements)
+        .where(Requirements.user_id == user_id, Requirements.req_id == req_id)
+        .values(usage_count=func.coalesce(Requirements.usage_count, 0) + 1)
+    )
+
+def claim_requirement_capture(db_session, user_id, capture_id):
+    """
+    Record that the requirement capture capture_id is taking effect. Does not commit, so the
+    record commits with the capture's own writes.
+
+    Returns:
+        bool: False when the capture was already recorded, i.e. this run is a retry of one that
+        committed
+    """
+    stmt = (
+        pg_insert(RequirementCaptures)
+        .values(user_id=user_id, capture_id=capture_id)
+        .on_conflict_do_nothing(index_elements=["user_id", "capture_id"])
+        .returning(RequirementCaptures.capture_id)
+    )
+    return db_session.execute(stmt).scalar_one_or_none() is not None
+
 def generate_unique_test_id(db_session, base_name, user_id, class_id):
-    i = 1
-    new_id = f"copy of {base_name}"
+    """
+    Pick the first free name of "copy of X", "copy (2) of X", "copy (3) of X", ...
 
-    while True:
-        exists = (
-            db_session.query(UserTests)
-            .filter(
+    All names already taken are fetched with one pattern query.
+    """
+    first = f"copy of {base_name}"
+    escaped = base_name.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+    taken = set(
+        db_session.execute(
+            select(UserTests.test_id).where(
                 UserTests.user_id == user_id,
                 UserTests.class_id == class_id,
-                UserTests.test_id == new_id
+                or_(
+                    UserTests.test_id == first,
+                    UserTests.test_id.like(f"copy (%) of {escaped}", escape="\\"),
+                ),
             )
-            .first()
-        )
+        ).scalars()
+    )
 
-        if not exists:
-            return new_id
+    if first not in taken:
+        return first
 
+    i = 2
+    while f"copy ({i}) of {base_name}" in taken:
         i += 1
-        new_id = f"copy ({i}) of {base_name}"
+    return f"copy ({i}) of {base_name}"
 
-      
 
 if __name__ == "__main__":
     # Define test parameters
@@ -0,0 +1,347 @@
+# db_pool.py
+# Description: Connection pooling for SQLAlchemy and raw psycopg2 access, with pool metrics.
+#
+# Usage mirrors flask_sqlalchemy: create_app passes engine_options(...) as
+# SQLALCHEMY_ENGINE_OPTIONS and calls raw_pool.init_app(app); raw access goes through
+# raw_pool.connection() or get_db_connection(). Both pools are (re)created lazily in each
+# process, so connections opened before a WSGI server forks its workers are never shared with
+# them.
+
+import os
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2 import pool as pg_pool
+from sqlalchemy import event
+from sqlalchemy.pool import QueuePool
+
+
+class PoolMetrics:
+    """
+    Thread-safe counters for one connection pool.
+
+    wait time is the time callers spent blocked getting a connection; churn is the number of
+    connections opened and closed, which should stay flat once a pool has warmed up.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.checkouts = 0
+            self.wait_seconds = 0.0
+            self.max_wait_seconds = 0.0
+            self.timeouts = 0
+            self.connects = 0
+            self.closes = 0
+            self.invalidations = 0
+
+    def record_wait(self, seconds, timed_out=False):
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+            self.wait_seconds += seconds
+            self.max_wait_seconds = max(self.max_wait_seconds, seconds)
+
+    def record(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def snapshot(self, in_use, capacity):
+        with self._lock:
+            return {
+                "pid": os.getpid(),
+                "inUse": in_use,
+                "capacity": capacity,
+                "saturation": round(in_use / capacity, 3) if capacity else None,
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "avgWaitMs": round(1000 * self.wait_seconds / self.checkouts, 3) if self.checkouts else 0.0,
+                "maxWaitMs": round(1000 * self.max_wait_seconds, 3),
+                "connects": self.connects,
+                "closes": self.closes,
+                "invalidations": self.invalidations,
+            }
+
+
+sqlalchemy_pool_metrics = PoolMetrics()
+raw_pool_metrics = PoolMetrics()
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool that records how long each checkout waited for a free connection."""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            conn = super()._do_get()
+        except Exception:
+            sqlalchemy_pool_metrics.record_wait(time.perf_counter() - start, timed_out=True)
+            raise
+        sqlalchemy_pool_metrics.record_wait(time.perf_counter() - start)
+        return conn
+
+
+def _statement_timeout_options(statement_timeout_ms):
+    return f"-c statement_timeout={int(statement_timeout_ms)}" if statement_timeout_ms else None
+
+
+def engine_options(pool_size=5, max_overflow=10, pool_timeout=30, pool_pre_ping=True,
+                   pool_recycle=1800, statement_timeout_ms=None):
+    """
+    SQLALCHEMY_ENGINE_OPTIONS for a pooled, instrumented engine.
+
+    Args:
+        pool_recycle (int): Seconds after which a connection is replaced on its next checkout.
+        statement_timeout_ms (int, optional): Server-side statement_timeout of every connection.
+    """
+    options = {
+        "poolclass": InstrumentedQueuePool,
+        "pool_size": pool_size,
+        "max_overflow": max_overflow,
+        "pool_timeout": pool_timeout,
+        "pool_pre_ping": pool_pre_ping,
+        "pool_recycle": pool_recycle,
+    }
+
+    timeout_options = _statement_timeout_options(statement_timeout_ms)
+    if timeout_options:
+        options["connect_args"] = {"options": timeout_options}
+
+    return options
+
+
+# Engines passed to instrument_engine, reset in forked children by the one fork hook below
+_instrumented_engines = weakref.WeakSet()
+_instrumented_lock = threading.Lock()
+
+
+def _reset_engines_in_child():
+    """
+    dispose(close=False) drops the pool inherited from the parent without closing the parent's
+    sockets, so each worker opens its own connections on first use.
+    """
+    for engine in list(_instrumented_engines):
+        engine.dispose(close=False)
+    sqlalchemy_pool_metrics.reset()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_engines_in_child)
+
+
+def instrument_engine(engine):
+    """
+    Count connection churn of an engine and make forked children start with an empty pool.
+
+    Calling it again for the same engine (another create_app() in tests or CLI runs) is a no-op.
+    """
+    with _instrumented_lock:
+        if engine in _instrumented_engines:
+            return
+        _instrumented_engines.add(engine)
+
+    event.listen(engine, "connect", lambda *args: sqlalchemy_pool_metrics.record("connects"))
+    event.listen(engine, "close", lambda *args: sqlalchemy_pool_metrics.record("closes"))
+    event.listen(engine, "invalidate", lambda *args: sqlalchemy_pool_metrics.record("invalidations"))
+
+
+def engine_metrics(engine):
+    pool = engine.pool
+    capacity = pool.size() + max(pool._max_overflow, 0)
+    return sqlalchemy_pool_metrics.snapshot(pool.checkedout(), capacity)
+
+
+class _CountingConnectionPool(pg_pool.ThreadedConnectionPool):
+    """ThreadedConnectionPool that remembers when each of its connections was opened."""
+
+    def __init__(self, *args, **kwargs):
+        self.created_at = {}
+        super().__init__(*args, **kwargs)
+
+    def _connect(self, key=None):
+        conn = super()._connect(key)
+        raw_pool_metrics.record("connects")
+        self.created_at[id(conn)] = time.monotonic()
+        return conn
+
+    def discard(self, conn):
+        self.created_at.pop(id(conn), None)
+        self.putconn(conn, close=True)
+        raw_pool_metrics.record("closes")
+
+
+class PooledConnection:
+    """
+    psycopg2 connection checked out of a RawConnectionPool, for callers written against
+    psycopg2.connect(): close() hands the connection back to the pool instead of closing it.
+
+    Everything else is delegated to the connection. A with block commits or rolls back like
+    psycopg2's own and leaves the connection open.
+    """
+
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+
+    def __getattr__(self, name):
+        if self._conn is None:
+            raise psycopg2.InterfaceError("connection already closed")
+        return getattr(self._conn, name)
+
+    @property
+    def closed(self):
+        return 1 if self._conn is None else self._conn.closed
+
+    def close(self):
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            self._pool.putconn(conn)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._conn is None:
+            return
+        if exc_type is None:
+            self._conn.commit()
+        else:
+            self._conn.rollback()
+
+
+class RawConnectionPool:
+    """
+    Process-wide pool of raw psycopg2 connections for code that bypasses SQLAlchemy.
+
+    Connections are checked for liveness and age when handed out, mirroring pool_pre_ping and
+    pool_recycle of the SQLAlchemy engine. Callers block up to timeout seconds for a free
+    connection instead of failing as soon as the pool is exhausted.
+    """
+
+    def __init__(self, app=None):
+        self.min_size = 1
+        self.max_size = 5
+        self.timeout = 30.0
+        self.pre_ping = True
+        self.recycle = 1800
+        self.statement_timeout_ms = None
+
+        self._pool = None
+        self._slots = None
+        self._in_use = 0
+        self._pid = None
+        self._lock = threading.Lock()
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.min_size = app.config.get("RAW_DB_POOL_MIN_SIZE", self.min_size)
+        self.max_size = app.config.get("RAW_DB_POOL_MAX_SIZE", self.max_size)
+        self.timeout = app.config.get("DB_POOL_TIMEOUT", self.timeout)
+        self.pre_ping = app.config.get("DB_POOL_PRE_PING", self.pre_ping)
+        self.recycle = app.config.get("DB_POOL_RECYCLE", self.recycle)
+        self.statement_timeout_ms = app.config.get("DB_STATEMENT_TIMEOUT_MS", self.statement_timeout_ms)
+
+        app.extensions["raw_db_pool"] = self
+
+    def _get_pool(self):
+        if self._pool is None or self._pid != os.getpid():
+            with self._lock:
+                if self._pool is None or self._pid != os.getpid():
+                    # A pool inherited across fork is abandoned, not closed: its sockets belong
+                    # to the parent
+                    raw_pool_metrics.reset()
+                    self._pool = _CountingConnectionPool(
+                        self.min_size,
+                        self.max_size,
+                        host=os.getenv("DB_HOST"),
+                        database=os.getenv("DB_NAME"),
+                        user=os.getenv("DB_USER"),
+                        password=os.getenv("DB_PASSWORD"),
+                        port=os.getenv("DB_PORT"),
+                        options=_statement_timeout_options(self.statement_timeout_ms),
+                    )
+                    self._slots = threading.BoundedSemaphore(self.max_size)
+                    self._in_use = 0
+                    self._pid = os.getpid()
+        return self._pool
+
+    def _usable(self, pool, conn):
+        if conn.closed:
+            return False
+        if self.recycle and time.monotonic() - pool.created_at.get(id(conn), 0) > self.recycle:
+            return False
+        if self.pre_ping:
+            try:
+                with conn.cursor() as cursor:
+                    cursor.execute("SELECT 1")
+                conn.rollback()
+            except psycopg2.Error:
+                raw_pool_metrics.record("invalidations")
+                return False
+        return True
+
+    def getconn(self):
+        """Check a connection out; return it with putconn."""
+        pool = self._get_pool()
+
+        start = time.perf_counter()
+        if not self._slots.acquire(timeout=self.timeout):
+            raw_pool_metrics.record_wait(time.perf_counter() - start, timed_out=True)
+            raise pg_pool.PoolError(f"No database connection free after {self.timeout}s")
+
+        try:
+            conn = pool.getconn()
+            while not self._usable(pool, conn):
+                pool.discard(conn)
+                conn = pool.getconn()
+        except Exception:
+            self._slots.release()
+            raise
+
+        with self._lock:
+            self._in_use += 1
+        raw_pool_metrics.record_wait(time.perf_counter() - start)
+        return conn
+
+    def putconn(self, conn):
+        pool = self._get_pool()
+        try:
+            if conn.closed:
+                pool.discard(conn)
+            else:
+                conn.rollback()
+                pool.putconn(conn)
+        finally:
+            with self._lock:
+                self._in_use -= 1
+            self._slots.release()
+
+    def connect(self):
+        """Check a connection out as a PooledConnection; close() returns it."""
+        return PooledConnection(self, self.getconn())
+
+    @contextmanager
+    def connection(self):
+        """Pooled psycopg2 connection for the duration of a with block."""
+        conn = self.getconn()
+        try:
+            yield conn
+        finally:
+            self.putconn(conn)
+
+    def metrics(self):
+        in_use = self._in_use if self._pid == os.getpid() else 0
+        return raw_pool_metrics.snapshot(in_use, self.max_size)
+
+
+raw_pool = RawConnectionPool()
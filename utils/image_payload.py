@@ -0,0 +1,79 @@
+# image_payload.py
+# Description: Compact encoding of images sent to vision models as base64 data URLs.
+
+import base64
+import os
+from io import BytesIO
+
+from PIL import Image, ImageOps
+
+# Longest edge, in pixels, of an image sent to a vision model
+IMAGE_MAX_EDGE = int(os.getenv("IMAGE_MAX_EDGE", "2048"))
+
+# Output format and encoder settings per kind of content.
+# Scanned documents keep sharp text at JPEG quality 80; photos and diagrams compress best as WebP.
+IMAGE_PROFILES = {
+    "document": ("JPEG", {"quality": int(os.getenv("IMAGE_DOCUMENT_QUALITY", "80")), "optimize": True}),
+    "photo": ("WEBP", {"quality": int(os.getenv("IMAGE_PHOTO_QUALITY", "80")), "method": 4}),
+}
+
+
+def _has_transparency(image):
+    return image.mode in ("RGBA", "LA", "PA") or "transparency" in image.info
+
+
+def _flatten(image):
+    """
+    Convert to RGB or L, compositing transparent images onto white.
+
+    Transparent pixels of diagrams and screenshots are usually black underneath, so a plain
+    convert("RGB") would turn the background black and hide black text and lines.
+    """
+    if _has_transparency(image):
+        image = image.convert("RGBA")
+        background = Image.new("RGB", image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel("A"))
+        return background
+
+    if image.mode not in ("RGB", "L"):
+        return image.convert("RGB")
+    return image
+
+
+def encode_image_data_url(image, kind="document", max_edge=None):
+    """
+    Encode an image as a data URL small enough to send to a vision model.
+
+    The image is rotated according to its EXIF orientation, flattened onto white if it has
+    transparency, down-scaled so its longest edge is at most max_edge, and re-encoded with the
+    profile for its kind. Re-encoding drops EXIF and other metadata.
+
+    Args:
+        image (PIL.Image.Image | bytes): Decoded image, or the raw bytes of an uploaded file.
+        kind (str): "document" for scanned pages and text, "photo" for everything else.
+        max_edge (int, optional): Defaults to IMAGE_MAX_EDGE.
+
+    Returns:
+        str: data URL with the actual MIME type of the encoded payload
+    """
+    if isinstance(image, (bytes, bytearray)):
+        image = Image.open(BytesIO(image))
+
+    image = ImageOps.exif_transpose(image)
+    image = _flatten(image)
+
+    max_edge = max_edge or IMAGE_MAX_EDGE
+    if max(image.size) > max_edge:
+        scale = max_edge / max(image.size)
+        image = image.resize(
+            (max(1, round(image.width * scale)), max(1, round(image.height * scale))),
+            Image.LANCZOS,
+        )
+
+    image_format, params = IMAGE_PROFILES[kind]
+    buffered = BytesIO()
+    image.save(buffered, format=image_format, **params)
+
+    # getbuffer() exposes the encoded bytes without the copy getvalue() makes
+    payload = base64.b64encode(buffered.getbuffer()).decode("ascii")
+    return f"data:image/{image_format.lower()};base64,{payload}"
@@ -0,0 +1,232 @@
+# item_cache.py
+# Description: Cache for item versions loaded by fetch_items_data / fetch_item_data.
+#
+# An item_history row for (user_id, class_id, item_id, version) never changes once written,
+# so a loaded version can be served from memory until undo or delete removes it.
+
+import json
+import os
+import threading
+from collections import OrderedDict
+
+from app.utils.local_store import LocalSQLite
+
+# Keys looked up per query in the shared tier; 3 parameters per key plus the user id stay under
+# SQLite's default limit of 999 bound parameters
+SHARED_GET_CHUNK_SIZE = 300
+
+
+class ItemCache:
+    """
+    Two-tier cache of item dicts keyed by (user_id, class_id, item_id, version).
+
+    The first tier is an in-process LRU bounded by the size of the cached JSON payloads.
+    The optional second tier is a SQLite file shared by every worker on the host; it also
+    carries an invalidation log so that an undo or delete in one worker evicts the version
+    from the in-process tier of the others.
+    """
+
+    def __init__(self, max_bytes, shared_path=None, shared_max_rows=100000):
+        self.max_bytes = max_bytes
+        self.shared_path = shared_path
+        self.shared_max_rows = shared_max_rows
+
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self._store = LocalSQLite(
+            shared_path,
+            schema=(
+                "CREATE TABLE IF NOT EXISTS item_cache ("
+                "user_id TEXT, class_id TEXT, item_id TEXT, version INTEGER, payload TEXT, "
+                "PRIMARY KEY (user_id, class_id, item_id, version))",
+                "CREATE TABLE IF NOT EXISTS item_cache_invalidations ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                "user_id TEXT, class_id TEXT, item_id TEXT, version INTEGER)",
+            ),
+        ) if shared_path else None
+        self._last_invalidation = None
+        self._puts_since_trim = 0
+
+    ################
+    # Public API
+    ################
+
+    def get_many(self, user_id, keys):
+        """
+        Look up many (class_id, item_id, version) keys of a user.
+
+        Returns:
+            dict: {(class_id, item_id, version): item} for every cached key. Each item is a fresh
+                copy, so callers may mutate it.
+        """
+        self._sync_invalidations()
+
+        found = {}
+        missing = []
+        with self._lock:
+            for key in keys:
+                payload = self._entries.get((user_id, *key))
+                if payload is None:
+                    missing.append(key)
+                    continue
+                self._entries.move_to_end((user_id, *key))
+                found[key] = payload
+
+        if missing and self.shared_path:
+            for key, payload in self._shared_get_many(user_id, missing).items():
+                self._remember((user_id, *key), payload)
+                found[key] = payload
+
+        return {key: json.loads(payload) for key, payload in found.items()}
+
+    def put_many(self, user_id, items):
+        """
+        Cache loaded items.
+
+        Args:
+            items (dict): {(class_id, item_id, version): item} as returned by fetch_items_data.
+        """
+        rows = []
+        for key, item in items.items():
+            payload = json.dumps(item)
+            self._remember((user_id, *key), payload)
+            rows.append((user_id, *key, payload))
+
+        if rows and self.shared_path:
+            self._shared_put_many(rows)
+
+    def invalidate(self, user_id, class_id, item_id, version=None):
+        """
+        Drop one version of an item, or every version when version is None.
+        """
+        self._forget(user_id, class_id, item_id, version)
+
+        if self.shared_path:
+            self._shared_invalidate(user_id, class_id, item_id, version)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    ################
+    # In-process tier
+    ################
+
+    def _remember(self, key, payload):
+        if len(payload) > self.max_bytes:
+            return
+
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._size -= len(previous)
+
+            self._entries[key] = payload
+            self._size += len(payload)
+
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+    def _forget(self, user_id, class_id, item_id, version):
+        with self._lock:
+            if version is not None:
+                stale = [(user_id, class_id, item_id, version)]
+            else:
+                stale = [key for key in self._entries if key[:3] == (user_id, class_id, item_id)]
+
+            for key in stale:
+                payload = self._entries.pop(key, None)
+                if payload is not None:
+                    self._size -= len(payload)
+
+    ################
+    # Shared tier
+    ################
+
+    def _shared_connection(self):
+        return self._store.connection()
+
+    def _shared_get_many(self, user_id, keys):
+        conn = self._shared_connection()
+        keys = list(keys)
+        found = {}
+        for start in range(0, len(keys), SHARED_GET_CHUNK_SIZE):
+            chunk = keys[start:start + SHARED_GET_CHUNK_SIZE]
+            # Joining against the keys (rather than IN) lets SQLite probe the primary key per key
+            rows = conn.execute(
+                "WITH wanted (class_id, item_id, version) AS (VALUES "
+                + ", ".join(["(?, ?, ?)"] * len(chunk)) + ") "
+                "SELECT c.class_id, c.item_id, c.version, c.payload FROM wanted w "
+                "JOIN item_cache c ON c.user_id = ? AND c.class_id = w.class_id "
+                "AND c.item_id = w.item_id AND c.version = w.version",
+                (*(value for key in chunk for value in key), user_id),
+            ).fetchall()
+            for class_id, item_id, version, payload in rows:
+                found[(class_id, item_id, version)] = payload
+        return found
+
+    def _shared_put_many(self, rows):
+        conn = self._shared_connection()
+        conn.executemany("INSERT OR REPLACE INTO item_cache VALUES (?, ?, ?, ?, ?)", rows)
+
+        self._puts_since_trim += len(rows)
+        if self._puts_since_trim >= 1000:
+            self._puts_since_trim = 0
+            # Keep the most recently written rows
+            conn.execute(
+                "DELETE FROM item_cache WHERE rowid <= "
+                "(SELECT max(rowid) FROM item_cache) - ?",
+                (self.shared_max_rows,),
+            )
+
+    def _shared_invalidate(self, user_id, class_id, item_id, version):
+        conn = self._shared_connection()
+        if version is not None:
+            conn.execute(
+                "DELETE FROM item_cache WHERE user_id = ? AND class_id = ? AND item_id = ? AND version = ?",
+                (user_id, class_id, item_id, version),
+            )
+        else:
+            conn.execute(
+                "DELETE FROM item_cache WHERE user_id = ? AND class_id = ? AND item_id = ?",
+                (user_id, class_id, item_id),
+            )
+        cursor = conn.execute(
+            "INSERT INTO item_cache_invalidations (user_id, class_id, item_id, version) VALUES (?, ?, ?, ?)",
+            (user_id, class_id, item_id, version),
+        )
+        if cursor.lastrowid % 1000 == 0:
+            conn.execute("DELETE FROM item_cache_invalidations WHERE id <= ?", (cursor.lastrowid - 10000,))
+
+    def _sync_invalidations(self):
+        """Apply invalidations other workers logged since the last call."""
+        if not self.shared_path:
+            return
+
+        conn = self._shared_connection()
+        if self._last_invalidation is None:
+            # Everything cached so far was loaded after the current end of the log
+            self._last_invalidation = conn.execute(
+                "SELECT COALESCE(max(id), 0) FROM item_cache_invalidations"
+            ).fetchone()[0]
+            return
+
+        rows = conn.execute(
+            "SELECT id, user_id, class_id, item_id, version FROM item_cache_invalidations WHERE id > ? ORDER BY id",
+            (self._last_invalidation,),
+        ).fetchall()
+        for row_id, user_id, class_id, item_id, version in rows:
+            self._forget(user_id, class_id, item_id, version)
+            self._last_invalidation = row_id
+
+
+# Process-wide cache used by db_operations.
+# ITEM_CACHE_PATH enables the shared tier; set it when running several workers per host.
+item_cache = ItemCache(
+    max_bytes=int(os.getenv("ITEM_CACHE_MAX_BYTES", str(64 * 1024 * 1024))),
+    shared_path=os.getenv("ITEM_CACHE_PATH") or None,
+    shared_max_rows=int(os.getenv("ITEM_CACHE_SHARED_MAX_ROWS", "100000")),
+)
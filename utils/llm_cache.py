@@ -0,0 +1,150 @@
+# llm_cache.py
+# Description: Content-addressed cache of parsed structured-output responses.
+#
+# Entries are keyed by a hash of everything that determines the model output: model, rendered
+# prompt (with embedded images replaced by their digest), schema, reasoning effort and verbosity.
+
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from app.utils.local_store import LocalSQLite
+
+
+def image_digest(data_url):
+    """Short stand-in for a base64 image data URL inside a cache key."""
+    return "sha256:" + hashlib.sha256(data_url.encode("utf-8")).hexdigest()
+
+
+def _normalize_prompt(prompt):
+    if isinstance(prompt, str):
+        return image_digest(prompt) if prompt.startswith("data:") else prompt
+    if isinstance(prompt, dict):
+        return {key: _normalize_prompt(value) for key, value in prompt.items()}
+    if isinstance(prompt, (list, tuple)):
+        return [_normalize_prompt(value) for value in prompt]
+    return prompt
+
+
+def _schema_fingerprint(schema):
+    schema_json = json.dumps(schema.model_json_schema(), sort_keys=True)
+    return f"{schema.__module__}.{schema.__qualname__}:{hashlib.sha256(schema_json.encode('utf-8')).hexdigest()}"
+
+
+class LLMResponseCache:
+    """
+    In-memory LRU in front of an optional SQLite file, both holding serialized pydantic responses.
+
+    The disk tier is shared by every worker on the host. Entries expire after ttl seconds and the
+    oldest entries are evicted once the file holds more than max_disk_bytes of payloads.
+    """
+
+    def __init__(self, max_entries=1024, path=None, ttl=7 * 24 * 3600, max_disk_bytes=256 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_disk_bytes = max_disk_bytes
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._puts_since_trim = 0
+        self._store = LocalSQLite(
+            path,
+            schema=(
+                "CREATE TABLE IF NOT EXISTS llm_cache ("
+                "key TEXT PRIMARY KEY, payload TEXT, size INTEGER, created_at REAL)",
+                "CREATE INDEX IF NOT EXISTS llm_cache_created_at ON llm_cache (created_at)",
+            ),
+        ) if path else None
+
+    @staticmethod
+    def make_key(model, prompt, schema, reasoning, verbosity):
+        material = json.dumps(
+            {
+                "model": model,
+                "prompt": _normalize_prompt(prompt),
+                "schema": _schema_fingerprint(schema),
+                "reasoning": reasoning,
+                "verbosity": verbosity,
+            },
+            sort_keys=True,
+        )
+        return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+    def get(self, key, schema):
+        """
+        Returns:
+            An instance of schema, or None on a miss or an expired entry.
+        """
+        now = time.time()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                payload, created_at = entry
+                if created_at + self.ttl > now:
+                    self._entries.move_to_end(key)
+                    return schema.model_validate_json(payload)
+                del self._entries[key]
+
+        if self._store is None:
+            return None
+
+        conn = self._store.connection()
+        row = conn.execute("SELECT payload, created_at FROM llm_cache WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+
+        payload, created_at = row
+        if created_at + self.ttl <= now:
+            conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+            return None
+
+        self._remember(key, payload, created_at)
+        return schema.model_validate_json(payload)
+
+    def put(self, key, parsed):
+        payload = parsed.model_dump_json()
+        created_at = time.time()
+        self._remember(key, payload, created_at)
+
+        if self._store is None:
+            return
+
+        conn = self._store.connection()
+        conn.execute(
+            "INSERT OR REPLACE INTO llm_cache (key, payload, size, created_at) VALUES (?, ?, ?, ?)",
+            (key, payload, len(payload), created_at),
+        )
+
+        self._puts_since_trim += 1
+        if self._puts_since_trim >= 100:
+            self._puts_since_trim = 0
+            self._trim(conn)
+
+    def _remember(self, key, payload, created_at):
+        with self._lock:
+            self._entries[key] = (payload, created_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _trim(self, conn):
+        """Drop expired entries, then the oldest ones until the disk tier fits max_disk_bytes."""
+        conn.execute("DELETE FROM llm_cache WHERE created_at <= ?", (time.time() - self.ttl,))
+
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM llm_cache").fetchone()[0]
+        if total <= self.max_disk_bytes:
+            return
+
+        excess = total - self.max_disk_bytes
+        freed = 0
+        stale = []
+        for key, size in conn.execute("SELECT key, size FROM llm_cache ORDER BY created_at"):
+            stale.append((key,))
+            freed += size
+            if freed >= excess:
+                break
+        conn.executemany("DELETE FROM llm_cache WHERE key = ?", stale)
+
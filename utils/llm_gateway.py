@@ -0,0 +1,153 @@
+# llm_gateway.py
+# Description: Process-wide OpenAI client shared by every GPT route.
+#
+# Usage mirrors flask_sqlalchemy: create_app calls llm.init_app(app) and routes call llm.parse(...).
+
+import os
+import threading
+
+import httpx
+import openai
+import yaml
+
+from app.utils.llm_cache import LLMResponseCache
+
+# Load config.yaml
+config_path = os.path.join(os.path.dirname(__file__), "config.yaml")
+with open(config_path, "r", encoding="utf-8") as f:
+    config = yaml.safe_load(f)
+
+
+class LLMGateway:
+    """
+    Owns one pooled OpenAI client per process and the single entry point for structured calls.
+
+    The client keeps its HTTP connections alive between requests, so routes no longer pay a
+    new connection pool and TLS handshake per call.
+    """
+
+    def __init__(self, app=None):
+        self.timeout = 120.0
+        self.connect_timeout = 10.0
+        self.max_connections = 50
+        self.max_keepalive_connections = 20
+        self.keepalive_expiry = 60.0
+        self.max_retries = 2
+        self.cache = LLMResponseCache()
+        self.cache_enabled = True
+
+        self._client = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.timeout = app.config.get("LLM_TIMEOUT", self.timeout)
+        self.connect_timeout = app.config.get("LLM_CONNECT_TIMEOUT", self.connect_timeout)
+        self.max_connections = app.config.get("LLM_MAX_CONNECTIONS", self.max_connections)
+        self.max_keepalive_connections = app.config.get(
+            "LLM_MAX_KEEPALIVE_CONNECTIONS", self.max_keepalive_connections
+        )
+        self.keepalive_expiry = app.config.get("LLM_KEEPALIVE_EXPIRY", self.keepalive_expiry)
+        self.max_retries = app.config.get("LLM_MAX_RETRIES", self.max_retries)
+
+        self.cache_enabled = app.config.get("LLM_CACHE_ENABLED", True)
+        self.cache = LLMResponseCache(
+            max_entries=app.config.get("LLM_CACHE_MAX_ENTRIES", 1024),
+            path=app.config.get("LLM_CACHE_PATH"),
+            ttl=app.config.get("LLM_CACHE_TTL", 7 * 24 * 3600),
+            max_disk_bytes=app.config.get("LLM_CACHE_MAX_DISK_BYTES", 256 * 1024 * 1024),
+        )
+
+        app.extensions["llm"] = self
+
+    @property
+    def client(self):
+        """
+        The shared openai.OpenAI client, created on first use in each process.
+
+        Creating it lazily keeps sockets from being shared between forked WSGI workers.
+        """
+        if self._client is None or self._pid != os.getpid():
+            with self._lock:
+                if self._client is None or self._pid != os.getpid():
+                    http_client = httpx.Client(
+                        limits=httpx.Limits(
+                            max_connections=self.max_connections,
+                            max_keepalive_connections=self.max_keepalive_connections,
+                            keepalive_expiry=self.keepalive_expiry,
+                        ),
+                        timeout=httpx.Timeout(self.timeout, connect=self.connect_timeout),
+                    )
+                    self._client = openai.OpenAI(
+                        api_key=os.getenv("OPENAI_API_KEY"),
+                        http_client=http_client,
+                        max_retries=self.max_retries,
+                    )
+                    self._pid = os.getpid()
+        return self._client
+
+    def parse(self, prompt, schema, model=None, reasoning=None, verbosity=None, cache=False):
+        """
+        Run a structured-output call and return the parsed object.
+
+        Args:
+            prompt (str | List[dict]): Rendered prompt, or a list of input messages (e.g. with images).
+            schema (Type[BaseModel]): Pydantic model the response is parsed into.
+            model (str, optional): Defaults to gpt_model.engine in config.yaml.
+            reasoning (str, optional): Reasoning effort, defaults to gpt_model.reasoning.
+            verbosity (str, optional): Output verbosity, defaults to gpt_model.verbosity.
+            cache (bool, optional): Serve identical earlier calls from the response cache.
+                Routes opt in per call and pass False when the client asks to bypass it.
+
+        Returns:
+            An instance of schema.
+        """
+        model = model or config["gpt_model"]["engine"]
+        reasoning = reasoning or config["gpt_model"]["reasoning"]
+        verbosity = verbosity or config["gpt_model"]["verbosity"]
+
+        use_cache = cache and self.cache_enabled
+        if use_cache:
+            key = self.cache.make_key(model, prompt, schema, reasoning, verbosity)
+            cached = self.cache.get(key, schema)
+            if cached is not None:
+                return cached
+
+        response = self.client.responses.parse(
+            model=model,
+            input=prompt,
+            text_format=schema,
+            reasoning={"effort": reasoning},
+            text={"verbosity": verbosity},
+        )
+        parsed = response.output[1].content[0].parsed
+
+        if use_cache and parsed is not None:
+            self.cache.put(key, parsed)
+
+        return parsed
+
+    def read_image(self, prompt, image_url, model="gpt-4o"):
+        """
+        Ask a vision chat model about one image and return the text of its reply.
+        """
+        response = self.client.chat.completions.create(
+            model=model,
+            messages=[
+                {
+                    "role": "user",
+                    "content": [
+                        {"type": "text", "text": prompt},
+                        {"type": "image_url", "image_url": {"url": image_url}},
+                    ],
+                },
+            ],
+        )
+
+        return response.choices[0].message.content
+
+
+llm = LLMGateway()
@@ -0,0 +1,37 @@
+# local_store.py
+# Description: Host-local SQLite files shared by every worker process on the machine.
+
+import os
+import sqlite3
+import threading
+
+
+class LocalSQLite:
+    """
+    Hands out one SQLite connection per thread and per process for a file on local disk.
+
+    SQLite connections must not be shared between threads or carried across a fork, so the
+    connection is recreated whenever the calling thread or process id changes.
+    """
+
+    def __init__(self, path, schema=()):
+        self.path = path
+        self.schema = schema
+        self._local = threading.local()
+
+    def connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None or getattr(self._local, "pid", None) != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            for statement in self.schema:
+                conn.execute(statement)
+
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
@@ -0,0 +1,77 @@
+# migrations.py
+# Description: Applies the numbered SQL files in migrations/ in order, once each.
+#
+# Applied versions are recorded in schema_migrations. Run with `flask migrate-db`; databases
+# that already had some files applied by hand are brought in with `--mark-applied`.
+
+import os
+import re
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "migrations")
+
+_MIGRATION_NAME = re.compile(r"^(\d{4})_[\w-]+\.sql$")
+
+
+def list_migrations(directory=None):
+    """
+    Returns:
+        List[Tuple[str, str]]: (version, path) of every migration file, in version order
+    """
+    directory = directory or MIGRATIONS_DIR
+    migrations = []
+    for name in os.listdir(directory):
+        match = _MIGRATION_NAME.match(name)
+        if match:
+            migrations.append((match.group(1), os.path.join(directory, name)))
+    return sorted(migrations)
+
+
+def _applied_versions(cursor):
+    cursor.execute(
+        "CREATE TABLE IF NOT EXISTS schema_migrations ("
+        "version VARCHAR(16) PRIMARY KEY, applied_at TIMESTAMPTZ NOT NULL DEFAULT now())"
+    )
+    cursor.execute("SELECT version FROM schema_migrations")
+    return {row[0] for row in cursor.fetchall()}
+
+
+def apply_migrations(engine, mark_applied=None, directory=None):
+    """
+    Run every migration that is not recorded in schema_migrations yet.
+
+    Each file is sent as one autocommit batch, so files that manage their own BEGIN/COMMIT
+    work unchanged and a failing file stops the run before later ones.
+
+    Args:
+        engine: SQLAlchemy engine of the application database.
+        mark_applied (str, optional): Record every version up to and including this one as
+            applied without running it.
+
+    Returns:
+        List[str]: file names run (or marked), in order
+    """
+    raw = engine.raw_connection()
+    try:
+        raw.driver_connection.autocommit = True
+        cursor = raw.cursor()
+        applied = _applied_versions(cursor)
+
+        done = []
+        for version, path in list_migrations(directory):
+            if version in applied:
+                continue
+
+            if mark_applied is None or version > mark_applied:
+                with open(path, "r", encoding="utf-8") as f:
+                    cursor.execute(f.read())
+
+            cursor.execute(
+                "INSERT INTO schema_migrations (version) VALUES (%s) ON CONFLICT DO NOTHING",
+                (version,),
+            )
+            done.append(os.path.basename(path))
+
+        return done
+    finally:
+        raw.driver_connection.autocommit = False
+        raw.close()
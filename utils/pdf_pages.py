@@ -0,0 +1,69 @@
+# pdf_pages.py
+# Description: Page-by-page rasterization of uploaded PDFs and images.
+#
+# convert_from_bytes renders every page of a document before returning, so a long scan holds
+# all of its full-resolution pages in memory at once. These helpers render a few pages at a
+# time and hand them out as they are produced.
+
+import os
+import shutil
+import tempfile
+
+from PIL import Image, ImageOps
+from pdf2image import convert_from_path, pdfinfo_from_path
+
+# Rendering resolution of PDF pages
+PDF_RENDER_DPI = int(os.getenv("PDF_RENDER_DPI", "200"))
+# Number of pages rendered per pdftoppm call
+PDF_RENDER_WINDOW = int(os.getenv("PDF_RENDER_WINDOW", "4"))
+# Threads pdf2image uses to render the pages of one window
+PDF_RENDER_THREADS = int(os.getenv("PDF_RENDER_THREADS", "2"))
+
+
+def iter_pdf_pages(file, dpi=None, window=None, thread_count=None):
+    """
+    Render an uploaded PDF one window of pages at a time.
+
+    The upload is spooled to a temporary file instead of being read into memory, and only
+    `window` rendered pages exist at any point besides those the caller still holds.
+
+    Args:
+        file (FileStorage): Uploaded PDF.
+        dpi (int, optional): Defaults to PDF_RENDER_DPI.
+        window (int, optional): Defaults to PDF_RENDER_WINDOW.
+        thread_count (int, optional): Defaults to PDF_RENDER_THREADS.
+
+    Yields:
+        PIL.Image.Image: each page, in order
+    """
+    dpi = dpi or PDF_RENDER_DPI
+    window = max(1, window or PDF_RENDER_WINDOW)
+    thread_count = max(1, thread_count or PDF_RENDER_THREADS)
+
+    with tempfile.NamedTemporaryFile(suffix=".pdf") as tmp:
+        file.seek(0)
+        shutil.copyfileobj(file.stream, tmp)
+        tmp.flush()
+
+        page_count = pdfinfo_from_path(tmp.name)["Pages"]
+
+        for first_page in range(1, page_count + 1, window):
+            last_page = min(first_page + window - 1, page_count)
+            pages = convert_from_path(
+                tmp.name,
+                dpi=dpi,
+                first_page=first_page,
+                last_page=last_page,
+                thread_count=min(thread_count, last_page - first_page + 1),
+            )
+
+            while pages:
+                yield pages.pop(0)
+
+
+def iter_uploaded_images(files):
+    """
+    Open uploaded image files one at a time as RGB pages.
+    """
+    for f in files:
+        yield ImageOps.exif_transpose(Image.open(f.stream)).convert("RGB")
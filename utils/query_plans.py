@@ -0,0 +1,114 @@
+# query_plans.py
+# Description: EXPLAIN-based check that the hot query shapes are served by an index.
+#
+# Each check builds the same statement the application runs and looks in its plan for a scan of
+# the queried table through the index meant for that shape. Sequential scans are disabled while
+# planning, so the check proves the index can serve the shape even on a small or empty database
+# where a sequential scan would be cheaper; a missing index shows up as a scan of another one,
+# usually the primary key. Run with `flask check-query-plans` after applying migrations.
+
+from sqlalchemy import select, func, text
+from sqlalchemy.dialects import postgresql
+
+from app.utils.table_models import Tests, ItemCurrent, ItemHistory, ItemTopics, ItemSkills, Requirements
+from app.utils.db_operations import _test_filter, select_user_items
+
+# Placeholder key values; plans do not depend on them once sequential scans are off
+_USER = _CLASS = _TEST = _ITEM = _REQ = "plan-check"
+
+
+def _test_items_in_order():
+    return (
+        select(Tests.item_id, Tests.order_number)
+        .where(*_test_filter(_USER, _CLASS, _TEST))
+        .order_by(func.coalesce(Tests.order_number, 0), Tests.item_id)
+    )
+
+
+def _items_by_name(link_table, id_column):
+    return (
+        select(id_column, link_table.item_id, link_table.version)
+        .where(link_table.user_id == _USER, link_table.class_id == _CLASS)
+        .order_by(id_column)
+    )
+
+
+def _requirement():
+    return select(Requirements.content).where(Requirements.user_id == _USER, Requirements.req_id == _REQ)
+
+
+def _newest_version():
+    return select(func.max(ItemHistory.version)).where(
+        ItemHistory.user_id == _USER, ItemHistory.class_id == _CLASS, ItemHistory.item_id == _ITEM
+    )
+
+
+def _newest_child():
+    return select(func.max(ItemHistory.version)).where(
+        ItemHistory.user_id == _USER,
+        ItemHistory.class_id == _CLASS,
+        ItemHistory.item_id == _ITEM,
+        ItemHistory.parent_version == 0,
+    )
+
+
+def _prune_queue():
+    return select(ItemCurrent.item_id).where(ItemCurrent.prune_pending).limit(200)
+
+
+# name: (queried table, index that must serve it, statement builder)
+HOT_QUERIES = {
+    "test items in rank order": ("tests", "tests_rank_idx", _test_items_in_order),
+    "user items page": ("tests", "tests_rank_idx", lambda: select_user_items(_USER, limit=200)),
+    "items by topic": (
+        "item_topics", "item_topics_topic_idx", lambda: _items_by_name(ItemTopics, ItemTopics.topic_id)
+    ),
+    "items by skill": (
+        "item_skills", "item_skills_skill_idx", lambda: _items_by_name(ItemSkills, ItemSkills.skill_id)
+    ),
+    "requirement by id": ("requirements", "requirements_user_req_idx", _requirement),
+    "newest item version": ("item_history", "item_history_pkey", _newest_version),
+    "newest child version": ("item_history", "item_history_parent_idx", _newest_child),
+    "prune queue": ("item_current", "item_current_prune_idx", _prune_queue),
+}
+
+
+def _scans(plan, relation):
+    """
+    (node type, index name) of every plan node that reads relation. Bitmap Index Scan nodes
+    carry no relation name, so they are kept too; their heap node above them has the relation.
+    """
+    found = []
+    if plan.get("Relation Name", relation) == relation and (
+        "Relation Name" in plan or "Index Name" in plan
+    ):
+        found.append((plan["Node Type"], plan.get("Index Name")))
+    for child in plan.get("Plans", ()):
+        found.extend(_scans(child, relation))
+    return found
+
+
+def check_query_plans(db_session):
+    """
+    EXPLAIN every query in HOT_QUERIES.
+
+    Returns:
+        List[Tuple[str, bool, List[str]]]: (query name, uses its expected index, scans of its
+        table) for each query
+    """
+    results = []
+    try:
+        db_session.execute(text("SET LOCAL enable_seqscan = off"))
+        for name, (relation, index, build) in HOT_QUERIES.items():
+            sql = build().compile(dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True})
+            plan = db_session.execute(text(f"EXPLAIN (FORMAT JSON) {sql}")).scalar_one()[0]["Plan"]
+            scans = _scans(plan, relation)
+            results.append((
+                name,
+                any(index_name == index for _, index_name in scans),
+                [f"{node} using {index_name}" if index_name else node for node, index_name in scans],
+            ))
+    finally:
+        db_session.rollback()
+
+    return results
@@ -0,0 +1,220 @@
+# requirement_index.py
+# Description: In-memory near-duplicate index over each user's saved requirements.
+#
+# Requirements are reduced to MinHash signatures of their word shingles and bucketed with
+# locality-sensitive hashing, so a duplicate check only compares a new requirement against the
+# few saved ones that share a bucket. Clear duplicates and clearly new requirements are decided
+# locally; only scores in between are sent to the model through compare_reqs.
+
+import hashlib
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import select
+
+from app.utils.table_models import Requirements
+from app.utils.compare_reqs import compare_reqs
+
+# Estimated Jaccard similarity at or above which a requirement is a duplicate
+REQUIREMENT_DUPLICATE_THRESHOLD = float(os.getenv("REQUIREMENT_DUPLICATE_THRESHOLD", "0.8"))
+# Below this similarity a requirement is new; scores in between are checked by the model
+REQUIREMENT_DISTINCT_THRESHOLD = float(os.getenv("REQUIREMENT_DISTINCT_THRESHOLD", "0.4"))
+# Seconds before a user's index picks up requirements saved by other worker processes
+REQUIREMENT_INDEX_REFRESH = float(os.getenv("REQUIREMENT_INDEX_REFRESH", "60"))
+# Users whose index is kept in memory
+REQUIREMENT_INDEX_MAX_USERS = int(os.getenv("REQUIREMENT_INDEX_MAX_USERS", "1000"))
+
+# Signature length and LSH banding: with 32 bands of 2 rows nearly every pair above ~0.4
+# similarity shares a bucket, while unrelated requirements rarely do
+NUM_PERM = 64
+BANDS = 32
+ROWS = NUM_PERM // BANDS
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+_PERMUTATIONS = [
+    (
+        int.from_bytes(hashlib.blake2b(f"a{i}".encode(), digest_size=8).digest(), "big") % (_MERSENNE_PRIME - 1) + 1,
+        int.from_bytes(hashlib.blake2b(f"b{i}".encode(), digest_size=8).digest(), "big") % _MERSENNE_PRIME,
+    )
+    for i in range(NUM_PERM)
+]
+
+_WORD = re.compile(r"[a-z0-9]+")
+
+
+def _shingles(content):
+    """Word 3-grams of the normalized text (single words for very short texts)."""
+    words = _WORD.findall((content or "").lower())
+    if len(words) < 3:
+        return set(words)
+    return {" ".join(words[i:i + 3]) for i in range(len(words) - 2)}
+
+
+def minhash(content):
+    """
+    Returns:
+        Tuple[int, ...]: NUM_PERM-long MinHash signature of the text, or None for empty text
+    """
+    shingles = _shingles(content)
+    if not shingles:
+        return None
+
+    hashes = [
+        int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=4).digest(), "big")
+        for shingle in shingles
+    ]
+    return tuple(
+        min(((a * h + b) % _MERSENNE_PRIME) & _MAX_HASH for h in hashes)
+        for a, b in _PERMUTATIONS
+    )
+
+
+def similarity(signature_a, signature_b):
+    """Estimated Jaccard similarity of the texts behind two signatures."""
+    return sum(x == y for x, y in zip(signature_a, signature_b)) / NUM_PERM
+
+
+def _bands(signature):
+    return [(band, signature[band * ROWS:(band + 1) * ROWS]) for band in range(BANDS)]
+
+
+class _UserIndex:
+    def __init__(self):
+        self.signatures = {}
+        self.buckets = {}
+        # None until the first load from the database
+        self.refreshed_at = None
+
+    def add(self, req_id, signature):
+        if req_id in self.signatures or signature is None:
+            return
+        self.signatures[req_id] = signature
+        for key in _bands(signature):
+            self.buckets.setdefault(key, []).append(req_id)
+
+    def remove(self, req_id):
+        signature = self.signatures.pop(req_id, None)
+        if signature is None:
+            return
+        for key in _bands(signature):
+            bucket = self.buckets.get(key)
+            if bucket is not None:
+                bucket.remove(req_id)
+                if not bucket:
+                    del self.buckets[key]
+
+    def best_match(self, signature):
+        candidates = {req_id for key in _bands(signature) for req_id in self.buckets.get(key, ())}
+        return max(
+            ((similarity(signature, self.signatures[req_id]), req_id) for req_id in candidates),
+            default=(0.0, None),
+        )
+
+
+class RequirementIndex:
+    """
+    Per-process, per-user MinHash/LSH index over Requirements.content.
+
+    A user's index is built from the database on first use and then kept current by add() for
+    requirements saved in this process, plus a periodic read of the user's requirement ids that
+    picks up ones saved by other processes and drops deleted ones. Only the content of ids not
+    seen yet is fetched.
+    """
+
+    def __init__(self, max_users=None, refresh=None):
+        self.max_users = max_users or REQUIREMENT_INDEX_MAX_USERS
+        self.refresh = REQUIREMENT_INDEX_REFRESH if refresh is None else refresh
+        self._users = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _index(self, db_session, user_id):
+        with self._lock:
+            index = self._users.get(user_id)
+            if index is None:
+                index = self._users[user_id] = _UserIndex()
+            self._users.move_to_end(user_id)
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+
+            if index.refreshed_at is not None and time.monotonic() - index.refreshed_at < self.refresh:
+                return index
+
+            # Mark as refreshed first so concurrent checks do not all query
+            index.refreshed_at = time.monotonic()
+            known = set(index.signatures)
+
+        saved = db_session.execute(
+            select(Requirements.req_id).where(Requirements.user_id == user_id)
+        ).scalars().all()
+        new_ids = [req_id for req_id in saved if req_id not in known]
+        deleted_ids = known.difference(saved)
+
+        if new_ids:
+            rows = db_session.execute(
+                select(Requirements.req_id, Requirements.content).where(
+                    Requirements.user_id == user_id, Requirements.req_id.in_(new_ids)
+                )
+            ).all()
+            signatures = [(req_id, minhash(content)) for req_id, content in rows]
+            with self._lock:
+                for req_id, signature in signatures:
+                    index.add(req_id, signature)
+
+        if deleted_ids:
+            with self._lock:
+                for req_id in deleted_ids:
+                    index.remove(req_id)
+
+        return index
+
+    def best_match(self, db_session, user_id, content):
+        """
+        Returns:
+            Tuple[float, Optional[str]]: highest estimated similarity between content and a saved
+            requirement of the user among the LSH candidates, and that requirement's id;
+            (0.0, None) when there is none
+        """
+        signature = minhash(content)
+        if signature is None:
+            return 0.0, None
+
+        index = self._index(db_session, user_id)
+        with self._lock:
+            return index.best_match(signature)
+
+    def add(self, user_id, req_id, content):
+        """Index a requirement this process just saved."""
+        signature = minhash(content)
+        with self._lock:
+            index = self._users.get(user_id)
+            if index is not None:
+                index.add(req_id, signature)
+
+
+requirement_index = RequirementIndex()
+
+
+def find_duplicate_requirement(db, user_id, content):
+    """
+    Find the saved requirement of the user that content repeats.
+
+    Scores at or above REQUIREMENT_DUPLICATE_THRESHOLD are duplicates and scores below
+    REQUIREMENT_DISTINCT_THRESHOLD are new without calling the model; anything in between is
+    left to compare_reqs, and the closest candidate is taken as the match when it agrees.
+
+    Returns:
+        Optional[str]: req_id of the duplicate, None when content is new
+    """
+    score, req_id = requirement_index.best_match(db.session, user_id, content)
+    if score >= REQUIREMENT_DUPLICATE_THRESHOLD:
+        return req_id
+    if score < REQUIREMENT_DISTINCT_THRESHOLD:
+        return None
+
+    if compare_reqs(db, user_id, content) == '{"requirementCheck":"False"}':
+        return None
+    return req_id
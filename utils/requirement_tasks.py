@@ -0,0 +1,53 @@
+# requirement_tasks.py
+# Description: Requirement bookkeeping run by the task queue after the response is sent.
+
+from app import db
+from app.utils.db_operations import (
+    add_requirement_to_database,
+    claim_requirement_capture,
+    increment_requirement_usage,
+)
+from app.utils.requirement_index import find_duplicate_requirement, requirement_index
+from app.utils.task_queue import task_queue
+
+
+@task_queue.task("capture_requirement")
+def capture_requirement(user_id, class_id, test_id, item_id, req_id, content, content_type, check_content=None):
+    """
+    Save a requirement the user just expressed, unless they already have an equivalent one, in
+    which case that one's usage count goes up instead.
+
+    req_id is generated once by the route, so it also keys the capture: a retry of a run that
+    already committed finds its claim and does nothing.
+
+    Args:
+        content (str): Requirement text to save.
+        content_type (Dict[str, bool]): The tags this requirement is generated for.
+        check_content (str, optional): Text compared against saved requirements, when it differs
+            from content.
+    """
+    duplicate_id = find_duplicate_requirement(db, user_id, check_content or content)
+
+    if not claim_requirement_capture(db.session, user_id, req_id):
+        db.session.rollback()
+        return
+
+    if duplicate_id is not None:
+        increment_requirement_usage(db.session, user_id, duplicate_id)
+        db.session.commit()
+        return
+
+    add_requirement_to_database(
+        db.session,
+        user_id=user_id,
+        class_id=class_id,
+        test_id=test_id,
+        item_id=item_id,
+        req_id=req_id,
+        version=0,
+        content=content,
+        usage_count=1,
+        application_count=1,
+        contentType=content_type,
+    )
+    requirement_index.add(user_id, req_id, content)
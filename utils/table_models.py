@@ -28,24 +28,46 @@ class UserTests(db.Model):
 
 class ItemCurrent(db.Model):
     __tablename__ = 'item_current'
+    __table_args__ = (
+        db.Index('item_current_prune_idx', 'user_id', 'class_id', 'item_id',
+                 postgresql_where=db.text('prune_pending')),
+    )
 
     user_id = db.Column(db.String(255), primary_key=True)
     class_id = db.Column(db.String(255), primary_key=True)
     item_id = db.Column(db.String(255), primary_key=True)
+    # Version the item currently shows; undo and redo only move this pointer
     version = db.Column(db.Integer)
+    # Highest version ever written, so a new edit never reuses an undone version's number
+    latest_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # Set when an edit abandons a branch of undone versions, cleared by prune_item_branches
+    prune_pending = db.Column(db.Boolean, nullable=False, default=False, server_default='false')
 
 class ItemHistory(db.Model):
     __tablename__ = 'item_history'
+    __table_args__ = (
+        db.Index('item_history_parent_idx', 'user_id', 'class_id', 'item_id', 'parent_version', 'version'),
+        db.Index('item_history_full_idx', 'user_id', 'class_id', 'item_id', 'version',
+                 postgresql_where=db.text("storage = 'full'")),
+    )
 
     user_id = db.Column(db.String(255), primary_key=True)
     class_id = db.Column(db.String(255), primary_key=True)
     item_id = db.Column(db.String(255), primary_key=True)
     version = db.Column(db.Integer, primary_key=True)
+    # Version this one was edited from; None for the first version
+    parent_version = db.Column(db.Integer, nullable=True)
     question_part = db.Column(db.Text)
     answer_part = db.Column(db.Text)
     format = db.Column(db.String(255))
     difficulty = db.Column(db.String(50))
     wrong_answer_explanation = db.Column(db.Text)
+    # "full" rows keep their text in the columns above; "packed" and "delta" rows keep it
+    # compressed in payload (see version_store.py)
+    storage = db.Column(db.String(16), nullable=False, default='full', server_default='full')
+    base_version = db.Column(db.Integer, nullable=True)
+    delta_depth = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    payload = db.Column(db.LargeBinary, nullable=True)
         
 class Tests(db.Model):
     __tablename__ = 'tests'
@@ -55,27 +77,70 @@ class Tests(db.Model):
     test_id = db.Column(db.String(255), primary_key=True)
     item_id = db.Column(db.String(255), primary_key=True)
     order_number = db.Column(db.Integer, nullable=True)
+
+# Rank order of a test, and of all of a user's tests; queries sort on the same expression
+db.Index(
+    'tests_rank_idx',
+    Tests.user_id, Tests.class_id, Tests.test_id, db.func.coalesce(Tests.order_number, 0), Tests.item_id,
+)
     
+class TestOrderCounters(db.Model):
+    __tablename__ = 'test_order_counters'
+    user_id = db.Column(db.String(255), primary_key=True)
+    class_id = db.Column(db.String(255), primary_key=True)
+    test_id = db.Column(db.String(255), primary_key=True)
+    next_order = db.Column(db.Integer, nullable=False)
+
+class ClassIdCounters(db.Model):
+    __tablename__ = 'class_id_counters'
+    user_id = db.Column(db.String(255), primary_key=True)
+    class_id = db.Column(db.String(255), primary_key=True)
+    kind = db.Column(db.String(50), primary_key=True)
+    next_id = db.Column(db.Integer, nullable=False)
+
+class Topics(db.Model):
+    __tablename__ = 'topics'
+    __table_args__ = (db.UniqueConstraint('user_id', 'class_id', 'name'),)
+    user_id = db.Column(db.String(255), primary_key=True)
+    class_id = db.Column(db.String(255), primary_key=True)
+    topic_id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(255), nullable=False)
+
+class Skills(db.Model):
+    __tablename__ = 'skills'
+    __table_args__ = (db.UniqueConstraint('user_id', 'class_id', 'name'),)
+    user_id = db.Column(db.String(255), primary_key=True)
+    class_id = db.Column(db.String(255), primary_key=True)
+    skill_id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(255), nullable=False)
+
 class ItemTopics(db.Model):
     __tablename__ = 'item_topics'
+    __table_args__ = (
+        db.Index('item_topics_topic_idx', 'user_id', 'class_id', 'topic_id',
+                 postgresql_include=['item_id', 'version']),
+    )
     user_id = db.Column(db.String(255), primary_key=True)
     class_id = db.Column(db.String(255), primary_key=True)
     item_id = db.Column(db.String(255), primary_key=True)
     version = db.Column(db.Integer, primary_key=True)
-    topic_id = db.Column(db.String(255), primary_key=True)
-    topic_name = db.Column(db.String(255))
+    topic_id = db.Column(db.Integer, primary_key=True)
 
 class ItemSkills(db.Model):
     __tablename__ = 'item_skills'
+    __table_args__ = (
+        db.Index('item_skills_skill_idx', 'user_id', 'class_id', 'skill_id',
+                 postgresql_include=['item_id', 'version']),
+    )
     user_id = db.Column(db.String(255), primary_key=True)
     class_id = db.Column(db.String(255), primary_key=True)
     item_id = db.Column(db.String(255), primary_key=True)
     version = db.Column(db.Integer, primary_key=True)
-    skill_id = db.Column(db.String(255), primary_key=True)
-    skill_name = db.Column(db.String(255))
+    skill_id = db.Column(db.Integer, primary_key=True)
     
 class Requirements(db.Model):
     __tablename__ = 'requirements'
+    __table_args__ = (db.Index('requirements_user_req_idx', 'user_id', 'req_id'),)
     user_id = db.Column(db.String(255), primary_key=True)
     class_id = db.Column(db.String(255), primary_key=True)
     test_id = db.Column(db.String(255), primary_key=True)
@@ -103,4 +168,15 @@ class Requirements(db.Model):
             "explanation": self.wrong_answer_explanation,
             "topics": self.topics,
             "skills": self.skills
-        }
\ No newline at end of file
+        }
+
+class RequirementCaptures(db.Model):
+    __tablename__ = 'requirement_captures'
+    user_id = db.Column(db.String(255), primary_key=True)
+    capture_id = db.Column(db.String(255), primary_key=True)
+    captured_at = db.Column(db.DateTime(timezone=True), nullable=False, server_default=db.func.now())
+
+class SyllabusPageText(db.Model):
+    __tablename__ = 'syllabus_page_text'
+    page_hash = db.Column(db.String(64), primary_key=True)
+    page_text = db.Column(db.Text)
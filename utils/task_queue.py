@@ -0,0 +1,186 @@
+# task_queue.py
+# Description: In-process queue for work that can run after the response is sent.
+#
+# Usage mirrors flask_sqlalchemy: create_app calls task_queue.init_app(app), modules register
+# handlers with @task_queue.task("name"), and routes call task_queue.enqueue("name", **kwargs).
+# Every task is written to a SQLite spool on local disk before it is queued, so tasks left
+# behind by a restart or a crashed worker are picked up again by any worker on the host. A
+# separate thread rescans the spool every poll_interval seconds, so due retries are queued
+# even while the workers never run out of work.
+
+import json
+import os
+import queue
+import threading
+import time
+import traceback
+
+from app.utils.local_store import LocalSQLite
+
+STATUS_PENDING = "pending"
+STATUS_RUNNING = "running"
+STATUS_FAILED = "failed"
+
+
+class TaskQueue:
+    """
+    Durable background task queue with a few worker threads per process.
+
+    A task is claimed with a conditional UPDATE on its spool row, so each task runs once even
+    though every worker process on the host polls the same file. Failed tasks are retried with
+    exponential backoff up to max_attempts times and then kept as "failed" for inspection.
+    """
+
+    def __init__(self, app=None):
+        self.workers = 1
+        self.max_attempts = 5
+        self.lease = 300.0
+        self.poll_interval = 5.0
+
+        self.app = None
+        self._handlers = {}
+        self._spool = None
+        self._queue = None
+        self._queued = set()
+        self._pid = None
+        self._lock = threading.Lock()
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.workers = app.config.get("TASK_WORKERS", self.workers)
+        self.max_attempts = app.config.get("TASK_MAX_ATTEMPTS", self.max_attempts)
+        self.lease = app.config.get("TASK_LEASE_SECONDS", self.lease)
+        self.poll_interval = app.config.get("TASK_POLL_INTERVAL", self.poll_interval)
+
+        self.app = app
+        self._spool = LocalSQLite(
+            app.config.get("TASK_SPOOL_PATH", os.path.join(app.instance_path, "task_spool.sqlite3")),
+            schema=(
+                "CREATE TABLE IF NOT EXISTS tasks ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL, payload TEXT NOT NULL, "
+                "status TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, run_after REAL NOT NULL, "
+                "claimed_at REAL, error TEXT)",
+                "CREATE INDEX IF NOT EXISTS tasks_status_run_after ON tasks (status, run_after)",
+            ),
+        )
+
+        # Workers are started lazily in each process, never in a parent that is about to fork
+        app.before_request(self._ensure_workers)
+        app.extensions["task_queue"] = self
+
+    def task(self, name):
+        """Register the decorated function as the handler of tasks called name."""
+        def decorator(func):
+            self._handlers[name] = func
+            return func
+        return decorator
+
+    def enqueue(self, name, **kwargs):
+        """
+        Spool a task and hand it to this process's workers.
+
+        kwargs must be JSON-serializable; the handler is called with them inside an app context.
+        """
+        if name not in self._handlers:
+            raise ValueError(f"No handler registered for task {name}")
+
+        conn = self._spool.connection()
+        task_id = conn.execute(
+            "INSERT INTO tasks (name, payload, status, run_after) VALUES (?, ?, ?, ?)",
+            (name, json.dumps(kwargs), STATUS_PENDING, time.time()),
+        ).lastrowid
+
+        self._ensure_workers()
+        self._put(task_id)
+        return task_id
+
+    def _put(self, task_id):
+        """Queue a task id unless it is already waiting in this process's queue."""
+        with self._lock:
+            if task_id in self._queued:
+                return
+            self._queued.add(task_id)
+        self._queue.put(task_id)
+
+    def _ensure_workers(self):
+        if self._pid == os.getpid():
+            return
+
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+
+            self._queue = queue.Queue()
+            self._queued = set()
+            for i in range(max(1, self.workers)):
+                threading.Thread(target=self._work, name=f"task-worker-{i}", daemon=True).start()
+            threading.Thread(target=self._poll, name="task-poller", daemon=True).start()
+            self._pid = os.getpid()
+
+    def _work(self):
+        while True:
+            task_id = self._queue.get()
+            with self._lock:
+                self._queued.discard(task_id)
+
+            try:
+                self._run(task_id)
+            except Exception:
+                traceback.print_exc()
+
+    def _poll(self):
+        while True:
+            time.sleep(self.poll_interval)
+            try:
+                self._requeue_spooled()
+            except Exception:
+                traceback.print_exc()
+
+    def _requeue_spooled(self):
+        """Queue due tasks from the spool: retries, and tasks of processes that went away."""
+        conn = self._spool.connection()
+        now = time.time()
+        conn.execute(
+            "UPDATE tasks SET status = ? WHERE status = ? AND claimed_at < ?",
+            (STATUS_PENDING, STATUS_RUNNING, now - self.lease),
+        )
+        due = conn.execute(
+            "SELECT id FROM tasks WHERE status = ? AND run_after <= ? ORDER BY id LIMIT 100",
+            (STATUS_PENDING, now),
+        ).fetchall()
+        for (task_id,) in due:
+            self._put(task_id)
+
+    def _run(self, task_id):
+        conn = self._spool.connection()
+        now = time.time()
+        claimed = conn.execute(
+            "UPDATE tasks SET status = ?, claimed_at = ? WHERE id = ? AND status = ? AND run_after <= ?",
+            (STATUS_RUNNING, now, task_id, STATUS_PENDING, now),
+        ).rowcount
+        if not claimed:
+            return
+
+        name, payload, attempts = conn.execute(
+            "SELECT name, payload, attempts FROM tasks WHERE id = ?", (task_id,)
+        ).fetchone()
+
+        try:
+            with self.app.app_context():
+                self._handlers[name](**json.loads(payload))
+        except Exception as e:
+            attempts += 1
+            status = STATUS_FAILED if attempts >= self.max_attempts else STATUS_PENDING
+            conn.execute(
+                "UPDATE tasks SET status = ?, attempts = ?, run_after = ?, error = ? WHERE id = ?",
+                (status, attempts, time.time() + 2 ** attempts, f"{type(e).__name__}: {e}", task_id),
+            )
+            print(f"Task {name} ({task_id}) failed, attempt {attempts}: {e}")
+            return
+
+        conn.execute("DELETE FROM tasks WHERE id = ?", (task_id,))
+
+
+task_queue = TaskQueue()
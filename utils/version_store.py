@@ -0,0 +1,108 @@
+# version_store.py
+# Description: Compact encodings of item_history versions.
+#
+# Every row starts out as "full" (plain text columns). Once a version is no longer current, the
+# compaction job rewrites it as either a "delta" (compressed edit script against its parent
+# version) or, every ITEM_KEYFRAME_INTERVAL steps along a chain, a "packed" keyframe (compressed
+# snapshot). Reading a delta walks back to the nearest keyframe or full row and replays the chain.
+
+import difflib
+import json
+import os
+import zlib
+
+# Text fields that are stored in a payload once a version is compacted.
+# format and difficulty are a few bytes and always stay in their columns.
+VERSION_FIELDS = ("question_part", "answer_part", "wrong_answer_explanation")
+
+# Longest chain of deltas between two keyframes
+ITEM_KEYFRAME_INTERVAL = int(os.getenv("ITEM_KEYFRAME_INTERVAL", "8"))
+
+STORAGE_FULL = "full"
+STORAGE_PACKED = "packed"
+STORAGE_DELTA = "delta"
+
+
+def pack_fields(fields):
+    """Compress a snapshot of the text fields of one version."""
+    snapshot = {name: fields.get(name) for name in VERSION_FIELDS}
+    return zlib.compress(json.dumps(snapshot, separators=(",", ":")).encode("utf-8"), 9)
+
+
+def unpack_fields(payload):
+    return json.loads(zlib.decompress(payload).decode("utf-8"))
+
+
+def _edit_script(base, target):
+    """
+    Describe target as a list of [start, end] ranges copied from base and literal strings.
+    """
+    if target is None:
+        return None
+
+    base = base or ""
+    script = []
+    matcher = difflib.SequenceMatcher(None, base, target, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            script.append([i1, i2])
+        elif j2 > j1:
+            script.append(target[j1:j2])
+
+    return script
+
+
+def _replay(base, script):
+    if script is None:
+        return None
+
+    base = base or ""
+    return "".join(base[op[0]:op[1]] if isinstance(op, list) else op for op in script)
+
+
+def diff_fields(base_fields, fields):
+    """Compress the edit scripts that turn base_fields into fields."""
+    scripts = {name: _edit_script(base_fields.get(name), fields.get(name)) for name in VERSION_FIELDS}
+    return zlib.compress(json.dumps(scripts, separators=(",", ":")).encode("utf-8"), 9)
+
+
+def apply_delta(base_fields, payload):
+    scripts = json.loads(zlib.decompress(payload).decode("utf-8"))
+    return {name: _replay(base_fields.get(name), scripts.get(name)) for name in VERSION_FIELDS}
+
+
+def encode_version(fields, base_version=None, base_fields=None, base_depth=None, keyframe_interval=None):
+    """
+    Choose the compact encoding of a version that is no longer current.
+
+    The version becomes a delta against base_version unless that would make its chain
+    keyframe_interval long, or the delta is not smaller than a keyframe.
+
+    Args:
+        fields (dict): Text fields of the version.
+        base_version (int, optional): Version the delta would be taken against, None for none.
+        base_fields (dict, optional): Text fields of base_version.
+        base_depth (int, optional): delta_depth of base_version.
+
+    Returns:
+        dict: storage, base_version, delta_depth and payload column values
+    """
+    keyframe_interval = keyframe_interval or ITEM_KEYFRAME_INTERVAL
+    packed = pack_fields(fields)
+
+    if base_version is not None and base_fields is not None and base_depth + 1 < keyframe_interval:
+        delta = diff_fields(base_fields, fields)
+        if len(delta) < len(packed):
+            return {
+                "storage": STORAGE_DELTA,
+                "base_version": base_version,
+                "delta_depth": base_depth + 1,
+                "payload": delta,
+            }
+
+    return {
+        "storage": STORAGE_PACKED,
+        "base_version": None,
+        "delta_depth": 0,
+        "payload": packed,
+    }